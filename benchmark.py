@@ -0,0 +1,358 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from decode_adblock import AdblockRuleDecoder
+from generate_list import LineParser, filter_lines, write_clash_payload, generate_adguard_home_list
+from lookup import LookupIndex
+from regex_set import RegexSet, verify_equivalence
+from external_sort import ExternalSorter
+
+# 性能基准：用固定种子生成的规则集测量各个解析、转换与输出函数的吞吐量和内存峰值
+# 用法: python benchmark.py --sizes 10000 100000 --save-baseline baseline.json
+#       python benchmark.py --baseline baseline.json --tolerance 0.2
+#       python benchmark.py --suite convert --sizes 10000 100000
+#       python benchmark.py --suite parse --sizes 200000 --workers 1 2 4
+#       python benchmark.py --suite regex --sizes 1000 5000
+#       python benchmark.py --suite lookup --sizes 1000000
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+DEFAULT_CONVERT_SIZES = [10000, 20000, 50000, 100000]
+DEFAULT_WORKERS = [1, 2, 4]
+DEFAULT_REGEX_SIZES = [1000, 5000]
+# regex 基准中每轮匹配的请求 URL 数量
+REGEX_QUERY_COUNT = 20000
+DEFAULT_LOOKUP_SIZES = [1000000]
+# lookup_many 的目标吞吐量（次/秒）
+LOOKUP_TARGET_RATE = 1000000
+# 与基准相比吞吐量下降或内存峰值上升超过该比例即视为性能回退
+DEFAULT_TOLERANCE = 0.2
+
+def make_ruleset(count, seed=0):
+    # 生成与 decode_*_rule 输出结构相同的规则，约 1/4 为重复域名以覆盖去重路径
+    rng = random.Random(seed)
+    prefers = ['HOST-SUFFIX', 'HOST', 'HOST-SUFFIX', 'HOST-KEYWORD', 'REGEX']
+    actions = ['REJECT', 'REJECT', 'REJECT', 'DIRECT']
+    unique = max(1, count * 3 // 4)
+    ruleset = []
+    for _ in range(count):
+        domain = f'ads{rng.randrange(unique)}.example{rng.randrange(100)}.com'
+        prefer = rng.choice(prefers)
+        ruleset.append({
+            'domain': domain if prefer != 'REGEX' else '',
+            'regex': '^ads[0-9]+\\.' + domain.split('.', 1)[1].replace('.', '\\.') if prefer == 'REGEX' else None,
+            'prefer': prefer,
+            'action': rng.choice(actions),
+        })
+    return ruleset
+
+def make_adblock_lines(count, seed=0):
+    # AdBlock 列表中常见的几种写法，按大致比例混合
+    rng = random.Random(seed)
+    templates = ['||ads{}.example{}.com^', '||ads{}.example{}.com^', 'track{}.site{}.net', '@@||cdn{}.example{}.org^',
+                 '||img{}.example{}.com^$third-party', '/banner{}/*{}', '! comment {} {}', 'example{}.com##.ad{}']
+    return [rng.choice(templates).format(rng.randrange(count), rng.randrange(100)) for _ in range(count)]
+
+def make_hosts_lines(count, seed=0):
+    # hosts 文件：注释、空行、不同的 IP 与空白写法、行尾注释
+    rng = random.Random(seed)
+    templates = ['0.0.0.0 ads{}.example{}.com', '127.0.0.1\ttrack{}.site{}.net', '0.0.0.0 cdn{}.example{}.org # ad',
+                 '# comment {} {}', '', '::1 ip6-{}.example{}.com', '  0.0.0.0   img{}.example{}.com']
+    return [rng.choice(templates).format(rng.randrange(count), rng.randrange(100)) for _ in range(count)]
+
+def make_gfwlist_text(count, seed=0):
+    # gfwlist：AutoProxy 格式的规则整体 base64 编码
+    rng = random.Random(seed)
+    templates = ['||site{}.example{}.com', '|http://site{}.example{}.net/', '.site{}.example{}.org', '@@||cdn{}.example{}.com',
+                 '/^https?:\\/\\/[^\\/]+site{}\\.example{}\\.com/', '! comment {} {}', 'site{}.example{}.com']
+    lines = ['[AutoProxy 0.2.9]'] + [rng.choice(templates).format(rng.randrange(count), rng.randrange(100)) for _ in range(count - 1)]
+    return base64.b64encode('\n'.join(lines).encode('utf-8')).decode('ascii')
+
+def make_query_names(count, seed=0):
+    # DNS 查询日志：一半与 make_adblock_lines 生成的规则同名或为其子域名，一半为无关域名
+    rng = random.Random(seed)
+    names = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            names.append(f'{rng.choice(["www.", "img.", ""])}ads{rng.randrange(count)}.example{rng.randrange(100)}.com')
+        else:
+            names.append(f'host{rng.randrange(count)}.site{rng.randrange(1000)}.net')
+    return names
+
+def make_surge_rules_text(count, seed=0):
+    # make_full_rule 的 surge-like-rules 输入，约 1/4 重复以覆盖 minify
+    rng = random.Random(seed)
+    prefers = ['HOST-SUFFIX', 'HOST', 'HOST-KEYWORD']
+    actions = ['REJECT', 'DIRECT', 'PROXY']
+    unique = max(1, count * 3 // 4)
+    return '\n'.join(f'{rng.choice(prefers)},ads{rng.randrange(unique)}.example.com,{rng.choice(actions)}' for _ in range(count))
+
+def make_regex_lines(count, seed=0):
+    # 解码后为 REGEX 规则的 AdBlock 写法：带路径的域名规则、URL 前缀、通配符与原生正则
+    rng = random.Random(seed)
+    templates = ['||ads{}.example{}.com/banner^', '|https://track{}.site{}.net/*pixel', '/ad{}/*{}.js',
+                 '/^https?:\\/\\/img{}\\.example{}\\.com\\//', '||cdn{}.example{}.org/*/ads/', '/(popup|promo){}[0-9]+x{}/']
+    return [rng.choice(templates).format(rng.randrange(count // 10 + 1), rng.randrange(10)) for _ in range(count)]
+
+def make_request_urls(count, rule_count, seed=0):
+    # 请求 URL：约 1/4 与 make_regex_lines(rule_count) 生成的规则使用相同的编号范围，其余为无关地址
+    rng = random.Random(seed)
+    urls = []
+    for _ in range(count):
+        n = rng.randrange(rule_count // 10 + 1)
+        m = rng.randrange(10)
+        if rng.random() < 0.25:
+            urls.append(rng.choice([f'https://www.ads{n}.example{m}.com/banner?id=1', f'https://track{n}.site{m}.net/v1/pixel.gif',
+                                    f'http://img{n}.example{m}.com/a.png', f'https://cdn{n}.example{m}.org/x/ads/1.js',
+                                    f'https://static.example.com/ad{n}/v2/{m}.js', f'https://example.com/promo{n}123x{m}.png']))
+        else:
+            urls.append(f'https://host{n}.site{rng.randrange(1000)}.net/static/{m}/app.js')
+    return urls
+
+def time_call(func, *args, repeat=3):
+    # 取多次运行中的最短时间，减少调度抖动的影响
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def emit_all(decoder, ruleset):
+    # 单次遍历写出全部目标
+    clash_files = {}
+    targets = {name: io.StringIO() for name in ('unbound_rejection', 'unbound_forward', 'quantumult_hosts', 'quantumult_regex', 'adguard')}
+    targets['clash'] = lambda action_name: clash_files.setdefault(action_name, io.StringIO())
+    return decoder.emit_rules(ruleset, targets)
+
+def external_sort(items, memory_budget):
+    # 按内存预算分段排序后归并，返回去重后的条目数
+    with ExternalSorter(memory_budget) as sorter:
+        sorter.update(items)
+        return sum(1 for _ in sorter)
+
+def quiet(func, *args):
+    # 屏蔽输出函数自带的 Generated ... 提示
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+def benchmark_cases(size):
+    # 返回 [(名称, 处理的行数, 函数)]，输入由固定种子生成，每个函数处理约 size 行
+    adblock_rule = {'type': 'adblock', 'exclude_action': 'IGNORE'}
+    adblock_lines = make_adblock_lines(size)
+    adblock_text = '\n'.join(adblock_lines)
+    hosts_text = '\n'.join(make_hosts_lines(size))
+    gfwlist_text = make_gfwlist_text(size)
+    ruleset = make_ruleset(size)
+    full_rule_parts = [
+        {'type': 'base', 'rules_text': ['port: 7890']},
+        {'type': 'surge-like-rules', 'minify': True, 'action_replace': {'REJECT': 'AdBlock'},
+         'rules_text': [make_surge_rules_text(size), 'FINAL,DIRECT']},
+    ]
+    domains = filter_lines(adblock_lines, adblock_rule)
+    lookup_index = LookupIndex()
+    lookup_index.add_list(domains, 'benchmark')
+    query_names = make_query_names(size)
+    decoder = AdblockRuleDecoder()
+    return [
+        ('filter_lines', size, lambda: filter_lines(adblock_lines, adblock_rule)),
+        # 解码器带有按行的解析缓存，每次使用新的实例，避免重复运行时全部命中缓存
+        ('decode_adblock_rule', size, lambda: AdblockRuleDecoder().decode_adblock_rule(adblock_text)),
+        ('decode_hosts_rule', size, lambda: AdblockRuleDecoder().decode_hosts_rule(hosts_text)),
+        ('decode_gfwlist_rule', size, lambda: AdblockRuleDecoder().decode_gfwlist_rule(gfwlist_text)),
+        ('convert_rule_to_unbound', size, lambda: decoder.convert_rule_to_unbound(ruleset)),
+        ('convert_rule_to_quantumult', size, lambda: decoder.convert_rule_to_quantumult(ruleset)),
+        ('convert_rule_to_clash', size, lambda: decoder.convert_rule_to_clash(ruleset)),
+        ('make_full_rule', size, lambda: decoder.make_full_rule(full_rule_parts, 'clash')),
+        ('write_clash_payload', len(domains), lambda: write_clash_payload(io.StringIO(), domains)),
+        ('generate_adguard_home_list', len(domains), lambda: quiet(generate_adguard_home_list, adblock_rule, domains, 'benchmark.conf')),
+        ('lookup_many', size, lambda: lookup_index.lookup_many(query_names)),
+        # 1 MiB 预算，规则数较多时会写出多个有序段再归并
+        ('external_sort', len(domains), lambda: external_sort(domains, 1 << 20)),
+    ]
+
+def measure_peak(func):
+    # tracemalloc 会拖慢运行，内存峰值单独运行一次测量
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_all(sizes, repeat=3, cases=None):
+    # 返回 {'名称@行数': {'lines', 'seconds', 'lines_per_second', 'peak_bytes'}}
+    results = {}
+    print(f"{'case':<28}{'lines':>10}{'seconds':>10}{'lines/s':>14}{'peak MiB':>10}")
+    # generate_adguard_home_list 写入当前目录下的 generated_rules，在临时目录中运行
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(os.path.join(work_dir, 'generated_rules'))
+        os.chdir(work_dir)
+        try:
+            for size in sizes:
+                for name, lines, func in benchmark_cases(size):
+                    if cases and name not in cases:
+                        continue
+                    elapsed = time_call(func, repeat=repeat)
+                    peak = measure_peak(func)
+                    result = {
+                        'lines': lines,
+                        'seconds': elapsed,
+                        'lines_per_second': lines / elapsed if elapsed > 0 else 0.0,
+                        'peak_bytes': peak,
+                    }
+                    results[f'{name}@{size}'] = result
+                    print(f"{name:<28}{lines:>10}{elapsed:>10.3f}{result['lines_per_second']:>14,.0f}{peak / 2 ** 20:>10.1f}", flush=True)
+        finally:
+            os.chdir(cwd)
+    return results
+
+def compare_baseline(results, baseline, tolerance):
+    # 返回性能回退的描述列表；基准中没有的用例不比较
+    failures = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if result['lines_per_second'] < base['lines_per_second'] * (1 - tolerance):
+            failures.append(f"{key}: {result['lines_per_second']:,.0f} lines/s, baseline {base['lines_per_second']:,.0f} lines/s")
+        if result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance):
+            failures.append(f"{key}: peak {result['peak_bytes']:,} bytes, baseline {base['peak_bytes']:,} bytes")
+    return failures
+
+def bench_convert(sizes, repeat=3):
+    # 每条规则的平均耗时应大致保持不变，即转换时间随规则数线性增长
+    decoder = AdblockRuleDecoder()
+    converters = {
+        'unbound': decoder.convert_rule_to_unbound,
+        'quantumult': decoder.convert_rule_to_quantumult,
+        'clash': decoder.convert_rule_to_clash,
+        'emit_all': lambda ruleset: emit_all(decoder, ruleset),
+    }
+    print(f"{'converter':<12}{'rules':>10}{'seconds':>12}{'us/rule':>10}")
+    for name, func in converters.items():
+        for size in sizes:
+            ruleset = make_ruleset(size)
+            elapsed = time_call(func, ruleset, repeat=repeat)
+            print(f"{name:<12}{size:>10}{elapsed:>12.4f}{elapsed / size * 1e6:>10.3f}")
+
+def bench_parse(sizes, workers_list, repeat=3):
+    # 多进程解析：对比不同进程数的耗时，并确认结果与单进程一致
+    print(f"{'parser':<12}{'lines':>10}{'workers':>9}{'seconds':>12}{'speedup':>9}")
+    for size in sizes:
+        lines = make_adblock_lines(size)
+        text = '\n'.join(lines)
+        rules = [{'type': 'adblock'}, {'type': 'allowlist'}]
+        baseline = {}
+        for workers in workers_list:
+            line_parser = LineParser({'workers': workers})
+            decoder = AdblockRuleDecoder()
+            for name, func in (('filter_line', lambda: line_parser.parse(lines, rules)),
+                               ('decoder', lambda: decoder.decode_adblock_rule(text, workers=workers))):
+                result = func()
+                if name not in baseline:
+                    baseline[name] = (result, None)
+                elif result != baseline[name][0]:
+                    raise RuntimeError(f'{name} output with {workers} workers differs from serial output')
+                elapsed = time_call(func, repeat=repeat)
+                serial_time = baseline[name][1] or elapsed
+                baseline[name] = (baseline[name][0], serial_time)
+                print(f"{name:<12}{size:>10}{workers:>9}{elapsed:>12.4f}{serial_time / elapsed:>8.2f}x")
+            line_parser.close()
+
+def bench_regex(sizes, repeat=3):
+    # 合并后的正则集合与逐个匹配原始正则的请求 URL 吞吐量对比，并确认两者的匹配结果一致
+    print(f"{'patterns':>10}{'combined':>10}{'kept':>6}{'hits':>8}{'naive urls/s':>15}{'set urls/s':>13}{'speedup':>9}")
+    for size in sizes:
+        urls = make_request_urls(REGEX_QUERY_COUNT, size)
+        patterns = [rule['regex'] for rule in AdblockRuleDecoder().decode_adblock_rule('\n'.join(make_regex_lines(size)))
+                    if rule['prefer'] == 'REGEX']
+        regex_set = RegexSet(patterns)
+        mismatches = verify_equivalence(patterns, regex_set, urls)
+        if mismatches:
+            raise RuntimeError(f'consolidated regex set differs on {len(mismatches)} urls, e.g. {mismatches[0]}')
+        compiled = [regex for regex in (RegexSet([pattern]).compiled for pattern in dict.fromkeys(patterns)) for regex in regex]
+        def naive():
+            return [any(regex.search(url) for regex in compiled) for url in urls]
+        def combined():
+            return [regex_set.search(url) for url in urls]
+        hits = sum(combined())
+        naive_time = time_call(naive, repeat=repeat)
+        set_time = time_call(combined, repeat=repeat)
+        print(f"{len(compiled):>10}{len(regex_set.combined):>10}{len(regex_set.kept):>6}{hits:>8}"
+              f"{len(urls) / naive_time:>15,.0f}{len(urls) / set_time:>13,.0f}{naive_time / set_time:>8.1f}x")
+
+def bench_lookup(sizes, repeat=3, target=LOOKUP_TARGET_RATE):
+    # 用 make_query_names(size) 查询 make_adblock_lines(size) 提取出的条目，返回 lookup_many 是否达到目标吞吐量
+    print(f"{'entries':>10}{'queries':>10}{'blocked':>10}{'lookup/s':>14}{'lookup_many/s':>15}{'target':>14}")
+    met = True
+    for size in sizes:
+        index = LookupIndex()
+        index.add_list(filter_lines(make_adblock_lines(size), {'type': 'adblock'}), 'benchmark')
+        names = make_query_names(size)
+        results = index.lookup_many(names)
+        if results != [index.lookup(name) for name in names]:
+            raise RuntimeError('lookup_many differs from lookup')
+        blocked = sum(hit is not None for hit in results)
+        single_time = time_call(lambda: [index.lookup(name) for name in names], repeat=repeat)
+        many_time = time_call(index.lookup_many, names, repeat=repeat)
+        rate = size / many_time
+        met = met and rate >= target
+        print(f"{index.size:>10}{size:>10}{blocked:>10}{size / single_time:>14,.0f}{rate:>15,.0f}"
+              f"{'ok' if rate >= target else 'below':>14}")
+    return met
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark rule parsing and conversion.')
+    parser.add_argument('--suite', choices=['all', 'convert', 'parse', 'regex', 'lookup'], default='all')
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--cases', nargs='+', help='only run these cases of the all suite')
+    parser.add_argument('--workers', type=int, nargs='+', default=DEFAULT_WORKERS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='fail when results regress against this baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--lookup-target', type=int, default=LOOKUP_TARGET_RATE, help='lookup suite: minimum lookup_many lookups/s')
+    parser.add_argument('--save-baseline', help='write the results to this JSON file')
+    args = parser.parse_args()
+    if args.suite == 'parse':
+        bench_parse(args.sizes or DEFAULT_SIZES[:2], args.workers, repeat=args.repeat)
+        return
+    if args.suite == 'regex':
+        bench_regex(args.sizes or DEFAULT_REGEX_SIZES, repeat=args.repeat)
+        return
+    if args.suite == 'lookup':
+        if not bench_lookup(args.sizes or DEFAULT_LOOKUP_SIZES, repeat=args.repeat, target=args.lookup_target):
+            print(f"lookup_many is below {args.lookup_target:,} lookups/s.")
+            sys.exit(1)
+        return
+    if args.suite == 'convert':
+        bench_convert(args.sizes or DEFAULT_CONVERT_SIZES, repeat=args.repeat)
+        return
+    results = bench_all(args.sizes or DEFAULT_SIZES, repeat=args.repeat, cases=args.cases)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print(f"Saved baseline to {args.save_baseline}.")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        failures = compare_baseline(results, baseline, args.tolerance)
+        for failure in failures:
+            print(f"Regression: {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，此时不记录内存峰值
+    resource = None
+
+# 构建过程的统计：各阶段耗时、输入输出字节数、内存峰值以及逐行过滤结果计数，最后写成 JSON 报告
+# 阶段: fetch (下载，串行解析时包含 parse) / parse (逐行过滤) / filter (减去白名单) / dedup (合并去重与裁剪) / emit (写出文件)
+#       assemble (拼接 full_rule_outputs 中的完整配置，在后台线程中与其他阶段同时进行)
+
+DEFAULT_REPORT_OPTIONS = {
+    'path': 'build_report.json',  # 报告路径，与 generated_rules/ 同级，不会随规则一起发布
+    'profile_dir': None,          # 设置后每个阶段的 cProfile 结果写入 <profile_dir>/<阶段>.prof
+}
+
+def peak_rss_bytes():
+    # 进程的最大常驻内存，Linux 上 ru_maxrss 单位为 KiB，macOS 上为字节
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Linux 上向 /proc/self/clear_refs 写入 5 可以把 VmHWM（常驻内存峰值）重置为当前值，
+# 各阶段开始与结束时读取并重置，得到每个阶段自己的内存峰值；不支持时报告中只有整个进程的峰值
+def read_hwm_bytes():
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def reset_hwm():
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='ascii') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+class BuildReport:
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_REPORT_OPTIONS, **(options or {}))
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.sources = {}
+        self.rules = {}
+        self._profiles = {}
+        self._active_profile = None
+        self._lock = threading.Lock()
+        # 正在运行的阶段（可能嵌套或在多个线程中同时运行）及其层数，两次采样之间的峰值计入所有正在运行的阶段
+        self._running = {}
+        self._peak = 0
+        self._stage_peaks = read_hwm_bytes() is not None and reset_hwm()
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'calls': 0, 'bytes_in': 0, 'bytes_out': 0, 'lines': 0}
+        return self.stages[name]
+
+    def _sample_peak(self):
+        # 调用时持有 _lock：上次重置以来的峰值计入正在运行的阶段，然后重新开始计量
+        if not self._stage_peaks:
+            return
+        peak = read_hwm_bytes()
+        if peak is None:
+            return
+        self._peak = max(self._peak, peak)
+        for name in self._running:
+            stage = self._stage(name)
+            stage['peak_rss_bytes'] = max(stage.get('peak_rss_bytes', 0), peak)
+        reset_hwm()
+
+    @contextmanager
+    def stage(self, name):
+        # 计时并记录本阶段运行期间的内存峰值；开启 profile_dir 时在主线程中同时做 cProfile
+        start = time.perf_counter()
+        with self._lock:
+            self._sample_peak()
+            self._running[name] = self._running.get(name, 0) + 1
+        try:
+            with self.profile(name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self._stage(name)
+                stage['seconds'] += elapsed
+                stage['calls'] += 1
+                self._sample_peak()
+                self._running[name] -= 1
+                if not self._running[name]:
+                    del self._running[name]
+
+    @contextmanager
+    def profile(self, name):
+        # 每个阶段一个 cProfile.Profile，多次进入同一阶段时累计到同一个 profiler
+        # cProfile 同一时间只能有一个在运行（3.12 起整个进程只能有一个），因此只在主线程中 profile，
+        # 下载线程与 assemble 线程中的调用不做 profile；嵌套的阶段暂停外层阶段的 profiler，结束后恢复
+        if not self.options['profile_dir'] or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        outer = self._active_profile
+        if outer == name:
+            yield
+            return
+        self._switch_profile(name)
+        try:
+            yield
+        finally:
+            self._switch_profile(outer)
+
+    def _switch_profile(self, name):
+        # 停止当前运行的 profiler 并启动 name 阶段的 profiler（None 为只停止）
+        if self._active_profile is not None:
+            self._profiles[self._active_profile].disable()
+            self._active_profile = None
+        if name is None:
+            return
+        profiler = self._profiles.get(name) or cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # 已经有其他 profiler 在运行，例如整个程序运行在 python -m cProfile 之下
+            print(f"Skipped profiling stage {name}: {e}")
+            return
+        self._profiles[name] = profiler
+        self._active_profile = name
+
+    def add_time(self, name, seconds):
+        # 在其他线程或子进程中累计的耗时，例如各分片的解析时间之和
+        with self._lock:
+            self._stage(name)['seconds'] += seconds
+
+    def add_io(self, name, bytes_in=0, bytes_out=0, lines=0):
+        with self._lock:
+            stage = self._stage(name)
+            stage['bytes_in'] += bytes_in
+            stage['bytes_out'] += bytes_out
+            stage['lines'] += lines
+
+    def count(self, group, outcomes):
+        # 累加计数，outcomes 为 {结果: 数量}
+        with self._lock:
+            counter = self.counters.setdefault(group, {})
+            for outcome, number in outcomes.items():
+                counter[outcome] = counter.get(outcome, 0) + number
+
+    def record_source(self, url, **fields):
+        with self._lock:
+            self.sources.setdefault(url, {}).update(fields)
+
+    def record_rule(self, name, **fields):
+        with self._lock:
+            self.rules.setdefault(name, {}).update(fields)
+
+    def peak_rss_bytes(self):
+        # 重置 VmHWM 之后 ru_maxrss 也会变小，因此与各次采样得到的峰值取最大值
+        peak = peak_rss_bytes()
+        if self._stage_peaks:
+            peak = max(self._peak, peak or 0, read_hwm_bytes() or 0)
+        return peak
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started_at': int(self.started_at),
+                'seconds': time.time() - self.started_at,
+                'peak_rss_bytes': self.peak_rss_bytes(),
+                'stages': self.stages,
+                'counters': self.counters,
+                'sources': self.sources,
+                'rules': self.rules,
+            }
+
+    def write(self):
+        path = self.options['path']
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4, sort_keys=True)
+        os.replace(path + '.tmp', path)
+        print(f"Wrote build report to {path}.")
+        profile_dir = self.options['profile_dir']
+        if profile_dir and self._profiles:
+            os.makedirs(profile_dir, exist_ok=True)
+            for name, profiler in self._profiles.items():
+                pstats.Stats(profiler).dump_stats(os.path.join(profile_dir, f'{name}.prof'))
+            print(f"Wrote {len(self._profiles)} stage profiles to {profile_dir}.")
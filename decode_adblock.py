@@ -1,337 +1,533 @@
 import base64
+import io
 import json
+import multiprocessing
+import os
+import re
+import shutil
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from regex_set import consolidate
+
+# hosts 文件的一行：可选的前导空白、IP 字段、空白、域名字段；# 之后为注释
+# '\r' 在匹配之前统一删除，与原来逐字符解析时忽略 '\r' 的行为一致
+re_hosts_rule = re.compile(r'^[ \t]*[^ \t\n#]+[ \t]+([^ \t\n#]+)', re.M)
+HOSTS_BATCH_LINES = 4096
+
+# 匹配子域名的前缀与 AdBlock 分隔符 ^ 对应的正则片段
+SUBDOMAIN_REGEX = '(https?://)?([0-9a-zA-Z_\\-\\.]*\\.)?'
+SEPARATOR_REGEX = '(?![0-9a-zA-Z_\\-\\.\\%]).'
+# 快速路径只处理不含任何特殊字符、且不以 . 开头的域名
+re_fast_subdomain_rule = re.compile(r'\|\|([0-9A-Za-z_-][0-9A-Za-z_.-]*)\^')
+re_fast_domain_rule = re.compile(r'[0-9A-Za-z_-][0-9A-Za-z_.-]*')
+NOT_FAST_PATH = object()
+# 按行缓存解析结果的最大条数
+DECODE_MEMO_SIZE = 65536
+# 多进程解析时每个分片的行数
+DECODE_CHUNK_LINES = 20000
+# emit_rules 支持的输出目标
+EMIT_TARGETS = ('unbound_rejection', 'unbound_forward', 'quantumult_hosts', 'quantumult_regex', 'clash', 'adguard')
+HOSTS_PREFERS = ('HOST-SUFFIX', 'HOST-KEYWORD', 'HOST')
+
+# Rule 中 regex 的延迟生成方式：快速路径的正则完全由域名决定，只记录类型，读取时再拼接
+REGEX_SUBDOMAIN = 1 # ||example.com^
+REGEX_DOMAIN = 2    # example.com
+RULE_KEYS = ('domain', 'regex', 'prefer', 'action')
+
+def process_pool_context():
+    # 进程池可能在下载线程中第一次启动子进程，fork 会把其他线程持有的锁一并复制到子进程里；
+    # 优先使用 forkserver，不支持时（Windows）使用 spawn
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
 
 class IllegalRuleException(RuntimeError):
     pass
 
+def escape_domain_regex(domain):
+    return domain.replace('.', '\\.').replace('-', '\\-')
+
+def iter_part_lines(part):
+    # make_full_rule 的 surge-like-rules 输入：先是 rules_text 中的文本，再逐行读取 files 中的文件
+    for rules_text in part.get('rules_text', ()):
+        yield from rules_text.split('\n')
+    for path in part.get('files', ()):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line[-1:] == '\n':
+                    line = line[:-1]
+                yield line
+
+class Rule(Mapping):
+    # 解析结果的紧凑表示，取代每条规则一个 dict：
+    # 使用 __slots__ 不带 __dict__，prefer/action 直接引用解析参数中的同一个字符串对象，
+    # 快速路径的 regex 只保存一个整数类型，访问时才生成字符串
+    # 仍然可以像 dict 一样使用 rule['domain']、dict(rule) 以及与 dict 比较，但应视为只读
+    __slots__ = ('domain', '_regex', 'prefer', 'action')
+
+    def __init__(self, domain, regex, prefer, action):
+        self.domain = domain
+        self._regex = regex # 字符串、None，或 REGEX_SUBDOMAIN/REGEX_DOMAIN
+        self.prefer = prefer
+        self.action = action
+
+    @classmethod
+    def from_mapping(cls, rule):
+        if rule.__class__ is cls:
+            return rule
+        return cls(rule['domain'], rule['regex'], rule['prefer'], rule['action'])
+
+    @property
+    def regex(self):
+        regex = self._regex
+        if regex == REGEX_SUBDOMAIN:
+            return '^' + SUBDOMAIN_REGEX + escape_domain_regex(self.domain) + SEPARATOR_REGEX + '^?'
+        if regex == REGEX_DOMAIN:
+            return escape_domain_regex(self.domain)
+        return regex
+
+    def __getitem__(self, key):
+        if key in RULE_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(RULE_KEYS)
+
+    def __len__(self):
+        return len(RULE_KEYS)
+
+    def __reduce__(self):
+        # 序列化时保留整数类型的 regex，不展开成字符串
+        return (Rule, (self.domain, self._regex, self.prefer, self.action))
+
+    def __repr__(self):
+        return repr(dict(self))
+
 class AdblockRuleDecoder:
-    __uniq_cache = {}
-    
-    def __clear_uniq_cache(self):
-        self.__uniq_cache = {}
+    def __init__(self, memo_size = DECODE_MEMO_SIZE, uniq_ignore_case = False):
+        self.memo_size = memo_size
+        self.uniq_ignore_case = uniq_ignore_case
+        self.__decode_memo = OrderedDict()
 
-    def __uniq(self, find_str):
-        try:
-            index_obj = self.__uniq_cache[find_str[0]]
-        except KeyError:
-            self.__uniq_cache[find_str[0]] = []
-            index_obj = self.__uniq_cache[find_str[0]]
-        for i in index_obj:
-            if i == find_str:
+    def __new_uniq(self):
+        # 每次转换使用独立的哈希集合去重，实例之间、线程之间互不影响
+        # 返回的函数在第一次见到某个字符串时返回 True
+        seen = set()
+        ignore_case = self.uniq_ignore_case
+        def uniq(find_str):
+            if ignore_case:
+                find_str = find_str.lower()
+            if find_str in seen:
                 return False
-        index_obj.append(find_str)
-        return True
+            seen.add(find_str)
+            return True
+        return uniq
 
     def decode_hosts_rule(self, rules_list, action_type = 'HOST-SUFFIX', default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT'):
-        now_rule_string = ''
-        rules = []
-        ignore_this_line = False
-        space = False
-        ip_path = False
-        for rule_char in rules_list:
-            if rule_char == '\n':
-                if now_rule_string != '':
-                    rules.append({'domain': now_rule_string, 'regex': None, 'prefer': action_type, 'action': default_action})
-                    now_rule_string = ''
-                ignore_this_line = False
-                space = False
-                ip_path = False
-                now_rule_string = ''
-                continue
-            if ignore_this_line or rule_char == '\r':
-                continue
-            if rule_char == '#':
-                ignore_this_line = True
-                continue
-            if ip_path == False and now_rule_string == '':
-                if rule_char != ' ' and rule_char != '\t':
-                    ip_path = True
-                continue
-            if ip_path == True and rule_char == ' ' or rule_char == '\t':
-                if space == False:
-                    space = True
-                elif now_rule_string != '':
-                    ignore_this_line = True
-                continue
-            if space:
-                now_rule_string += rule_char
-        if now_rule_string != '':
-            rules.append({'domain': now_rule_string, 'regex': None, 'prefer': action_type, 'action': default_action})
-            now_rule_string = ''
-        return rules
-
-    def decode_gfwlist_rule(self, rules_list, default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT'):
+        return [
+            Rule(domain, None, action_type, default_action)
+            for domain in re_hosts_rule.findall(rules_list.replace('\r', ''))
+        ]
+
+    def iter_decode_hosts_rule(self, rules_lines, action_type = 'HOST-SUFFIX', default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT'):
+        # 流式入口：按 HOSTS_BATCH_LINES 行一批交给正则处理，rules_lines 中的每一项必须是以 '\n' 切分的完整行
+        batch = []
+        for line in rules_lines:
+            batch.append(line)
+            if len(batch) >= HOSTS_BATCH_LINES:
+                yield from self.decode_hosts_rule('\n'.join(batch), action_type=action_type, default_action=default_action)
+                batch.clear()
+        if batch:
+            yield from self.decode_hosts_rule('\n'.join(batch), action_type=action_type, default_action=default_action)
+
+    def decode_gfwlist_rule(self, rules_list, default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT', workers = 1):
         return self.decode_adblock_rule(
             base64.b64decode(rules_list).decode('utf-8'),
             default_action=default_action,
             unsupport_action=unsupport_action,
             unsupport_convert=unsupport_convert,
-            exclude_action=exclude_action
+            exclude_action=exclude_action,
+            workers=workers
         )
 
-    def convert_rule_to_unbound(self, ruleset, unbound_target_dns = '8.8.8.8'):
-        rejection_ruleset = ''
-        forward_ruleset = ''
+    def emit_rules(self, ruleset, targets, unbound_target_dns = '8.8.8.8', consolidate_regex = False):
+        # 单次遍历规则集，同时写入多个目标，targets 为 {目标名: 文件对象}，只输出给出的目标
+        # clash 目标是一个函数，接收小写的动作名并返回该动作对应的文件对象，第一次写入时先写入 payload 头
+        # consolidate_regex 为 True 时 quantumult_regex 在最后写入合并后的少量正则（见 regex_set.py），计数为写入的正则条数
+        # 返回每个目标写入的规则条数
+        for name in targets:
+            if name not in EMIT_TARGETS:
+                raise ValueError(f'unknown emit target: {name}')
+        unbound_rejection = targets.get('unbound_rejection')
+        unbound_forward = targets.get('unbound_forward')
+        quantumult_hosts = targets.get('quantumult_hosts')
+        quantumult_regex = targets.get('quantumult_regex')
+        clash = targets.get('clash')
+        adguard = targets.get('adguard')
+        emit_unbound = unbound_rejection is not None or unbound_forward is not None
+        emit_hosts = quantumult_hosts is not None or clash is not None or adguard is not None
+        counts = dict.fromkeys(targets, 0)
+        clash_files = {}
+        clash_prefix = {prefer: '  - ' + self.convert_action_name(prefer, 'clash') + ',' for prefer in HOSTS_PREFERS}
+        adguard_format = {'HOST-SUFFIX': '||{}^', 'HOST': '|{}^', 'HOST-KEYWORD': '*{}*'}
+        # Unbound 只对 HOST 规则去重（HOST-SUFFIX 不经过去重），与其他目标的去重状态分开
+        unbound_uniq = self.__new_uniq()
+        hosts_uniq = self.__new_uniq()
+        regex_patterns = [] if consolidate_regex and quantumult_regex is not None else None
         for i in ruleset:
-            if i['domain'] == '':
-                continue
-            if i['prefer'] == 'HOST-SUFFIX' or i['prefer'] == 'HOST' and self.__uniq(i['domain']):
-                if i['action'] == 'REJECT':
-                    rejection_ruleset += 'local-zone: "' + i['domain'] + '" refuse\n'
-                else:
-                    forward_ruleset += 'forward-zone:\n\tname: "' + i['domain'] + '."\n' + unbound_target_dns + '\n'
-        self.__clear_uniq_cache()
+            if i.__class__ is not Rule:
+                i = Rule.from_mapping(i)
+            prefer = i.prefer
+            domain = i.domain
+            if emit_unbound and domain != '' and (prefer == 'HOST-SUFFIX' or prefer == 'HOST' and unbound_uniq(domain)):
+                if i.action == 'REJECT':
+                    if unbound_rejection is not None:
+                        unbound_rejection.write('local-zone: "' + domain + '" refuse\n')
+                        counts['unbound_rejection'] += 1
+                elif unbound_forward is not None:
+                    unbound_forward.write('forward-zone:\n\tname: "' + domain + '."\n' + unbound_target_dns + '\n')
+                    counts['unbound_forward'] += 1
+            if prefer in HOSTS_PREFERS:
+                if domain == '' or not emit_hosts or not hosts_uniq(domain):
+                    continue
+                action = i.action
+                if quantumult_hosts is not None:
+                    quantumult_hosts.write(prefer + ',' + domain + ',' + action + '\n')
+                    counts['quantumult_hosts'] += 1
+                if clash is not None:
+                    action_name = action.lower()
+                    f = clash_files.get(action_name)
+                    if f is None:
+                        f = clash_files[action_name] = clash(action_name)
+                        f.write('payload:\n')
+                    f.write(clash_prefix[prefer] + domain + '\n')
+                    counts['clash'] += 1
+                if adguard is not None:
+                    line = adguard_format[prefer].format(domain)
+                    adguard.write((line if action == 'REJECT' else '@@' + line) + '\n')
+                    counts['adguard'] += 1
+            elif prefer == 'REGEX':
+                regex = i.regex
+                if regex == '':
+                    continue
+                if i.action == 'REJECT':
+                    if regex_patterns is not None:
+                        regex_patterns.append(regex)
+                    elif quantumult_regex is not None:
+                        quantumult_regex.write(regex + '\n')
+                        counts['quantumult_regex'] += 1
+                    if adguard is not None:
+                        adguard.write('/' + regex + '/\n')
+                        counts['adguard'] += 1
+                elif adguard is not None:
+                    adguard.write('@@/' + regex + '/\n')
+                    counts['adguard'] += 1
+        if regex_patterns:
+            combined, kept = consolidate(regex_patterns)
+            for regex in combined + kept:
+                quantumult_regex.write(regex + '\n')
+            counts['quantumult_regex'] = len(combined) + len(kept)
+        return counts
+
+    def convert_rule_to_unbound(self, ruleset, unbound_target_dns = '8.8.8.8'):
+        rejection_ruleset = io.StringIO()
+        forward_ruleset = io.StringIO()
+        self.emit_rules(ruleset, {
+            'unbound_rejection': rejection_ruleset,
+            'unbound_forward': forward_ruleset
+        }, unbound_target_dns=unbound_target_dns)
         return {
-            'rejection': rejection_ruleset,
-            'forward': forward_ruleset
+            'rejection': rejection_ruleset.getvalue(),
+            'forward': forward_ruleset.getvalue()
         }
 
-    def convert_rule_to_quantumult(self, ruleset):
-        hosts_ruleset = ''
-        regex_rejection_ruleset = ''
-        for i in ruleset:
-            if i['prefer'] == 'HOST-SUFFIX' or i['prefer'] == 'HOST-KEYWORD' or i['prefer'] == 'HOST':
-                if i['domain'] == '':
-                    continue
-                if self.__uniq(i['domain']):
-                    hosts_ruleset += i['prefer'] + ',' + i['domain'] + ',' + i['action'] + '\n'
-            elif i['prefer'] == 'REGEX':
-                if i['action'] != 'REJECT':
-                    continue
-                if i['regex'] == '':
-                    continue
-                regex_rejection_ruleset += i['regex'] + '\n'
-        self.__clear_uniq_cache()
+    def convert_rule_to_quantumult(self, ruleset, consolidate_regex = False):
+        hosts_ruleset = io.StringIO()
+        regex_rejection_ruleset = io.StringIO()
+        self.emit_rules(ruleset, {
+            'quantumult_hosts': hosts_ruleset,
+            'quantumult_regex': regex_rejection_ruleset
+        }, consolidate_regex=consolidate_regex)
         return {
-            'hosts': hosts_ruleset,
-            'regex_rejection': regex_rejection_ruleset
+            'hosts': hosts_ruleset.getvalue(),
+            'regex_rejection': regex_rejection_ruleset.getvalue()
         }
 
     def convert_rule_to_clash(self, ruleset):
-        file_header = 'payload:\n'
         clash_action_rules = {}
-        for i in ruleset:
-            if i['prefer'] == 'HOST-SUFFIX' or i['prefer'] == 'HOST-KEYWORD' or i['prefer'] == 'HOST':
-                if i['domain'] == '':
-                    continue
-                if self.__uniq(i['domain']):
-                    try:
-                        clash_action_rules[i['action'].lower()] += '  - ' + self.convert_action_name(i['prefer'], 'clash') + ',' + i['domain'] + '\n'
-                    except KeyError:
-                        clash_action_rules[i['action'].lower()] = file_header + '  - ' + self.convert_action_name(i['prefer'], 'clash') + ',' + i['domain'] + '\n'
-        self.__clear_uniq_cache()
-        return clash_action_rules
+        def open_action(action_name):
+            clash_action_rules[action_name] = io.StringIO()
+            return clash_action_rules[action_name]
+        self.emit_rules(ruleset, {'clash': open_action})
+        return {action: f.getvalue() for action, f in clash_action_rules.items()}
+
+    def convert_rule_to_adguard(self, ruleset):
+        adguard_ruleset = io.StringIO()
+        self.emit_rules(ruleset, {'adguard': adguard_ruleset})
+        return adguard_ruleset.getvalue()
 
     def make_full_rule(self, parts, target_software = 'surfboard'):
+        config_file = io.StringIO()
+        self.write_full_rule(parts, config_file, target_software)
+        return config_file.getvalue()
+
+    def write_full_rule(self, parts, output, target_software = 'surfboard'):
+        # 流式写出完整配置：parts 的每一项用 rules_text 给出文本，或用 files 给出文件路径，文件在用到时才打开、逐行读取
+        # 写出 FINAL/MATCH 规则后结束，之后的规则与 parts 都被忽略
         match_type_prefix = ''
         if target_software == 'clash':
             match_type_prefix = '  - '
-        config_file = ''
+        # 规则类型 -> 带前缀的输出类型名，每种类型只转换一次
+        match_types = {}
         for i in parts:
             if i['type'] == 'base':
-                for rules_text in i['rules_text']:
-                    config_file += rules_text + '\n\n'
+                for rules_text in i.get('rules_text', ()):
+                    output.write(rules_text + '\n\n')
+                for path in i.get('files', ()):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, output)
+                    output.write('\n\n')
             elif i['type'] == 'surge-like-rules':
-                action_replace = None
-                try:
-                    action_replace = i['action_replace']
-                except KeyError:
-                    pass
-                self.__clear_uniq_cache()
-                minify = False
-                try:
-                    minify = i['minify']
-                except KeyError:
-                    pass
-                for rule_file in i['rules_text']:
-                    for rule in rule_file.split('\n'):
-                        if rule.startswith('#'):
-                            continue
-                        if rule.isspace():
-                            continue
-                        if len(rule) == 0:
-                            continue
-                        rule = rule.split(',')
-                        if rule[0] in ['FINAL', 'MATCH']:
-                            match_type = self.convert_action_name(rule[0], target_software)
-                            action = rule[1]
-                            if action_replace != None:
-                                try:
-                                    action = action_replace[action]
-                                except KeyError:
-                                    pass
-                            config_file +=  f'{match_type_prefix}{match_type},{action}\n'
-                            self.__clear_uniq_cache()
-                            return config_file
-                        elif not minify or self.__uniq(rule[1]):
-                            match_type = self.convert_action_name(rule[0], target_software)
-                            action = rule[2]
-                            if action_replace != None:
-                                try:
-                                    action = action_replace[action]
-                                except KeyError:
-                                    pass
-                            config_file +=  f'{match_type_prefix}{match_type},{rule[1]},{action}\n'
-        self.__clear_uniq_cache()
-        return config_file
-                
-
-    def decode_adblock_rule(self, rules_list, default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT'):
-        rules = []
-        rules_raw = rules_list.split('\n')
+                action_replace = i.get('action_replace') or {}
+                uniq = self.__new_uniq()
+                minify = i.get('minify', False)
+                for rule in iter_part_lines(i):
+                    if rule.startswith('#'):
+                        continue
+                    if rule.isspace():
+                        continue
+                    if len(rule) == 0:
+                        continue
+                    rule = rule.split(',')
+                    match_type = match_types.get(rule[0])
+                    if match_type is None:
+                        match_type = match_types[rule[0]] = match_type_prefix + self.convert_action_name(rule[0], target_software)
+                    if rule[0] in ['FINAL', 'MATCH']:
+                        output.write(f'{match_type},{action_replace.get(rule[1], rule[1])}\n')
+                        return
+                    elif not minify or uniq(rule[1]):
+                        output.write(f'{match_type},{rule[1]},{action_replace.get(rule[2], rule[2])}\n')
+
+    def decode_adblock_rule(self, rules_list, default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT', workers = 1):
+        # workers 不为 1 时按 DECODE_CHUNK_LINES 行分片交给进程池解析（0 为全部 CPU 核心），
+        # 各分片的结果按原顺序拼接，与单进程解析的结果完全一致
+        rules_lines = rules_list.split('\n')
+        options = (default_action, unsupport_convert, unsupport_action, exclude_action)
+        if workers != 1 and len(rules_lines) > DECODE_CHUNK_LINES:
+            chunks = [rules_lines[i:i + DECODE_CHUNK_LINES] for i in range(0, len(rules_lines), DECODE_CHUNK_LINES)]
+            ruleset = []
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=process_pool_context()) as pool:
+                for chunk_ruleset in pool.map(decode_adblock_chunk, chunks, repeat(options)):
+                    ruleset.extend(chunk_ruleset)
+            return ruleset
+        return list(self.iter_decode_adblock_rule(rules_lines, *options))
+
+    def iter_decode_adblock_rule(self, rules_lines, default_action = 'REJECT', unsupport_convert = 'REGEX', unsupport_action = 'REJECT', exclude_action = 'DIRECT'):
+        # 流式入口：rules_lines 可以是文件对象或任意逐行产出的可迭代对象，逐条产出解析结果
         # scheme: ^(https?://)?
         # 域名及子域名: ([0-9a-zA-Z_\-\.]*\.)?
         # 标记分隔符 ^: (?![0-9a-zA-Z_\-\.\%]).
-        if len(rules_raw) == 0:
-            return rules
-        for rule in rules_raw:
+        # 相同的行在合并的多个列表中大量重复，解析结果以 (解析参数, 行) 为键缓存，
+        # 不同线程同时用不同参数解析时不会互相读到对方的结果
+        memo = self.__decode_memo
+        options = (default_action, unsupport_convert, unsupport_action, exclude_action)
+        for rule in rules_lines:
+            if rule[-1:] == '\n':
+                rule = rule[0:-1]
             if len(rule) < 2:
                 continue
             if rule[-1] == '\r':
                 rule = rule[0:-1]
-            first_str = rule[0]
-            if first_str == '[' and rule[-1] == ']': # 去掉 [Adblock Plus 1.1] 这一行
-                continue
-            if first_str == '!': # 去掉注释行
+            key = (options, rule)
+            try:
+                result = memo[key]
+                memo.move_to_end(key)
+            except KeyError:
+                # 其他线程可能恰好淘汰了这个键，重新解析即可
+                result = self.__decode_adblock_line(rule, default_action, unsupport_convert, unsupport_action, exclude_action)
+                if self.memo_size > 0:
+                    memo[key] = result
+                    if len(memo) > self.memo_size:
+                        try:
+                            memo.popitem(last=False)
+                        except KeyError:
+                            pass
+            if result is not None:
+                yield result
+
+    def __decode_adblock_line(self, rule, default_action, unsupport_convert, unsupport_action, exclude_action):
+        # 解析单行规则，返回 Rule，需要丢弃的行返回 None
+        fast_result = self.__decode_fast_path(rule, default_action, unsupport_convert, unsupport_action)
+        if fast_result is not NOT_FAST_PATH:
+            return fast_result
+        first_str = rule[0]
+        if first_str == '[' and rule[-1] == ']': # 去掉 [Adblock Plus 1.1] 这一行
+            return None
+        if first_str == '!': # 去掉注释行
+            return None
+        prev_str = ''
+        generated_domain = ''
+        generated_regex = ''
+
+        char_path = -1 # 当前处理字符的位置，0 开始计
+        domain_end = False # 标记停止记录域名
+        prefix_match = False # 标记规则需要匹配前缀
+        suffix_match = False # 标记规则需要匹配后缀
+        path_length = 0 # 标记除域名后面的目录的长度
+        subdomain = False # 标记规则需要匹配子域名
+        regex_only = False # 标记规则只能用正则
+        skip_char = 0 # 标记跳过多少字
+        unsupport_rule = False # 标记不支持的规则
+        is_exclude_rule = False
+        for now_char in rule:
+            char_path += 1
+            if skip_char > 0:
+                skip_char -= 1
                 continue
-            prev_str = ''
-            generated_domain = ''
-            generated_regex = ''
-
-            char_path = -1 # 当前处理字符的位置，0 开始计
-            domain_end = False # 标记停止记录域名
-            prefix_match = False # 标记规则需要匹配前缀
-            suffix_match = False # 标记规则需要匹配后缀
-            path_length = 0 # 标记除域名后面的目录的长度
-            subdomain = False # 标记规则需要匹配子域名
-            regex_only = False # 标记规则只能用正则
-            skip_char = 0 # 标记跳过多少字
-            unsupport_rule = False # 标记不支持的规则
-            is_exclude_rule = False
-            for now_char in rule:
-                char_path += 1
-                if skip_char > 0:
-                    skip_char -= 1
+            if char_path == 0:
+                if now_char == '@' and rule[1] == '@':
+                    if exclude_action == 'IGNORE':
+                        break
+                    skip_char = 1
+                    char_path = -2
+                    is_exclude_rule = True
                     continue
-                if char_path == 0:
-                    if now_char == '@' and rule[1] == '@':
-                        if exclude_action == 'IGNORE':
-                            break
-                        skip_char = 1
-                        char_path = -2
-                        is_exclude_rule = True
-                        continue
-                    if now_char == '|': # 检查开头是否匹配
-                        prefix_match = True
-                        generated_regex = '^'
-                        prev_str = now_char
-                        domain_end = False
-                        continue
-                    elif now_char == '/': # 正则规则，直接跳过
-                        if rule[-1] == '/':
-                            regex_only = True
-                            generated_regex = rule[1:-1]
-                            break
-                        else:
-                            regex_suffix = rule.find('/$')
-                            rule_length = len(rule) - 2
-                            if regex_suffix != -1 and regex_suffix != rule_length:
-                                regex_only = True
-                                generated_regex = rule[1:regex_suffix]
-                                break
-                elif regex_only == False and char_path == 1 and now_char == '|' and prev_str == '|': # 检查是否匹配子域名
-                    subdomain = True
-                    generated_regex += '(https?://)?([0-9a-zA-Z_\\-\\.]*\\.)?'
+                if now_char == '|': # 检查开头是否匹配
+                    prefix_match = True
+                    generated_regex = '^'
                     prev_str = now_char
+                    domain_end = False
                     continue
-                if now_char == '$':
-                    rule_options = rule[rule.find('$'):] # 检查是否有高度可能导致访问网站出问题的附加选项
-                    if 'domain=' in rule_options or 'csp=' in rule_options or 'popup' in rule_options or 'popunder' in rule_options:
-                        unsupport_rule = True
-                    break
-                if now_char == '#': # 不支持元素过滤，直接忽略
+                elif now_char == '/': # 正则规则，直接跳过
+                    if rule[-1] == '/':
+                        regex_only = True
+                        generated_regex = rule[1:-1]
+                        break
+                    else:
+                        regex_suffix = rule.find('/$')
+                        rule_length = len(rule) - 2
+                        if regex_suffix != -1 and regex_suffix != rule_length:
+                            regex_only = True
+                            generated_regex = rule[1:regex_suffix]
+                            break
+            elif regex_only == False and char_path == 1 and now_char == '|' and prev_str == '|': # 检查是否匹配子域名
+                subdomain = True
+                generated_regex += SUBDOMAIN_REGEX
+                prev_str = now_char
+                continue
+            if now_char == '$':
+                rule_options = rule[rule.find('$'):] # 检查是否有高度可能导致访问网站出问题的附加选项
+                if 'domain=' in rule_options or 'csp=' in rule_options or 'popup' in rule_options or 'popunder' in rule_options:
                     unsupport_rule = True
-                    break
-                elif (now_char == ':' and (generated_domain == 'http' or generated_domain == 'https' or generated_domain == 'http*')) and rule[char_path + 1:char_path + 3] == '//':
-                    # 如果出现冒号检查是否是 scheme，如果是重新提取域名
-                    generated_domain = ''
-                    skip_char = 2
-                    prev_str = '/'
-                    generated_regex += '://'
-                    continue
-                elif domain_end == False and now_char == '/': # 如果出现路径则停止记录域名
-                    domain_end = True
-                elif now_char == '*': # 如果出现 * 则转换成正则的形式
-                    generated_regex += '.'
-                elif now_char == '^': # 如果出现分隔符则用正则替代，并且停止记录域名
-                    generated_regex += '(?![0-9a-zA-Z_\-\.\%]).'
-                    domain_end = True
-                    generated_regex += now_char
-                    prev_str = now_char # 记录最后一个字是什么
-                    continue
-                elif now_char in '.?-+[]{},\\': # 如果出现正则的特殊字符则在签名加一个转义符
-                    generated_regex += '\\'
-                if domain_end:
-                    path_length += 1 # 记录域名后面的路径有多长，方便后面判断是否必须用正则
-                else:
-                    if now_char == '.' and generated_domain == '':
-                        generated_regex += now_char
-                        prev_str = now_char # 记录最后一个字是什么
-                        continue
-                    generated_domain += now_char # 记录域名
+                break
+            if now_char == '#': # 不支持元素过滤，直接忽略
+                unsupport_rule = True
+                break
+            elif (now_char == ':' and (generated_domain == 'http' or generated_domain == 'https' or generated_domain == 'http*')) and rule[char_path + 1:char_path + 3] == '//':
+                # 如果出现冒号检查是否是 scheme，如果是重新提取域名
+                generated_domain = ''
+                skip_char = 2
+                prev_str = '/'
+                generated_regex += '://'
+                continue
+            elif domain_end == False and now_char == '/': # 如果出现路径则停止记录域名
+                domain_end = True
+            elif now_char == '*': # 如果出现 * 则转换成正则的形式
+                generated_regex += '.'
+            elif now_char == '^': # 如果出现分隔符则用正则替代，并且停止记录域名
+                generated_regex += SEPARATOR_REGEX
+                domain_end = True
                 generated_regex += now_char
                 prev_str = now_char # 记录最后一个字是什么
-            if unsupport_rule == False:
-                if generated_domain == 'localhost' or generated_domain == 'ip6_localhost':
+                continue
+            elif now_char in '.?-+[]{},\\': # 如果出现正则的特殊字符则在签名加一个转义符
+                generated_regex += '\\'
+            if domain_end:
+                path_length += 1 # 记录域名后面的路径有多长，方便后面判断是否必须用正则
+            else:
+                if now_char == '.' and generated_domain == '':
+                    generated_regex += now_char
+                    prev_str = now_char # 记录最后一个字是什么
                     continue
-                if prev_str == '^': # 如果最后是分隔符，根据 AdBlock 的规则，在最后的分隔符可以没有
-                    generated_regex += '?'
-                elif prev_str == '|':
-                    if rule[char_path-1] == '^': # 如果最后要求匹配结尾并且上一个是分隔符，就在正则后面加这些
-                        generated_regex = generated_regex[0:len(generated_regex)-1] + '?$'
-                    else: # 如果上一个字不是分隔符就不加问号
-                        generated_regex = generated_regex[0:len(generated_regex)-1] + '$'
-                maybe_domain_only = True
-                if first_str != '|' and not is_exclude_rule:
-                    maybe_domain_only = False
-                rule_end_path = char_path
-                if is_exclude_rule:
-                    rule_end_path += 2
+                generated_domain += now_char # 记录域名
+            generated_regex += now_char
+            prev_str = now_char # 记录最后一个字是什么
+        if unsupport_rule == False:
+            if generated_domain == 'localhost' or generated_domain == 'ip6_localhost':
+                return None
+            if prev_str == '^': # 如果最后是分隔符，根据 AdBlock 的规则，在最后的分隔符可以没有
+                generated_regex += '?'
+            elif prev_str == '|':
+                if rule[char_path-1] == '^': # 如果最后要求匹配结尾并且上一个是分隔符，就在正则后面加这些
+                    generated_regex = generated_regex[0:len(generated_regex)-1] + '?$'
+                else: # 如果上一个字不是分隔符就不加问号
+                    generated_regex = generated_regex[0:len(generated_regex)-1] + '$'
+            maybe_domain_only = True
+            if first_str != '|' and not is_exclude_rule:
+                maybe_domain_only = False
+            rule_end_path = char_path
+            if is_exclude_rule:
+                rule_end_path += 2
+            last_str = rule[rule_end_path]
+            if last_str == '$':
+                char_path -= 1
+                rule_end_path -= 1
                 last_str = rule[rule_end_path]
-                if last_str == '$':
-                    char_path -= 1
-                    rule_end_path -= 1
-                    last_str = rule[rule_end_path]
-                if (maybe_domain_only and (path_length == 0 or path_length == 1)):
-                    # 判断是否只包含域名的字符串，然后判断一下 path 的长度
-                    # 先决条件满足以后检查一下最后面是不是 / 或分隔符，如果是的话就分域名或者子域名
-                    # 如果不是的话就改用域名关键字
-                    if last_str == '/' or last_str == '^':
-                        if subdomain:
-                            prefer = 'HOST-SUFFIX'
-                        else:
-                            prefer = 'HOST'
+            if (maybe_domain_only and (path_length == 0 or path_length == 1)):
+                # 判断是否只包含域名的字符串，然后判断一下 path 的长度
+                # 先决条件满足以后检查一下最后面是不是 / 或分隔符，如果是的话就分域名或者子域名
+                # 如果不是的话就改用域名关键字
+                if last_str == '/' or last_str == '^':
+                    if subdomain:
+                        prefer = 'HOST-SUFFIX'
                     else:
-                        if unsupport_convert != 'REGEX':
-                            prefer = unsupport_convert
-                        else:
-                            prefer = 'HOST-KEYWORD'
+                        prefer = 'HOST'
                 else:
-                    # 如果明显不是域名就改用正则
-                    prefer = unsupport_convert
-                action = ''
-                if prefer == 'HOST' or prefer == 'HOST-SUFFIX' or prefer == 'HOST-KEYWORD': # 如果是域名就用默认操作
-                    if self.check_str_is_domain(generated_domain) == False: # 如果规则不支持用域名的方式但是用户要求用域名的时候把规则偏好改回正则避免出问题
-                        prefer = 'REGEX'
-                        action = unsupport_action
-                    else: # 如果域名没问题就用域名的规则
-                        action = default_action
-                else:
-                    action = unsupport_action # 如果不是就用正则的
-                if is_exclude_rule and prefer != 'REGEX': # 判断是否为排除规则
-                    action = exclude_action
-                rules.append({'domain': generated_domain, 'regex': generated_regex, 'prefer': prefer, 'action': action})
-        return rules
+                    if unsupport_convert != 'REGEX':
+                        prefer = unsupport_convert
+                    else:
+                        prefer = 'HOST-KEYWORD'
+            else:
+                # 如果明显不是域名就改用正则
+                prefer = unsupport_convert
+            action = ''
+            if prefer == 'HOST' or prefer == 'HOST-SUFFIX' or prefer == 'HOST-KEYWORD': # 如果是域名就用默认操作
+                if self.check_str_is_domain(generated_domain) == False: # 如果规则不支持用域名的方式但是用户要求用域名的时候把规则偏好改回正则避免出问题
+                    prefer = 'REGEX'
+                    action = unsupport_action
+                else: # 如果域名没问题就用域名的规则
+                    action = default_action
+            else:
+                action = unsupport_action # 如果不是就用正则的
+            if is_exclude_rule and prefer != 'REGEX': # 判断是否为排除规则
+                action = exclude_action
+            return Rule(generated_domain, generated_regex, prefer, action)
+        return None
+
+    def __decode_fast_path(self, rule, default_action, unsupport_convert, unsupport_action):
+        # 最常见的两种写法：||example.com^ 与纯域名 example.com，直接得到与逐字符解析完全相同的结果
+        # 其他写法返回 NOT_FAST_PATH，交给逐字符解析
+        match = re_fast_subdomain_rule.fullmatch(rule)
+        if match:
+            domain = match.group(1)
+            if domain == 'localhost' or domain == 'ip6_localhost':
+                return None
+            if self.check_str_is_domain(domain):
+                return Rule(domain, REGEX_SUBDOMAIN, 'HOST-SUFFIX', default_action)
+            return Rule(domain, REGEX_SUBDOMAIN, 'REGEX', unsupport_action)
+        if re_fast_domain_rule.fullmatch(rule):
+            if rule == 'localhost' or rule == 'ip6_localhost':
+                return None
+            prefer = unsupport_convert
+            if prefer == 'HOST' or prefer == 'HOST-SUFFIX' or prefer == 'HOST-KEYWORD':
+                if self.check_str_is_domain(rule):
+                    return Rule(rule, REGEX_DOMAIN, prefer, default_action)
+                return Rule(rule, REGEX_DOMAIN, 'REGEX', unsupport_action)
+            return Rule(rule, REGEX_DOMAIN, prefer, unsupport_action)
+        return NOT_FAST_PATH
 
     def convert_action_name(self, action, target_software = 'surfboard'):
         actions = {
@@ -370,3 +566,11 @@ class AdblockRuleDecoder:
                 return False
         return have_dot
 
+# 子进程中复用的解码器，解析缓存在同一进程处理的多个分片之间共享
+chunk_decoder = None
+
+def decode_adblock_chunk(rules_lines, options):
+    global chunk_decoder
+    if chunk_decoder is None:
+        chunk_decoder = AdblockRuleDecoder()
+    return list(chunk_decoder.iter_decode_adblock_rule(rules_lines, *options))
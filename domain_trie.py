@@ -0,0 +1,94 @@
+# 按标签反转存储的域名后缀树，用于判断一条规则是否已被更宽泛的 +. 规则覆盖
+# 例如 +.example.com 存为 com -> example，节点上记录 SUFFIX 标记
+
+SUFFIX = 1 # +.example.com: 域名本身及所有子域名
+EXACT = 2  # example.com: 仅域名本身
+DOT = 4    # .example.com: 仅子域名
+
+def split_entry(entry):
+    # 拆分 filter_lines 产出的条目，返回 (域名部分, 类型)
+    if entry.startswith('+.'):
+        return entry[2:], SUFFIX
+    if entry.startswith('.'):
+        return entry[1:], DOT
+    return entry, EXACT
+
+class DomainTrie:
+    def __init__(self):
+        # 每个节点是 {标签: 子节点}，None 键存放该节点的类型标记
+        self.root = {}
+
+    def add(self, entry):
+        # 只收录可以精确表达覆盖范围的条目：不含通配符的 +. 和精确域名
+        name, kind = split_entry(entry)
+        if '*' in name or kind == DOT:
+            return False
+        node = self.root
+        for label in reversed(name.split('.')):
+            child = node.get(label)
+            if child is None:
+                child = node[label] = {}
+            node = child
+        node[None] = node.get(None, 0) | kind
+        return True
+
+    def covers(self, entry, strict=False):
+        # 判断 entry 匹配的所有域名是否都被树中的规则匹配
+        # strict=True 时 +.x 不会被自身节点上的 SUFFIX 覆盖，用于树中已包含 entry 本身的情况
+        name, kind = split_entry(entry)
+        labels = name.split('.')
+        last = len(labels) - 1
+        node = self.root
+        flags = 0
+        for depth, label in enumerate(reversed(labels)):
+            # 通配符标签以下无法继续精确比较，只能依赖上层的 SUFFIX
+            if '*' in label:
+                return False
+            node = node.get(label)
+            if node is None:
+                return False
+            flags = node.get(None, 0)
+            if flags & SUFFIX and (depth < last or kind != SUFFIX or not strict):
+                return True
+        return kind == EXACT and bool(flags & EXACT)
+
+def prune_redundant(domains):
+    # 去掉已被更宽泛的 +. 规则覆盖的条目，保持原有顺序，返回 (剩余条目, 删除数量)
+    trie = DomainTrie()
+    for entry in domains:
+        if entry.startswith('+.'):
+            trie.add(entry)
+    kept = [entry for entry in domains if not trie.covers(entry, strict=True)]
+    return kept, len(domains) - len(kept)
+
+# 外部排序时使用的反转键：标签反转后以 \x01 连接，末尾为 \x01\x00 加类型编号
+# 按反转键排序后，+.example.com 排在 example.com、.example.com 以及所有子域名之前，并且这些条目连续出现
+SORT_SEPARATOR = '\x01'
+SORT_KINDS = {SUFFIX: '\x001', EXACT: '\x002', DOT: '\x003'}
+
+def sort_key(entry):
+    name, kind = split_entry(entry)
+    return SORT_SEPARATOR.join(reversed(name.split('.'))) + SORT_SEPARATOR + SORT_KINDS[kind]
+
+def entry_from_sort_key(key):
+    name = '.'.join(reversed(key[:-3].split(SORT_SEPARATOR)))
+    kind = key[-1]
+    if kind == '1':
+        return '+.' + name
+    if kind == '3':
+        return '.' + name
+    return name
+
+def iter_prune_sorted(keys):
+    # keys 为按 sort_key 排序并去重的反转键，流式产出未被更宽泛的 +. 规则覆盖的条目（原格式）
+    # 与 prune_redundant 的判断相同，但只需要保存当前路径上的 +. 条目，而不是整棵后缀树
+    path = []
+    for key in keys:
+        prefix = key[:-2]
+        while path and not prefix.startswith(path[-1]):
+            path.pop()
+        if path:
+            continue
+        if key[-1] == '1' and '*' not in prefix:
+            path.append(prefix)
+        yield entry_from_sort_key(key)
@@ -0,0 +1,101 @@
+import heapq
+import os
+import sys
+import tempfile
+
+# 外部排序：内存中的条目超过预算后排序去重写入临时文件（有序段），最后对所有有序段做 k 路归并
+# 产出的顺序与 sorted(set(items)) 完全相同；条目为不含换行符的字符串
+
+DEFAULT_SORT_OPTIONS = {
+    'memory_budget': 0,  # 内存中缓存条目的估计大小上限（字节），0 为全部在内存中排序
+    'tmp_dir': None,     # 有序段的临时目录，None 为系统默认
+}
+# 集合中每个条目除字符串本身以外的大致开销（哈希表槽位与引用）
+ENTRY_OVERHEAD = 64
+# 一次归并同时打开的有序段数量上限，超出时先分批合并
+MERGE_FAN_IN = 64
+
+def iter_run(path):
+    with open(path, 'r', encoding='utf-8', newline='\n') as f:
+        for line in f:
+            yield line[:-1]
+
+def iter_unique(items):
+    # 有序输入中去掉相邻的重复条目
+    previous = None
+    for item in items:
+        if item != previous:
+            yield item
+            previous = item
+
+class ExternalSorter:
+    # add 收集条目，迭代时按顺序产出去重后的全部条目，可以多次迭代；用完后调用 close 删除临时文件
+    def __init__(self, memory_budget, tmp_dir=None):
+        self.memory_budget = memory_budget
+        self.tmp_dir = tmp_dir
+        self.buffer = set()
+        self.buffer_bytes = 0
+        self.runs = []
+
+    def add(self, item):
+        if item in self.buffer:
+            return
+        self.buffer.add(item)
+        self.buffer_bytes += sys.getsizeof(item) + ENTRY_OVERHEAD
+        if self.buffer_bytes >= self.memory_budget:
+            self.spill()
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def write_run(self, items):
+        fd, path = tempfile.mkstemp(prefix='sort-', suffix='.run', dir=self.tmp_dir)
+        with open(fd, 'w', encoding='utf-8', newline='\n') as f:
+            for item in items:
+                f.write(item + '\n')
+        return path
+
+    def spill(self):
+        if not self.buffer:
+            return
+        self.runs.append(self.write_run(sorted(self.buffer)))
+        self.buffer = set()
+        self.buffer_bytes = 0
+
+    def merge(self, paths):
+        path = self.write_run(iter_unique(heapq.merge(*[iter_run(path) for path in paths])))
+        for old_path in paths:
+            os.remove(old_path)
+        return path
+
+    def finish(self):
+        # 把所有有序段归并成一个，之后每次迭代只需要顺序读取一个文件
+        if not self.runs:
+            return
+        self.spill()
+        while len(self.runs) > 1:
+            self.runs = [self.merge(self.runs[i:i + MERGE_FAN_IN]) for i in range(0, len(self.runs), MERGE_FAN_IN)]
+
+    def __iter__(self):
+        # 没有写出过有序段时直接在内存中排序
+        if not self.runs:
+            return iter(sorted(self.buffer))
+        self.finish()
+        return iter_run(self.runs[0])
+
+    def close(self):
+        for path in self.runs:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.runs = []
+        self.buffer = set()
+        self.buffer_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
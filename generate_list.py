@@ -1,8 +1,25 @@
+import argparse
+import hashlib
 import requests
 import yaml
 import json
 import os
 import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from source_cache import SourceCache
+from build_report import BuildReport
+from domain_trie import DomainTrie, entry_from_sort_key, iter_prune_sorted, prune_redundant, sort_key
+from external_sort import DEFAULT_SORT_OPTIONS, ExternalSorter
+from decode_adblock import AdblockRuleDecoder, process_pool_context
+import mrs
 
 # --- 1. 自定义 Dumper：强制单引号 + 缩进 ---
 class QuotedDumper(yaml.Dumper):
@@ -15,158 +32,869 @@ def quoted_presenter(dumper, data):
 QuotedDumper.add_representer(str, quoted_presenter)
 # ----------------------------------------
 
-def download_file(url):
-    try:
-        print(f"Downloading: {url}")
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"Error downloading {url}: {e}")
-        return ""
+# 下载参数默认值，可在 config.json 的 download 字段中覆盖
+DEFAULT_DOWNLOAD_OPTIONS = {
+    'workers': 8,       # 并发下载线程数
+    'per_host': 4,      # 同一主机的最大并发连接数
+    'timeout': 30,      # 连接/读取超时（秒）
+    'retries': 3,       # 失败重试次数
+    'backoff': 1.0,     # 重试退避系数：1s, 2s, 4s...
+}
 
-def filter_lines(content, rule):
-    lines = content.splitlines()
-    filtered_lines = []
-    
-    # 锚点正则 (用于处理 |http...)
-    re_start_anchor = re.compile(r'^\|https?://([a-zA-Z0-9.-]+)(?:[:/].*|\||\^)?$')
-    re_end_anchor = re.compile(r'^([a-zA-Z0-9.-]+)\|(?:\^)?$')
+# 解析参数默认值，可在 config.json 的 parse 字段或命令行 --workers 中覆盖
+DEFAULT_PARSE_OPTIONS = {
+    'workers': 1,           # 解析进程数，1 为在下载线程中直接解析，0 为使用全部 CPU 核心
+    'chunk_lines': 20000,   # 每次交给子进程的行数
+}
 
-    # 定义“无效字符集合”：域名中不应该出现这些符号
-    # / : ? = 路径或参数
-    # ^ = AdBlock 分隔符（如果出现在中间）
-    invalid_chars = ['/', ':', '?', '^']
+# filter_lines 的解析版本号，修改过滤逻辑后需要递增，使缓存的解析结果失效
+FILTER_VERSION = 1
+# 生成流程的版本号，修改输出格式或处理步骤后需要递增，使所有输出在下次运行时重新生成
+GENERATOR_VERSION = 1
+MANIFEST_PATH = os.path.join('generated_rules', 'manifest.json')
 
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('!') or line.startswith('#'):
-            continue
-            
-        if rule['type'] == 'adblock':
-            domain_candidate = ""
-            is_wildcard_rule = False
+class Downloader:
+    def __init__(self, options=None, cache=None, parser=None, report=None):
+        self.options = dict(DEFAULT_DOWNLOAD_OPTIONS, **(options or {}))
+        self.cache = cache
+        self.report = report or BuildReport()
+        self.parser = parser or LineParser(report=self.report)
+        self.session = self.create_session()
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
 
-            # --- 1. 提取规则中的域名部分 ---
-            
-            # Case A: 以 || 开头 (AdBlock 核心规则)
-            if line.startswith('||'):
-                # 去掉开头的 || 和结尾的 ^
-                domain_candidate = line[2:].rstrip('^')
-                # 标记处理方式：如果不含通配符，可能需要加 +.
-                if '*' not in domain_candidate:
-                    is_wildcard_rule = False # 需要加 +.
-                else:
-                    is_wildcard_rule = True  # 原样保留
-
-            # Case B: 起始锚点 |http://...
-            elif line.startswith('|'):
-                match_start = re_start_anchor.match(line)
-                if match_start:
-                    domain_candidate = match_start.group(1)
-                    is_wildcard_rule = True # 精确匹配，不需要加 +.
-
-            # Case C: 结束锚点 ...|
-            elif line.endswith('|'):
-                match_end = re_end_anchor.match(line)
-                if match_end:
-                    domain_candidate = match_end.group(1)
-                    is_wildcard_rule = True
-
-            # Case D: 普通行 (纯域名或通配符)
+    def create_session(self):
+        # 共享连接池 (keep-alive)，并对临时性错误按指数退避重试
+        session = requests.Session()
+        session.headers['User-Agent'] = 'Mozilla/5.0'
+        retry = Retry(
+            total=self.options['retries'],
+            backoff_factor=self.options['backoff'],
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+        )
+        pool_size = max(self.options['workers'], self.options['per_host'])
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.options['per_host'])
+            return self._host_semaphores[host]
+
+    def download(self, url, rules=()):
+        # 流式下载：响应按行读取，同时写入缓存并为每种规则类型过滤进各自的域名集合
+        # 返回 {'url', 'not_modified', 'empty', 'domains'}；304 时 domains 为 None，需要时从缓存读取
+        headers = self.cache.conditional_headers(url) if self.cache else {}
+        parsers = {parse_key(rule): rule for rule in rules}
+        body = None
+        with self.host_semaphore(url):
+            try:
+                print(f"Downloading: {url}")
+                with self.session.get(url, headers=headers, timeout=self.options['timeout'], stream=True) as response:
+                    if response.status_code == 304 and headers:
+                        print(f"Not modified: {url}")
+                        self.report.record_source(url, status='not_modified')
+                        return {'url': url, 'not_modified': True, 'empty': False, 'domains': None}
+                    response.raise_for_status()
+                    if response.encoding is None:
+                        response.encoding = 'utf-8'
+                    body = self.cache.body_writer(
+                        url,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified'),
+                    ) if self.cache else None
+                    line_count = 0
+                    def iter_body_lines():
+                        nonlocal line_count
+                        for line in response.iter_lines(decode_unicode=True):
+                            line_count += 1
+                            if body:
+                                body.write(line)
+                            yield line
+                    domains = self.parser.parse(iter_body_lines(), parsers.values())
+                    empty = line_count == 0
+                    # 从连接中实际读取的字节数（压缩传输时为压缩后的大小）
+                    bytes_in = response.raw.tell()
+                    self.report.add_io('fetch', bytes_in=bytes_in, lines=line_count)
+                    self.report.record_source(url, status='downloaded', bytes=bytes_in, lines=line_count)
+                    if body:
+                        body.close()
+                        for key, key_domains in domains.items():
+                            store_parsed_domains(self.cache, url, key, key_domains)
+                        # 外部排序的解析结果写入缓存后即关闭，之后由 load_source_domains 从缓存文件逐行读取，
+                        # 所有上游的域名集合不会同时留在内存中
+                        if any(isinstance(key_domains, ExternalSorter) for key_domains in domains.values()):
+                            domains = None
+                    return {'url': url, 'not_modified': False, 'empty': empty, 'domains': domains}
+            except requests.RequestException as e:
+                print(f"Error downloading {url}: {e}")
+                self.report.record_source(url, status='error', error=str(e))
+                if body:
+                    body.discard()
+                # 下载失败时退回到上一次缓存的内容
+                if headers:
+                    print(f"Using cached copy of {url}")
+                    self.report.record_source(url, status='cached')
+                    return {'url': url, 'not_modified': True, 'empty': False, 'domains': None}
+                return {'url': url, 'not_modified': False, 'empty': True, 'domains': {key: set() for key in parsers}}
+
+    def fetch_all(self, rules):
+        # 每个 URL 只下载一次，返回 {url: 下载结果}，合并顺序由调用方按配置顺序决定
+        url_rules = url_rules_map(rules)
+        with ThreadPoolExecutor(max_workers=self.options['workers']) as pool:
+            sources = pool.map(self.download, url_rules.keys(), url_rules.values())
+            return dict(zip(url_rules.keys(), sources))
+
+def filter_chunk(lines, rules):
+    # 过滤一批行，可在子进程中运行
+    # 返回 ({parse_key: 域名集合}, {parse_key: {LINE_*: 行数}}, 耗时秒数)
+    start = time.perf_counter()
+    domains = {}
+    outcomes = {}
+    for rule in rules:
+        key_domains = domains[parse_key(rule)] = set()
+        counts = outcomes[parse_key(rule)] = {}
+        for line in lines:
+            domain, outcome = classify_line(line, rule)
+            counts[outcome] = counts.get(outcome, 0) + 1
+            if domain is not None:
+                key_domains.add(domain)
+    return domains, outcomes, time.perf_counter() - start
+
+class LineParser:
+    # 按 chunk_lines 行分片过滤；workers 大于 1 时分片交给进程池，否则在当前线程中直接过滤
+    # 各分片的结果按提交顺序合并成集合，结果与串行过滤完全一致
+    # sort_options 的 memory_budget 不为 0 时结果合并进 ExternalSorter 而不是集合，由调用方关闭
+    def __init__(self, options=None, report=None, sort_options=None):
+        self.options = dict(DEFAULT_PARSE_OPTIONS, **(options or {}))
+        self.report = report or BuildReport()
+        self.sort_options = dict(DEFAULT_SORT_OPTIONS, **(sort_options or {}))
+        self.workers = self.options['workers'] or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_pool_context()) if self.workers > 1 else None
+
+    def parse(self, lines, rules):
+        rules = list({parse_key(rule): rule for rule in rules}.values())
+        if self.sort_options['memory_budget']:
+            domains = {parse_key(rule): ExternalSorter(self.sort_options['memory_budget'], self.sort_options['tmp_dir'])
+                       for rule in rules}
+        else:
+            domains = {parse_key(rule): set() for rule in rules}
+        try:
+            return self._parse(lines, rules, domains)
+        except BaseException:
+            for key_domains in domains.values():
+                if isinstance(key_domains, ExternalSorter):
+                    key_domains.close()
+            raise
+
+    def _parse(self, lines, rules, domains):
+        pending = deque()
+        def merge(result):
+            chunk_domains, outcomes, seconds = result
+            for key, key_domains in chunk_domains.items():
+                domains[key].update(key_domains)
+            for key, counts in outcomes.items():
+                self.report.count(f'lines:{key}', counts)
+            self.report.add_time('parse', seconds)
+        def submit(chunk):
+            if self.pool is None:
+                merge(filter_chunk(chunk, rules))
+                return
+            pending.append(self.pool.submit(filter_chunk, chunk, rules))
+            # 限制同时在途的分片数量，避免下载比解析快时内存无限增长
+            if len(pending) > self.workers * 2:
+                merge(pending.popleft().result())
+        line_count = 0
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= self.options['chunk_lines']:
+                line_count += len(chunk)
+                submit(chunk)
+                chunk = []
+        if chunk:
+            line_count += len(chunk)
+            submit(chunk)
+        while pending:
+            merge(pending.popleft().result())
+        self.report.add_io('parse', lines=line_count)
+        return domains
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+def rule_urls(rule):
+    if isinstance(rule['url'], list):
+        return rule['url']
+    return [rule['url']]
+
+def allowlist_rules(rule, rules_by_name):
+    # 规则的 allowlist 字段引用其他规则的 name，可以是字符串或列表
+    names = rule.get('allowlist', [])
+    if isinstance(names, str):
+        names = [names]
+    allow_rules = []
+    for name in names:
+        allow_rule = rules_by_name[name]
+        # domain 类型直接使用其域名列表，adblock 类型需要把 @@ 例外规则还原成域名
+        allow_type = 'domain' if allow_rule['type'] == 'domain' else 'allowlist'
+        allow_rules.append({'name': name, 'type': allow_type, 'url': allow_rule['url']})
+    return allow_rules
+
+# 锚点正则 (用于处理 |http...)
+re_start_anchor = re.compile(r'^\|https?://([a-zA-Z0-9.-]+)(?:[:/].*|\||\^)?$')
+re_end_anchor = re.compile(r'^([a-zA-Z0-9.-]+)\|(?:\^)?$')
+
+# 定义“无效字符集合”：域名中不应该出现这些符号
+# / : ? = 路径或参数
+# ^ = AdBlock 分隔符（如果出现在中间）
+invalid_chars = ['/', ':', '?', '^']
+
+# classify_line 返回的处理结果，用于构建报告中的逐行统计
+LINE_EMPTY = 'empty'                  # 空行
+LINE_COMMENT = 'comment'              # ! 或 # 开头的注释
+LINE_NO_DOMAIN = 'no_domain'          # 无法提取出域名（锚点不匹配等）
+LINE_INVALID_CHARS = 'invalid_chars'  # 含有 invalid_chars 中的字符
+LINE_SUFFIX = 'suffix'                # || 规则转换为 +.
+LINE_WILDCARD = 'wildcard'            # 含有 * 的通配符规则，原样保留
+LINE_EXACT = 'exact'                  # 精确域名，原样保留
+LINE_UNSUPPORTED = 'unsupported'      # 不支持的规则类型
+
+def filter_line(line, rule):
+    # 处理单行规则，返回提取出的域名；不需要保留的行返回 None
+    return classify_line(line, rule)[0]
+
+def classify_line(line, rule):
+    # 与 filter_line 相同，同时返回该行的处理结果: (域名或 None, LINE_*)
+    line = line.strip()
+    if not line:
+        return None, LINE_EMPTY
+    if line.startswith('!') or line.startswith('#'):
+        return None, LINE_COMMENT
+        
+    if rule['type'] == 'adblock':
+        domain_candidate = ""
+        is_wildcard_rule = False
+
+        # --- 1. 提取规则中的域名部分 ---
+        
+        # Case A: 以 || 开头 (AdBlock 核心规则)
+        if line.startswith('||'):
+            # 去掉开头的 || 和结尾的 ^
+            domain_candidate = line[2:].rstrip('^')
+            # 标记处理方式：如果不含通配符，可能需要加 +.
+            if '*' not in domain_candidate:
+                is_wildcard_rule = False # 需要加 +.
             else:
-                domain_candidate = line.rstrip('^')
-                if '*' in domain_candidate:
-                    is_wildcard_rule = True
-                else:
-                    # 如果不是 || 开头，通常认为是精确域名
-                    is_wildcard_rule = True 
-
-            # --- 2. 严格的有效性检查 (Pure Domain Check) ---
-            
-            # 如果提取失败，跳过
-            if not domain_candidate:
-                continue
+                is_wildcard_rule = True  # 原样保留
 
-            # 关键修复：检查是否包含非法字符 (路径、端口、参数、分隔符)
-            # 例如: acronymfinder.com/*/housebanners 包含 / -> 丢弃
-            if any(char in domain_candidate for char in invalid_chars):
-                continue
-                
-            # --- 3. 添加到结果列表 ---
-            
-            # 如果是 || 提取出来的纯域名 (不含*)，转换为 +.domain
-            if line.startswith('||') and not is_wildcard_rule:
-                filtered_lines.append(f"+.{domain_candidate}")
+        # Case B: 起始锚点 |http://...
+        elif line.startswith('|'):
+            match_start = re_start_anchor.match(line)
+            if match_start:
+                domain_candidate = match_start.group(1)
+                is_wildcard_rule = True # 精确匹配，不需要加 +.
+
+        # Case C: 结束锚点 ...|
+        elif line.endswith('|'):
+            match_end = re_end_anchor.match(line)
+            if match_end:
+                domain_candidate = match_end.group(1)
+                is_wildcard_rule = True
+
+        # Case D: 普通行 (纯域名或通配符)
+        else:
+            domain_candidate = line.rstrip('^')
+            if '*' in domain_candidate:
+                is_wildcard_rule = True
             else:
-                filtered_lines.append(domain_candidate)
+                # 如果不是 || 开头，通常认为是精确域名
+                is_wildcard_rule = True 
+
+        # --- 2. 严格的有效性检查 (Pure Domain Check) ---
+        
+        # 如果提取失败，跳过
+        if not domain_candidate:
+            return None, LINE_NO_DOMAIN
+
+        # 关键修复：检查是否包含非法字符 (路径、端口、参数、分隔符)
+        # 例如: acronymfinder.com/*/housebanners 包含 / -> 丢弃
+        if any(char in domain_candidate for char in invalid_chars):
+            return None, LINE_INVALID_CHARS
+            
+        # --- 3. 返回结果 ---
         
-        elif rule['type'] == 'domain':
-             filtered_lines.append(line)
+        # 如果是 || 提取出来的纯域名 (不含*)，转换为 +.domain
+        if line.startswith('||') and not is_wildcard_rule:
+            return f"+.{domain_candidate}", LINE_SUFFIX
+        if '*' in domain_candidate:
+            return domain_candidate, LINE_WILDCARD
+        return domain_candidate, LINE_EXACT
+    
+    elif rule['type'] == 'domain':
+         return line, LINE_EXACT
+
+    elif rule['type'] == 'allowlist':
+        # 白名单：去掉例外规则的 @@ 前缀后按 adblock 规则提取域名
+        if line.startswith('@@'):
+            line = line[2:]
+        return classify_line(line, ADBLOCK_RULE)
+
+    return None, LINE_UNSUPPORTED
 
-    return sorted(list(set(filtered_lines)))
+ADBLOCK_RULE = {'type': 'adblock'}
+
+def iter_filtered(lines, rule):
+    # 流式过滤：逐行读取，逐个产出域名
+    for line in lines:
+        domain = classify_line(line, rule)[0]
+        if domain is not None:
+            yield domain
+
+def filter_lines(content, rule):
+    # content 可以是整段文本，也可以是逐行产出的可迭代对象
+    if isinstance(content, str):
+        content = content.splitlines()
+    return sorted(set(iter_filtered(content, rule)))
+
+def collect_domains(rule, sources, cache, parser=None):
+    # filter_lines 按行处理，逐个上游过滤后再合并，结果与拼接后整体过滤一致
+    merged = set()
+    for url in rule_urls(rule):
+        merged.update(load_source_domains(sources[url], rule, cache, parser))
+    return merged
+
+def parse_key(rule):
+    return f"{rule['type']}-v{FILTER_VERSION}"
+
+def load_source_domains(source, rule, cache, parser=None):
+    # 下载时已经边读边过滤，未变化的上游则复用缓存的解析结果，跳过 filter_lines
+    key = parse_key(rule)
+    if source['domains'] is not None:
+        return source['domains'][key]
+    domains = cache.load_domains(source['url'], key)
+    if domains is not None:
+        if source['not_modified']:
+            print(f"Reusing parsed domains of {source['url']}")
+        return domains
+    if parser is not None:
+        domains = parser.parse(cache.iter_body(source['url']), [rule])[key]
+    else:
+        domains = set(iter_filtered(cache.iter_body(source['url']), rule))
+    store_parsed_domains(cache, source['url'], key, domains)
+    if isinstance(domains, ExternalSorter):
+        return cache.load_domains(source['url'], key) or []
+    return domains
+
+def store_parsed_domains(cache, url, key, domains):
+    # 外部排序的结果已经有序，直接流式写入缓存后关闭
+    if isinstance(domains, ExternalSorter):
+        try:
+            cache.store_domains(url, key, domains, presorted=True)
+        finally:
+            domains.close()
+    else:
+        cache.store_domains(url, key, domains)
+
+# 可以直接写成单引号字符串的条目：可打印、不含空格与换行，与 QuotedDumper 的输出完全一致
+# 其余条目（含空格、控制字符等）交给 QuotedDumper 单独处理，保证逐字节一致
+re_clash_plain_item = re.compile('[\x21-\x7E\xA0-\u2027\u202A-\uD7FF\uE000-\uFEFE\uFF00-\uFFFD\U00010000-\U0010FFFE]*')
+CLASH_WRITE_BATCH = 8192
+
+def format_clash_item(domain):
+    if re_clash_plain_item.fullmatch(domain):
+        return "  - '" + domain.replace("'", "''") + "'\n"
+    content = yaml.dump({"payload": [domain]}, Dumper=QuotedDumper, sort_keys=False, allow_unicode=True)
+    return content[content.index('\n') + 1:]
+
+def write_clash_payload(f, domains):
+    # 流式写出 payload，按批拼接后写入，返回条目数量
+    count = 0
+    batch = []
+    for domain in domains:
+        if count == 0:
+            f.write("'payload':\n")
+        batch.append(format_clash_item(domain))
+        count += 1
+        if len(batch) >= CLASH_WRITE_BATCH:
+            f.write(''.join(batch))
+            batch.clear()
+    if count == 0:
+        f.write("'payload': []\n")
+    f.write(''.join(batch))
+    return count
+
+def parse_clash_item(line):
+    # 还原 format_clash_item 写出的单引号字符串，其他写法返回 None
+    if line.startswith("  - '") and line.endswith("'\n") and "'" not in line[5:-2].replace("''", ''):
+        return line[5:-2].replace("''", "'")
+    return None
+
+def read_clash_payload(path):
+    # 读取 write_clash_payload 写出的文件，返回域名集合；文件不存在时返回 None
+    # 逐行还原单引号字符串，遇到其他写法时整体交给 yaml 解析
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except OSError:
+        return None
+    with f:
+        domains = set()
+        for line in f:
+            if line == "'payload':\n" or line == "'payload': []\n":
+                continue
+            domain = parse_clash_item(line)
+            if domain is not None:
+                domains.add(domain)
+                continue
+            f.seek(0)
+            return set(yaml.safe_load(f)['payload'] or [])
+    return domains
 
 def generate_clash_domain_list(rule, domains, filename):
-    data = {
-        "payload": domains
-    }
-    content = yaml.dump(data, Dumper=QuotedDumper, sort_keys=False, allow_unicode=True)
-    
     output_path = os.path.join('generated_rules', filename)
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-    print(f"Generated {output_path} with {len(domains)} rules.")
+        count = write_clash_payload(f, domains)
+    print(f"Generated {output_path} with {count} rules.")
+
+def generate_clash_mrs(rule, domains, filename, sort_options=None):
+    # 把域名编译成 mihomo 的 MRS 二进制规则集 (domain behavior)
+    # sort_options 的 memory_budget 不为 0 时展开后的 key 同样使用外部排序
+    output_path = os.path.join('generated_rules', filename)
+    if not mrs.zstd_available():
+        print(f"Skipping {output_path}: zstd support is unavailable, install the zstandard package.")
+        return
+    sort_options = dict(DEFAULT_SORT_OPTIONS, **(sort_options or {}))
+    count = mrs.write_mrs(output_path, domains, sort_options['memory_budget'], sort_options['tmp_dir'])
+    if count == 0:
+        print(f"Skipping {output_path}: no valid domains.")
+        return
+    print(f"Generated {output_path} with {count} rules.")
 
 def generate_adguard_home_list(rule, domains, filename):
+    # domains 可以是任意可迭代对象，按批写出，不在内存中拼接整个文件
+    output_path = os.path.join('generated_rules', filename)
+    count = 0
+    separator = ''
     lines = []
-    for domain in domains:
-        if rule['exclude_action'] == 'IGNORE':
-             # 还原逻辑：
-             if domain.startswith('+.'):
-                 clean_domain = domain[2:]
-                 lines.append(f"||{clean_domain}^")
-             elif '*' not in domain and not domain.startswith('.'):
-                 lines.append(f"||{domain}^")
-             else:
-                 lines.append(domain)
-    
-    content = "\n".join(lines)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for domain in domains:
+            count += 1
+            if rule['exclude_action'] == 'IGNORE':
+                 # 还原逻辑：
+                 if domain.startswith('+.'):
+                     clean_domain = domain[2:]
+                     lines.append(f"||{clean_domain}^")
+                 elif '*' not in domain and not domain.startswith('.'):
+                     lines.append(f"||{domain}^")
+                 else:
+                     lines.append(domain)
+                 if len(lines) >= CLASH_WRITE_BATCH:
+                     f.write(separator + "\n".join(lines))
+                     separator = "\n"
+                     lines.clear()
+        if lines:
+            f.write(separator + "\n".join(lines))
+    print(f"Generated {output_path} with {count} rules.")
+
+def write_sorted_domain_diff(filename, previous_path, domains, base, target):
+    # 与 write_domain_diff 的输出相同，但上一次的 Clash 列表与 domains 都按顺序逐个比较，不需要读入内存
+    # 上一次的列表不存在、含有需要 yaml 解析的写法或不是有序的时返回 None，由调用方改用 write_domain_diff
+    try:
+        f = open(previous_path, 'r', encoding='utf-8')
+    except OSError:
+        return None
+    output_path = os.path.join('generated_rules', filename)
+    removed = 0
+    added = 0
+    with f, open(output_path + '.tmp', 'w', encoding='utf-8') as out, tempfile.TemporaryFile('w+', encoding='utf-8') as added_lines:
+        out.write(f"# base: {base}\n# target: {target}\n")
+        new_items = iter(domains)
+        new = next(new_items, None)
+        last = None
+        for line in f:
+            if line == "'payload':\n" or line == "'payload': []\n":
+                continue
+            old = parse_clash_item(line)
+            if old is None or (last is not None and old <= last):
+                break
+            last = old
+            while new is not None and new < old:
+                added_lines.write(f"+{new}\n")
+                added += 1
+                new = next(new_items, None)
+            if new == old:
+                new = next(new_items, None)
+            else:
+                out.write(f"-{old}\n")
+                removed += 1
+        else:
+            while new is not None:
+                added_lines.write(f"+{new}\n")
+                added += 1
+                new = next(new_items, None)
+            added_lines.seek(0)
+            shutil.copyfileobj(added_lines, out)
+            out.close()
+            os.replace(output_path + '.tmp', output_path)
+            print(f"Generated {output_path} with {added} added and {removed} removed entries.")
+            return {'file': filename, 'base': base, 'added': added, 'removed': removed}
+    os.remove(output_path + '.tmp')
+    return None
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    with open(MANIFEST_PATH + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4, sort_keys=True)
+    os.replace(MANIFEST_PATH + '.tmp', MANIFEST_PATH)
+
+def rule_input_hash(rule, rules_by_name, cache):
+    # 一条规则的全部输入：配置项、引用的白名单配置、所有上游内容的哈希以及生成器版本
+    # 有上游没有可用的缓存内容时返回 None，此时总是重新生成
+    config_entries = [rule] + [rules_by_name[allow_rule['name']] for allow_rule in allowlist_rules(rule, rules_by_name)]
+    source_hashes = {}
+    for entry in config_entries:
+        for url in rule_urls(entry):
+            source_hashes[url] = cache.body_hash(url)
+            if source_hashes[url] is None:
+                return None
+    inputs = {
+        'generator_version': GENERATOR_VERSION,
+        'filter_version': FILTER_VERSION,
+        'config': config_entries,
+        'sources': source_hashes,
+    }
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def full_rule_input_hash(output):
+    # 完整配置的全部输入：配置项、各部分文件内容的哈希以及生成器版本；有文件读不到时返回 None
+    file_hashes = {}
+    for part in output['parts']:
+        for path in part.get('files', ()):
+            try:
+                with open(path, 'rb') as f:
+                    file_hashes[path] = hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                return None
+    inputs = {
+        'generator_version': GENERATOR_VERSION,
+        'config': output,
+        'files': file_hashes,
+    }
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+def generate_full_rule(output, decoder, report, previous=None):
+    # 按 full_rule_outputs 中的一项拼接完整配置，流式写入 generated_rules/<output_name>
+    # 返回 (清单条目, 是否重新生成)
+    output_name = output['output_name']
+    output_path = os.path.join('generated_rules', output_name)
+    inputs = full_rule_input_hash(output)
+    if inputs is not None and previous and previous['inputs'] == inputs and os.path.exists(output_path):
+        print(f"Skipping {output_name}: parts and config are unchanged.")
+        report.record_rule(output_name, status='unchanged')
+        return previous, False
+    with report.stage('assemble'):
+        with open(output_path + '.tmp', 'w', encoding='utf-8') as f:
+            decoder.write_full_rule(output['parts'], f, output.get('target_software', 'surfboard'))
+        os.replace(output_path + '.tmp', output_path)
+    size = os.path.getsize(output_path)
+    report.add_io('assemble', bytes_out=size)
+    report.record_rule(output_name, status='built', outputs={output_name: size})
+    print(f"Generated {output_path}.")
+    return {'inputs': inputs, 'outputs': [output_name]}, True
+
+def write_domain_diff(filename, previous, domains, base, target):
+    # 相对上一次生成结果的增量：- 开头为删除的条目，+ 开头为新增的条目
+    removed = sorted(previous.difference(domains))
+    added = sorted(set(domains).difference(previous))
     output_path = os.path.join('generated_rules', filename)
     with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-    print(f"Generated {output_path} with {len(domains)} rules.")
+        f.write(f"# base: {base}\n# target: {target}\n")
+        for domain in removed:
+            f.write(f"-{domain}\n")
+        for domain in added:
+            f.write(f"+{domain}\n")
+    print(f"Generated {output_path} with {len(added)} added and {len(removed)} removed entries.")
+    return {'file': filename, 'base': base, 'added': len(added), 'removed': len(removed)}
+
+def url_rules_map(rules):
+    # {url: [使用该 URL 的规则]}，每个 URL 只下载一次，下载时为这些规则的类型分别过滤
+    url_rules = {}
+    for rule in rules:
+        for url in rule_urls(rule):
+            url_rules.setdefault(url, []).append(rule)
+    return url_rules
+
+class RuleBuilder:
+    # 一条规则从上游域名集合到输出文件的全部处理：合并去重、减去白名单、裁剪以及写出
+    # 白名单的后缀树在多条规则之间共享，白名单上游变化后需要调用 forget_allowlist 重新建立
+    # sort_options 的 memory_budget 不为 0 时使用外部排序，见 collect_external
+    def __init__(self, cache, parser, rules_by_name, report=None, sort_options=None):
+        self.cache = cache
+        self.parser = parser
+        self.rules_by_name = rules_by_name
+        self.report = report or BuildReport()
+        self.sort_options = dict(DEFAULT_SORT_OPTIONS, **(sort_options or {}))
+        self.allow_indexes = {}
+
+    def forget_allowlist(self, name):
+        self.allow_indexes.pop(name, None)
 
-def main():
+    def allow_index(self, allow_rule, sources):
+        if allow_rule['name'] not in self.allow_indexes:
+            # 重复的条目在后缀树中只占一个节点，逐个上游直接加入，不需要先合并成集合
+            index = DomainTrie()
+            for url in rule_urls(allow_rule):
+                for entry in load_source_domains(sources[url], allow_rule, self.cache, self.parser):
+                    index.add(entry)
+            self.allow_indexes[allow_rule['name']] = index
+        return self.allow_indexes[allow_rule['name']]
+
+    def update(self, rule, sources, previous=None):
+        # 输入没有变化且输出文件都在时跳过，返回 (清单条目, 是否重新生成)；所有上游都为空时条目为 previous
+        report = self.report
+        rule_sources = [sources[u] for u in rule_urls(rule)]
+        if all(s['empty'] for s in rule_sources):
+            print(f"Skipping {rule['name']} due to empty content.")
+            report.record_rule(rule['name'], status='empty')
+            return previous, False
+
+        inputs = rule_input_hash(rule, self.rules_by_name, self.cache)
+        if inputs is not None and previous and previous['inputs'] == inputs and all(
+                os.path.exists(os.path.join('generated_rules', filename)) for filename in previous['outputs']):
+            print(f"Skipping {rule['name']}: sources and config are unchanged.")
+            report.record_rule(rule['name'], status='unchanged')
+            return previous, False
+
+        if self.sort_options['memory_budget']:
+            domains, counts = self.collect_external(rule, sources)
+        else:
+            domains, counts = self.collect(rule, sources)
+        try:
+            entry = self.emit(rule, domains, counts['entries'], previous, inputs)
+        finally:
+            if isinstance(domains, ExternalSorter):
+                domains.close()
+        output_sizes = {filename: os.path.getsize(os.path.join('generated_rules', filename)) for filename in entry['outputs']}
+        report.add_io('emit', bytes_out=sum(output_sizes.values()), lines=counts['entries'])
+        report.record_rule(rule['name'], status='built', outputs=output_sizes, **counts)
+        return entry, True
+
+    def collect(self, rule, sources):
+        # 在内存中合并排序，返回 (有序条目列表, 各步骤的条目数)
+        report = self.report
+        with report.stage('dedup'):
+            filtered_domains = sorted(collect_domains(rule, sources, self.cache, self.parser))
+        merged_count = len(filtered_domains)
+
+        # 从黑名单中减去白名单：白名单编入后缀树，每个条目只需按标签查找一次
+        allowed_count = 0
+        with report.stage('filter'):
+            for allow_rule in allowlist_rules(rule, self.rules_by_name):
+                index = self.allow_index(allow_rule, sources)
+                before = len(filtered_domains)
+                filtered_domains = [entry for entry in filtered_domains if not index.covers(entry)]
+                allowed_count += before - len(filtered_domains)
+                print(f"Removed {before - len(filtered_domains)} entries allowed by {allow_rule['name']} from {rule['name']}.")
+
+        # 删除已被更宽泛的 +. 规则覆盖的条目，Clash 与 AdGuard Home 输出都使用裁剪后的列表
+        pruned_count = 0
+        if rule.get('prune_redundant', True):
+            with report.stage('dedup'):
+                filtered_domains, pruned_count = prune_redundant(filtered_domains)
+            print(f"Pruned {pruned_count} entries covered by broader +. rules from {rule['name']}.")
+        return filtered_domains, {'merged': merged_count, 'allowlist_removed': allowed_count,
+                                  'pruned': pruned_count, 'entries': len(filtered_domains)}
+
+    def collect_external(self, rule, sources):
+        # 外部排序：各上游的条目在超出内存预算后分段排序写入临时文件，再归并成一个有序文件
+        # 需要裁剪时先按反转键排序，使每条 +. 规则紧挨在它覆盖的条目之前，流式裁剪后再按原顺序排序一次
+        # 返回 (可重复迭代的 ExternalSorter, 各步骤的条目数)，最终顺序与 collect 完全相同
+        report = self.report
+        budget = self.sort_options['memory_budget']
+        tmp_dir = self.sort_options['tmp_dir']
+        prune = rule.get('prune_redundant', True)
+        allow_indexes = [self.allow_index(allow_rule, sources) for allow_rule in allowlist_rules(rule, self.rules_by_name)]
+        merged_count = 0
+        allowed_count = 0
+        kept_count = 0
+        def iter_allowed(keys):
+            nonlocal merged_count, allowed_count
+            for key in keys:
+                merged_count += 1
+                entry = entry_from_sort_key(key) if prune else key
+                if any(index.covers(entry) for index in allow_indexes):
+                    allowed_count += 1
+                    continue
+                yield key
+        with report.stage('dedup'):
+            with ExternalSorter(budget, tmp_dir) as merged:
+                for url in rule_urls(rule):
+                    for entry in load_source_domains(sources[url], rule, self.cache, self.parser):
+                        merged.add(sort_key(entry) if prune else entry)
+                domains = ExternalSorter(budget, tmp_dir)
+                try:
+                    entries = iter_allowed(merged)
+                    if prune:
+                        entries = iter_prune_sorted(entries)
+                    for entry in entries:
+                        kept_count += 1
+                        domains.add(entry)
+                    domains.finish()
+                except BaseException:
+                    domains.close()
+                    raise
+        if allow_indexes:
+            print(f"Removed {allowed_count} allowlisted entries from {rule['name']}.")
+        pruned_count = merged_count - allowed_count - kept_count
+        if prune:
+            print(f"Pruned {pruned_count} entries covered by broader +. rules from {rule['name']}.")
+        return domains, {'merged': merged_count, 'allowlist_removed': allowed_count,
+                         'pruned': pruned_count, 'entries': kept_count}
+
+    def emit(self, rule, domains, count, previous, inputs):
+        # 写出 Clash、MRS 与 AdGuard Home 列表以及相对上一次结果的增量，返回清单条目
+        # domains 为有序的条目，需要可以多次迭代
+        with self.report.stage('emit'):
+            clash_filename = f"{rule['file_prefix']}-clash_reject_hostnames.yaml"
+            clash_path = os.path.join('generated_rules', clash_filename)
+            diff_filename = f"{rule['file_prefix']}-domains.diff"
+            diff = None
+            previous_domains = None
+            if previous:
+                # 覆盖之前先读出上一次的结果用于生成增量；外部排序时两边都是有序的，逐个比较即可
+                if isinstance(domains, ExternalSorter):
+                    diff = write_sorted_domain_diff(diff_filename, clash_path, domains, previous['inputs'], inputs)
+                if diff is None:
+                    previous_domains = read_clash_payload(clash_path)
+            generate_clash_domain_list(rule, domains, clash_filename)
+
+            mrs_filename = f"{rule['file_prefix']}-clash_reject_hostnames.mrs"
+            generate_clash_mrs(rule, domains, mrs_filename, self.sort_options)
+
+            agh_filename = f"{rule['file_prefix']}-rejection-unbound_dns.conf" 
+            generate_adguard_home_list(rule, domains, agh_filename)
+
+            entry = {
+                'inputs': inputs,
+                'outputs': [filename for filename in (clash_filename, mrs_filename, agh_filename)
+                            if os.path.exists(os.path.join('generated_rules', filename))],
+                'count': count,
+            }
+            if previous_domains is not None:
+                diff = write_domain_diff(diff_filename, previous_domains, domains, previous['inputs'], inputs)
+            if diff is not None:
+                entry['diff'] = diff
+            elif os.path.exists(os.path.join('generated_rules', diff_filename)):
+                os.remove(os.path.join('generated_rules', diff_filename))
+        return entry
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate rule lists from the sources in config.json.')
+    parser.add_argument('--workers', type=int, help='number of parse processes, 0 for all CPU cores (overrides parse.workers in config.json)')
+    parser.add_argument('--report', help='path of the JSON build report (overrides report.path in config.json)')
+    parser.add_argument('--profile', metavar='DIR', help='write a cProfile dump per stage to DIR (overrides report.profile_dir in config.json)')
+    parser.add_argument('--memory-budget', type=int, metavar='BYTES',
+                        help='sort and deduplicate each rule in external memory above this many bytes (overrides sort.memory_budget in config.json)')
+    parser.add_argument('--serve', action='store_true', help='keep running: poll upstreams, rebuild changed rules and serve generated_rules/ over HTTP')
+    parser.add_argument('--host', help='address to serve on (overrides service.host in config.json)')
+    parser.add_argument('--port', type=int, help='port to serve on (overrides service.port in config.json)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
     if not os.path.exists('generated_rules'):
         os.makedirs('generated_rules')
 
     with open('config.json', 'r', encoding='utf-8') as f:
         config = json.load(f)
 
+    report_options = dict(config.get('report') or {})
+    if args.report is not None:
+        report_options['path'] = args.report
+    if args.profile is not None:
+        report_options['profile_dir'] = args.profile
+    parse_options = dict(config.get('parse') or {})
+    if args.workers is not None:
+        parse_options['workers'] = args.workers
+    sort_options = dict(config.get('sort') or {})
+    if args.memory_budget is not None:
+        sort_options['memory_budget'] = args.memory_budget
+
+    if args.serve:
+        # 服务模式见 service.py：常驻内存，按上游的轮询间隔增量更新
+        import service
+        service_options = dict(config.get('service') or {})
+        if args.host is not None:
+            service_options['host'] = args.host
+        if args.port is not None:
+            service_options['port'] = args.port
+        service.run(config, service_options, parse_options, report_options, sort_options)
+        return
+
+    report = BuildReport(report_options)
+
+    # 上一次生成的清单：输入没有变化且输出文件都在的规则直接跳过
+    previous_state = load_manifest()
+    previous_manifest = previous_state.get('rules', {})
+    previous_full_rules = previous_state.get('full_rules', {})
+    manifest = {'generator_version': GENERATOR_VERSION, 'rules': {}, 'full_rules': {}, 'changed': []}
+
+    # 完整配置只依赖仓库中的文件，在后台线程中与下载和列表生成同时拼接
+    assembler = ThreadPoolExecutor(max_workers=1)
+    decoder = AdblockRuleDecoder()
+    full_rule_futures = [
+        (output['output_name'], assembler.submit(generate_full_rule, output, decoder, report, previous_full_rules.get(output['output_name'])))
+        for output in config.get('full_rule_outputs', [])
+    ]
+
+    # 先并发下载所有上游，再按配置顺序逐条处理
+    cache = SourceCache(config.get('cache'))
+    line_parser = LineParser(parse_options, report=report, sort_options=sort_options)
+    downloader = Downloader(config.get('download'), cache=cache, parser=line_parser, report=report)
+    rules_by_name = {rule['name']: rule for rule in config['rules_list']}
+    allow_rules = {}
+    for rule in config['rules_list']:
+        for allow_rule in allowlist_rules(rule, rules_by_name):
+            allow_rules[allow_rule['name']] = allow_rule
+    with report.stage('fetch'):
+        sources = downloader.fetch_all(config['rules_list'] + list(allow_rules.values()))
+    builder = RuleBuilder(cache, line_parser, rules_by_name, report=report, sort_options=sort_options)
+
     for rule in config['rules_list']:
         print(f"Processing rule: {rule['name']}")
-        
-        content = ""
+
         if isinstance(rule['url'], list):
             print(f"Detected multiple URLs for {rule['name']}, merging...")
-            for u in rule['url']:
-                file_content = download_file(u)
-                content += file_content + "\n"
-        else:
-            content = download_file(rule['url'])
 
-        if not content:
-            print(f"Skipping {rule['name']} due to empty content.")
-            continue
+        entry, built = builder.update(rule, sources, previous_manifest.get(rule['name']))
+        if entry is not None:
+            manifest['rules'][rule['name']] = entry
+        if built:
+            manifest['changed'].append(rule['name'])
 
-        filtered_domains = filter_lines(content, rule)
-        
-        clash_filename = f"{rule['file_prefix']}-clash_reject_hostnames.yaml"
-        generate_clash_domain_list(rule, filtered_domains, clash_filename)
+    for output_name, future in full_rule_futures:
+        entry, built = future.result()
+        manifest['full_rules'][output_name] = entry
+        if built:
+            manifest['changed'].append(output_name)
+    assembler.shutdown()
 
-        agh_filename = f"{rule['file_prefix']}-rejection-unbound_dns.conf" 
-        generate_adguard_home_list(rule, filtered_domains, agh_filename)
+    save_manifest(manifest)
+    line_parser.close()
+    cache.evict()
+    report.write()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+import argparse
+import glob
+import os
+import re
+import sys
+
+from generate_list import ADBLOCK_RULE, filter_lines, read_clash_payload
+
+# 查询域名是否被生成的规则列表拦截，以及命中的是哪一条规则
+# 用法: python lookup.py queries.txt
+#       cat dns.log | python lookup.py --list generated_rules/adguard-dns-clash_reject_hostnames.yaml --blocked-only
+
+DEFAULT_LISTS = os.path.join('generated_rules', '*-clash_reject_hostnames.yaml')
+LOOKUP_BATCH_LINES = 65536
+
+def wildcard_regex(pattern):
+    # * 匹配标签内任意数量的字符，不跨越 .，因此整个标签为 * 时恰好匹配一级
+    labels = pattern.split('.')
+    return r'\.'.join('[^.]*'.join(re.escape(part) for part in label.split('*')) for label in labels)
+
+class LookupIndex:
+    # 按 filter_lines 的条目格式建立哈希索引：
+    # example.com 只匹配自身，+.example.com 匹配自身及所有子域名，.example.com 只匹配子域名
+    # names 存放匹配域名自身的条目 (example.com 与 +.example.com)，精确条目优先；
+    # parents 存放匹配其子域名的条目 (+.example.com 与 .example.com)，查询时按 . 逐级取父域名查找
+    # 含 * 的条目按最后一个通配符标签之后的固定后缀分桶，只对后缀相同的查询执行正则
+    def __init__(self):
+        self.names = {}
+        self.parents = {}
+        self.wildcards = {}
+        self.size = 0
+        # parents 中是否有单个标签的键（例如 +.com），没有时查询不必查找顶级域
+        self.tld_parents = False
+
+    def add(self, entry, source=None):
+        # 同一个条目出现在多个列表中时保留最先加入的来源
+        entry = entry.strip().lower()
+        if not entry:
+            return
+        match = (entry, source)
+        self.size += 1
+        if '*' in entry:
+            name = entry
+            prefix = ''
+            if name.startswith('+.'):
+                name = name[2:]
+                prefix = r'(?:.+\.)?'
+            elif name.startswith('.'):
+                name = name[1:]
+                prefix = r'.+\.'
+            labels = name.split('.')
+            last = max(i for i, label in enumerate(labels) if '*' in label)
+            fixed = '.'.join(labels[last + 1:])
+            # 正则只匹配固定后缀之前的部分
+            regex = re.compile(prefix + wildcard_regex('.'.join(labels[:last + 1])))
+            self.wildcards.setdefault(fixed, []).append((regex, match))
+        elif entry.startswith('+.'):
+            self.names.setdefault(entry[2:], match)
+            self.add_parent(entry[2:], match)
+        elif entry.startswith('.'):
+            self.add_parent(entry[1:], match)
+        else:
+            current = self.names.get(entry)
+            if current is None or current[0].startswith('+.'):
+                self.names[entry] = match
+
+    def add_parent(self, name, match):
+        self.parents.setdefault(name, match)
+        if '.' not in name:
+            self.tld_parents = True
+
+    def add_list(self, entries, source=None):
+        for entry in entries:
+            self.add(entry, source)
+
+    def lookup(self, name):
+        # name 需为小写且不带结尾的 .，返回 (命中的条目, 来源)，未命中返回 None
+        # 优先级：域名自身（精确条目优先），然后从最长到最短的父域名，最后才是通配符
+        hit = self.names.get(name)
+        if hit is not None:
+            return hit
+        parents = self.parents
+        i = name.find('.')
+        while i != -1:
+            i += 1
+            j = name.find('.', i)
+            if j == -1 and not self.tld_parents:
+                break
+            hit = parents.get(name[i:])
+            if hit is not None:
+                return hit
+            i = j
+        if self.wildcards:
+            return self.lookup_wildcard(name)
+        return None
+
+    def lookup_wildcard(self, name):
+        wildcards = self.wildcards
+        i = name.find('.')
+        while True:
+            fixed = name[i + 1:] if i != -1 else ''
+            end = i if i != -1 else len(name)
+            for regex, match in wildcards.get(fixed, ()):
+                if regex.fullmatch(name, 0, end):
+                    return match
+            if i == -1:
+                return None
+            i = name.find('.', i + 1)
+
+    def lookup_many(self, names):
+        # 批量查询，返回与 names 一一对应的结果列表；与逐个调用 lookup 相同，但省去了每次调用的开销
+        names_get = self.names.get
+        parents_get = self.parents.get
+        lookup_wildcard = self.lookup_wildcard if self.wildcards else None
+        tld_parents = self.tld_parents
+        results = []
+        append = results.append
+        for name in names:
+            hit = names_get(name)
+            if hit is None:
+                i = name.find('.')
+                while i != -1:
+                    i += 1
+                    j = name.find('.', i)
+                    if j == -1 and not tld_parents:
+                        break
+                    hit = parents_get(name[i:])
+                    if hit is not None:
+                        break
+                    i = j
+                if hit is None and lookup_wildcard is not None:
+                    hit = lookup_wildcard(name)
+            append(hit)
+        return results
+
+def load_entries(path):
+    # .yaml 为 generate_list 写出的 Clash 列表，其他文件按 AdBlock 规则交给 filter_lines 提取条目
+    if path.endswith('.yaml') or path.endswith('.yml'):
+        entries = read_clash_payload(path)
+        if entries is None:
+            raise OSError(f'cannot read {path}')
+        return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        return filter_lines(f, ADBLOCK_RULE)
+
+def build_index(paths):
+    index = LookupIndex()
+    for path in paths:
+        index.add_list(load_entries(path), os.path.basename(path))
+    return index
+
+def normalize_name(line):
+    # 查询文件每行取第一列，统一转小写并去掉结尾的 .
+    fields = line.split(None, 1)
+    if not fields:
+        return None
+    return fields[0].rstrip('.').lower()
+
+def run_queries(index, lines, output, blocked_only=False):
+    # 输出制表符分隔的 name, blocked/allowed, 命中的条目, 来源；返回 (查询数, 拦截数)
+    total = 0
+    blocked = 0
+    names = []
+    def flush():
+        nonlocal blocked
+        out = []
+        for name, hit in zip(names, index.lookup_many(names)):
+            if hit is not None:
+                blocked += 1
+                out.append(f'{name}\tblocked\t{hit[0]}\t{hit[1]}\n')
+            elif not blocked_only:
+                out.append(f'{name}\tallowed\t\t\n')
+        output.write(''.join(out))
+        names.clear()
+    for line in lines:
+        name = normalize_name(line)
+        if not name:
+            continue
+        total += 1
+        names.append(name)
+        if len(names) >= LOOKUP_BATCH_LINES:
+            flush()
+    flush()
+    return total, blocked
+
+def main():
+    parser = argparse.ArgumentParser(description='Check domains against the generated rule lists.')
+    parser.add_argument('input', nargs='?', default='-', help='file with one domain per line (first column), - for stdin')
+    parser.add_argument('--list', action='append', dest='lists', metavar='PATH',
+                        help=f'rule list to load, may be repeated (default: {DEFAULT_LISTS})')
+    parser.add_argument('--blocked-only', action='store_true', help='only print blocked names')
+    args = parser.parse_args()
+    paths = args.lists or sorted(glob.glob(DEFAULT_LISTS))
+    if not paths:
+        parser.error('no rule lists found, pass --list')
+    index = build_index(paths)
+    print(f"Loaded {index.size} entries from {len(paths)} lists.", file=sys.stderr)
+    if args.input == '-':
+        total, blocked = run_queries(index, sys.stdin, sys.stdout, args.blocked_only)
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            total, blocked = run_queries(index, f, sys.stdout, args.blocked_only)
+    print(f"Checked {total} names, {blocked} blocked.", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+import struct
+import sys
+from array import array
+
+from external_sort import ExternalSorter
+
+# mihomo MRS 规则集（domain behavior）的读写，格式与 mihomo convert-ruleset 的输出一致：
+# zstd( 'MRS' 0x01 | behavior(1) | count(int64) | extra_len(int64) | extra | DomainSet )
+# DomainSet: version(1) | leaves(int64 长度 + uint64[]) | labelBitmap(int64 长度 + uint64[]) | labels(int64 长度 + bytes)
+# 所有整数均为大端序，DomainSet 是由反转后的域名构成的 succinct trie (LOUDS)
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+MRS_MAGIC = b'MRS\x01'
+BEHAVIOR_DOMAIN = 0
+DOMAIN_SET_VERSION = 1
+
+class MrsFormatError(RuntimeError):
+    pass
+
+def zstd_available():
+    return zstd is not None
+
+def expand_domain(domain):
+    # 按 mihomo DomainTrie.Insert + Foreach 的规则展开一个域名，返回它产生的 key，无效条目返回 None
+    # +.example.com 同时产生 example.com 与 +.example.com；.example.com 产生 +.example.com
+    domain = domain.strip().lower()
+    if not domain or domain[-1] == '.':
+        return None
+    parts = domain.split('.')
+    if len(parts) > 1 and '' in parts[1:]:
+        return None
+    if parts[0] == '+' and len(parts) > 1:
+        return ('.'.join(parts[1:]), domain)
+    if parts[0] == '' and len(parts) > 1:
+        return ('+' + domain,)
+    return (domain,)
+
+def domain_keys(domains):
+    # 返回 (去重后的 key 集合, 有效条目数)
+    keys = set()
+    count = 0
+    for domain in domains:
+        expanded = expand_domain(domain)
+        if expanded is not None:
+            keys.update(expanded)
+            count += 1
+    return keys, count
+
+# 每层暂存的 b'0'/b'1' 达到这个长度后打包成字节，暂存部分每位占一个字节，打包后每位占一位
+COMPACT_BITS = 1 << 16
+# 每处理这么多个 key 检查一次各层的暂存长度
+COMPACT_INTERVAL = 4096
+
+class _LevelBits:
+    # 按层追加的位串：pending[L] 为第 L 层尚未打包的 b'0'/b'1'，packed[L] 为已打包的小端字节
+    # （位 i 在第 i>>3 个字节的第 i&7 位）；最后各层按顺序首尾相接
+    def __init__(self):
+        self.pending = []
+        self.packed = []
+
+    def add_level(self):
+        self.pending.append(bytearray())
+        self.packed.append(bytearray())
+
+    def compact(self):
+        # 把各层暂存的位中 8 的整数倍打包，剩余的不足一个字节的位留在暂存中
+        for pending, packed in zip(self.pending, self.packed):
+            if len(pending) >= COMPACT_BITS:
+                size = len(pending) & ~7
+                packed += int(pending[size - 1::-1], 2).to_bytes(size >> 3, 'little')
+                del pending[:size]
+
+    def words(self):
+        # 拼接所有层并转换成 uint64 数组，位 i 存放在第 i>>6 个字的第 i&63 位；
+        # 与 mihomo 的 setBit 一样，数组只延伸到最后一个置 1 的位所在的字
+        out = bytearray()
+        offset = 0
+        for pending, packed in zip(self.pending, self.packed):
+            bits = len(packed) * 8 + len(pending)
+            if bits == 0:
+                continue
+            value = int.from_bytes(packed, 'little')
+            if pending:
+                value |= int(pending[::-1], 2) << (len(packed) * 8)
+            shift = offset & 7
+            chunk = (value << shift).to_bytes((bits + shift + 7) >> 3, 'little')
+            if shift:
+                out[-1] |= chunk[0]
+                out += chunk[1:]
+            else:
+                out += chunk
+            offset += bits
+        while out and out[-1] == 0:
+            out.pop()
+        out += bytes(-len(out) & 7)
+        words = array('Q', bytes(out))
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words
+
+def _common_prefix_length(a, b):
+    # 两个 bytes 的公共前缀长度：异或后最高的非零位就是第一个不同的字节
+    size = min(len(a), len(b))
+    diff = int.from_bytes(a[:size], 'big') ^ int.from_bytes(b[:size], 'big')
+    if diff == 0:
+        return size
+    return size - 1 - (diff.bit_length() - 1) // 8
+
+def build_domain_set(keys):
+    # 与 mihomo NewDomainSet 的输出相同：反转后按字节排序，按广度优先生成 leaves/labelBitmap/labels
+    return build_sorted_domain_set(sorted(key[::-1].encode('utf-8') for key in keys))
+
+def build_sorted_domain_set(sorted_keys):
+    # sorted_keys 为反转后按字节排序且不重复的 key，只顺序读取一遍，可以直接接外部排序的输出
+    # 第 L 层的节点即长度为 L 的不同前缀；key 与前一个 key 的公共前缀长度为 lcp 时，
+    # 它在第 lcp+1 层到第 len(key) 层各产生一个新节点，同一层的节点按 key 的顺序出现，
+    # 因此每层分别追加 label、leaf 位与 labelBitmap 位，最后按层拼接即是广度优先的顺序
+    labels = [bytearray()]
+    leaf_bits = _LevelBits()
+    bitmap_bits = _LevelBits()
+    leaf_bits.add_level()
+    bitmap_bits.add_level()
+    leaves = leaf_bits.pending
+    bitmap = bitmap_bits.pending
+    leaves[0].append(48)
+    # 当前路径上每一层尚未结束的节点已有的子节点数，节点结束时写入 子节点数 个 0 和一个 1
+    children = [0]
+    previous = None
+    for index, key in enumerate(sorted_keys):
+        level = 0
+        if previous is not None:
+            level = _common_prefix_length(previous, key)
+            for depth in range(len(children) - 1, level, -1):
+                bitmap[depth] += b'0' * children[depth]
+                bitmap[depth].append(49)
+            del children[level + 1:]
+        size = len(key)
+        while len(labels) <= size:
+            labels.append(bytearray())
+            leaf_bits.add_level()
+            bitmap_bits.add_level()
+        children[level] += 1
+        for depth in range(level + 1, size + 1):
+            labels[depth].append(key[depth - 1])
+            leaves[depth].append(48)
+            children.append(1)
+        leaves[size][-1] = 49
+        children[-1] = 0
+        previous = key
+        if index % COMPACT_INTERVAL == 0:
+            leaf_bits.compact()
+            bitmap_bits.compact()
+    for depth in range(len(children) - 1, -1, -1):
+        bitmap[depth] += b'0' * children[depth]
+        bitmap[depth].append(49)
+    return leaf_bits.words(), bitmap_bits.words(), b''.join(labels)
+
+def _sorted_keys(domains, memory_budget, tmp_dir):
+    # 返回 (反转后排序去重的 key 迭代器, 有效条目数, 需要关闭的 ExternalSorter 或 None)
+    if not memory_budget:
+        keys, count = domain_keys(domains)
+        return sorted(key[::-1].encode('utf-8') for key in keys), count, None
+    # 字符串按码位排序与 UTF-8 编码后按字节排序的顺序相同，可以直接使用外部排序
+    sorter = ExternalSorter(memory_budget, tmp_dir)
+    count = 0
+    for domain in domains:
+        expanded = expand_domain(domain)
+        if expanded is not None:
+            sorter.update(key[::-1] for key in expanded)
+            count += 1
+    return (key.encode('utf-8') for key in sorter), count, sorter
+
+def encode_mrs(domains, memory_budget=0, tmp_dir=None):
+    # 返回未压缩的 MRS 内容，没有有效条目时返回 None（mihomo 同样拒绝空规则集）
+    # memory_budget 不为 0 时展开后的 key 用外部排序，内存中只保留生成的位数组与 labels
+    sorted_keys, count, sorter = _sorted_keys(domains, memory_budget, tmp_dir)
+    try:
+        if count == 0:
+            return None
+        leaves, label_bitmap, labels = build_sorted_domain_set(sorted_keys)
+    finally:
+        if sorter is not None:
+            sorter.close()
+    if sys.byteorder == 'little':
+        leaves.byteswap()
+        label_bitmap.byteswap()
+    chunks = [
+        MRS_MAGIC,
+        bytes([BEHAVIOR_DOMAIN]),
+        struct.pack('>qq', count, 0),
+        bytes([DOMAIN_SET_VERSION]),
+        struct.pack('>q', len(leaves)),
+        leaves.tobytes(),
+        struct.pack('>q', len(label_bitmap)),
+        label_bitmap.tobytes(),
+        struct.pack('>q', len(labels)),
+        labels,
+    ]
+    return b''.join(chunks)
+
+def write_mrs(path, domains, memory_budget=0, tmp_dir=None):
+    # 编译并写出 .mrs 文件，返回写入的条目数；没有有效条目时不生成文件并返回 0
+    if zstd is None:
+        raise MrsFormatError('zstd support is unavailable, install the zstandard package')
+    payload = encode_mrs(domains, memory_budget, tmp_dir)
+    if payload is None:
+        return 0
+    with open(path, 'wb') as f:
+        f.write(_compress(payload))
+    return struct.unpack('>q', payload[5:13])[0]
+
+# 标准库 compression.zstd 同样有 ZstdCompressor/ZstdDecompressor，但接口与 zstandard 不同，
+# 因此按模块名区分：标准库使用一次性的 compress/decompress
+def _compress(payload):
+    if zstd.__name__ == 'zstandard':
+        return zstd.ZstdCompressor().compress(payload)
+    return zstd.compress(payload)
+
+def _decompress(data):
+    if zstd.__name__ == 'zstandard':
+        # mihomo 流式写出的帧头中没有内容长度，zstandard 的一次性 decompress 无法处理
+        return zstd.ZstdDecompressor().decompressobj().decompress(data)
+    return zstd.decompress(data)
+
+def read_payload(path):
+    # 读取 .mrs 文件并返回解压后的内容，用于与 mihomo 生成的文件逐字节比较
+    if zstd is None:
+        raise MrsFormatError('zstd support is unavailable, install the zstandard package')
+    with open(path, 'rb') as f:
+        return _decompress(f.read())
+
+def read_mrs(path):
+    # 读取 domain behavior 的 .mrs 文件，返回 (条目数, 还原出的 key 集合)，用于校验往返一致
+    data = read_payload(path)
+    if data[:4] != MRS_MAGIC:
+        raise MrsFormatError('invalid MRS magic bytes')
+    if data[4] != BEHAVIOR_DOMAIN:
+        raise MrsFormatError('only domain behavior is supported')
+    count, extra_length = struct.unpack_from('>qq', data, 5)
+    offset = 21 + extra_length
+    if data[offset] != DOMAIN_SET_VERSION:
+        raise MrsFormatError('unsupported DomainSet version')
+    offset += 1
+    arrays = []
+    for fmt in ('Q', 'Q'):
+        (length,) = struct.unpack_from('>q', data, offset)
+        offset += 8
+        arrays.append(struct.unpack_from(f'>{length}{fmt}', data, offset))
+        offset += length * 8
+    (length,) = struct.unpack_from('>q', data, offset)
+    offset += 8
+    labels = data[offset:offset + length]
+    return count, decode_domain_set(arrays[0], arrays[1], labels)
+
+def decode_domain_set(leaves, label_bitmap, labels):
+    # 按广度优先顺序重建 trie：每个节点的子节点对应 labelBitmap 中的一段 0，以 1 结尾
+    def bit(bitmap, i):
+        word = i >> 6
+        return word < len(bitmap) and (bitmap[word] >> (i & 63)) & 1
+    prefixes = [b'']
+    keys = set()
+    label_index = 0
+    bit_index = 0
+    node = 0
+    while node < len(prefixes):
+        if bit(leaves, node):
+            keys.add(prefixes[node].decode('utf-8')[::-1])
+        while not bit(label_bitmap, bit_index):
+            prefixes.append(prefixes[node] + labels[label_index:label_index + 1])
+            label_index += 1
+            bit_index += 1
+        bit_index += 1
+        node += 1
+    return keys
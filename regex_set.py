@@ -0,0 +1,209 @@
+import re
+
+# REGEX 规则的合并：把大量独立的正则按原子拆分后放进前缀树，公共前缀只保留一份，
+# 生成少量 (?:a|b|c) 形式的组合正则，客户端只需要对每个请求匹配几个正则而不是几千个
+# 只有可以安全合并的正则参与合并：不含反向引用、命名分组、内联标志、原子分组、占有量词，且顶层不含 |
+# 其余正则原样保留
+
+# 每个组合正则最多包含的原始正则数量，过大的正则编译与匹配都会变慢
+REGEX_CHUNK_SIZE = 500
+LOOKAROUND_PREFIXES = ('(?:', '(?=', '(?!', '(?<=', '(?<!')
+re_repeat_quantifier = re.compile(r'\{(?:\d+(?:,\d*)?|,\d+)\}')
+
+def _escape_length(pattern, i):
+    # pattern[i] 为反斜杠，返回转义序列的长度，反向引用等无法合并的写法返回 None
+    if i + 1 >= len(pattern):
+        return None
+    char = pattern[i + 1]
+    if char in '123456789':
+        return None
+    if char == 'x':
+        return 4
+    if char == 'u':
+        return 6
+    if char == 'U':
+        return 10
+    if char == 'N':
+        end = pattern.find('}', i)
+        return None if end == -1 else end - i + 1
+    if char == '0':
+        length = 2
+        while length < 4 and i + length < len(pattern) and pattern[i + length] in '01234567':
+            length += 1
+        return length
+    return 2
+
+def _class_end(pattern, i):
+    # pattern[i] 为 [，返回字符类结束的 ] 之后的位置
+    j = i + 1
+    if j < len(pattern) and pattern[j] == '^':
+        j += 1
+    if j < len(pattern) and pattern[j] == ']':
+        j += 1
+    while j < len(pattern):
+        if pattern[j] == '\\':
+            j += 2
+            continue
+        if pattern[j] == ']':
+            return j + 1
+        j += 1
+    return None
+
+def tokenize(pattern, top_level=True):
+    # 把正则拆成原子序列：转义、字符类、分组（整体作为一个原子）或单个字符，量词附加在前一个原子上
+    # 无法安全合并时返回 None
+    atoms = []
+    i = 0
+    length = len(pattern)
+    while i < length:
+        char = pattern[i]
+        if char == '\\':
+            size = _escape_length(pattern, i)
+            if size is None:
+                return None
+            atom = pattern[i:i + size]
+            i += size
+        elif char == '[':
+            end = _class_end(pattern, i)
+            if end is None:
+                return None
+            atom = pattern[i:end]
+            i = end
+        elif char == '(':
+            if pattern.startswith('(?', i) and not pattern.startswith(LOOKAROUND_PREFIXES, i):
+                return None
+            end = _group_end(pattern, i)
+            if end is None:
+                return None
+            atom = pattern[i:end]
+            i = end
+        elif char == ')':
+            return None
+        elif char == '|':
+            if top_level:
+                return None
+            atom = char
+            i += 1
+        else:
+            atom = char
+            i += 1
+        # 量词及其非贪婪标记
+        quantifier = ''
+        if i < length and pattern[i] in '*+?':
+            quantifier = pattern[i]
+        elif i < length and pattern[i] == '{':
+            match = re_repeat_quantifier.match(pattern, i)
+            if match:
+                quantifier = match.group()
+        if quantifier:
+            i += len(quantifier)
+            if i < length and pattern[i] == '?':
+                quantifier += '?'
+                i += 1
+            elif i < length and pattern[i] == '+':
+                return None
+            atom += quantifier
+        atoms.append(atom)
+    return atoms
+
+def _group_end(pattern, i):
+    # pattern[i] 为 (，返回对应的 ) 之后的位置；分组内部同样检查是否可以合并，但允许 |
+    depth = 0
+    j = i
+    while j < len(pattern):
+        char = pattern[j]
+        if char == '\\':
+            size = _escape_length(pattern, j)
+            if size is None:
+                return None
+            j += size
+            continue
+        if char == '[':
+            end = _class_end(pattern, j)
+            if end is None:
+                return None
+            j = end
+            continue
+        if char == '(':
+            if pattern.startswith('(?', j) and not pattern.startswith(LOOKAROUND_PREFIXES, j):
+                return None
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return j + 1
+        j += 1
+    return None
+
+def _emit(node):
+    # 前缀树转成正则；None 键表示有原始正则在此结束
+    # 对 search 而言 AB 能匹配时 A 必然能匹配，因此结束节点之下的分支都是多余的
+    if None in node:
+        return ''
+    branches = [atom + _emit(child) for atom, child in node.items()]
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+def consolidate(patterns, chunk_size=REGEX_CHUNK_SIZE):
+    # 返回 (组合后的正则列表, 原样保留的正则列表)，两者合起来与原来的正则集合匹配结果相同
+    mergeable = []
+    kept = []
+    for pattern in dict.fromkeys(patterns):
+        atoms = tokenize(pattern)
+        if atoms is None:
+            kept.append(pattern)
+            continue
+        try:
+            re.compile(pattern)
+        except re.error:
+            kept.append(pattern)
+            continue
+        mergeable.append((atoms, pattern))
+    # 排序后相同前缀的正则落在同一个分组中
+    mergeable.sort(key=lambda item: item[1])
+    combined = []
+    for start in range(0, len(mergeable), chunk_size):
+        root = {}
+        for atoms, pattern in mergeable[start:start + chunk_size]:
+            node = root
+            for atom in atoms:
+                if None in node:
+                    break
+                node = node.setdefault(atom, {})
+            else:
+                node.clear()
+                node[None] = {}
+        combined.append(_emit(root))
+    return combined, kept
+
+class RegexSet:
+    # 在合并后的正则上做匹配，用于测试与测量请求 URL 的匹配吞吐量
+    def __init__(self, patterns, chunk_size=REGEX_CHUNK_SIZE):
+        self.combined, self.kept = consolidate(patterns, chunk_size)
+        self.compiled = [re.compile(pattern) for pattern in self.combined]
+        for pattern in self.kept:
+            try:
+                self.compiled.append(re.compile(pattern))
+            except re.error:
+                pass
+
+    @property
+    def patterns(self):
+        return self.combined + self.kept
+
+    def search(self, text):
+        for regex in self.compiled:
+            if regex.search(text):
+                return True
+        return False
+
+def verify_equivalence(patterns, regex_set, samples):
+    # 与逐个正则匹配的结果比较，返回结果不一致的样本
+    compiled = []
+    for pattern in patterns:
+        try:
+            compiled.append(re.compile(pattern))
+        except re.error:
+            pass
+    return [text for text in samples if any(regex.search(text) for regex in compiled) != regex_set.search(text)]
@@ -0,0 +1,254 @@
+import email.utils
+import gzip
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from build_report import BuildReport
+from decode_adblock import AdblockRuleDecoder
+from generate_list import (GENERATOR_VERSION, Downloader, LineParser, RuleBuilder, allowlist_rules, generate_full_rule,
+                           load_manifest, load_source_domains, parse_key, rule_urls, save_manifest, url_rules_map)
+from source_cache import SourceCache
+
+# 服务模式：常驻进程，按每个上游的轮询间隔重新下载，只重新生成上游内容变化了的规则，
+# 同时通过 HTTP 提供 generated_rules/ 中的文件（带 ETag 与预先压缩的 gzip 内容）
+# 用法: python generate_list.py --serve --port 8080
+
+DEFAULT_SERVICE_OPTIONS = {
+    'host': '127.0.0.1',  # 监听地址，局域网内使用时改为 0.0.0.0
+    'port': 8080,
+    'interval': 3600,     # 上游默认的轮询间隔（秒），rules_list 中的规则可以用 refresh_interval 单独设置
+    'gzip_level': 9,      # 文件只在变化后压缩一次，使用最高压缩级别
+}
+
+CONTENT_TYPES = {
+    '.yaml': 'text/yaml; charset=utf-8',
+    '.json': 'application/json',
+    '.conf': 'text/plain; charset=utf-8',
+    '.diff': 'text/plain; charset=utf-8',
+    '.mrs': 'application/octet-stream',
+}
+
+class RuleFiles:
+    # generated_rules/ 中文件的内存副本：原始内容、gzip 内容与 ETag，修改时间或大小变化后才重新读取和压缩
+    def __init__(self, directory, gzip_level=9):
+        self.directory = directory
+        self.gzip_level = gzip_level
+        self.files = {}
+
+    def refresh(self):
+        # 重新扫描目录，返回更新的文件数量；整个字典一次性替换，请求线程不需要加锁
+        files = {}
+        updated = 0
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.') or name.endswith('.tmp') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            current = self.files.get(name)
+            if current is not None and current['mtime'] == stat.st_mtime_ns and current['size'] == stat.st_size:
+                files[name] = current
+                continue
+            with open(path, 'rb') as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:32]
+            files[name] = {
+                'mtime': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'body': body,
+                'gzip': gzip.compress(body, self.gzip_level, mtime=0),
+                'etag': f'"{digest}"',
+                'gzip_etag': f'"{digest}-gzip"',
+                'last_modified': email.utils.formatdate(stat.st_mtime, usegmt=True),
+                'content_type': CONTENT_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream'),
+            }
+            updated += 1
+        self.files = files
+        return updated
+
+def accepts_gzip(header):
+    # Accept-Encoding 中包含 gzip 且 q 不为 0
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            params = params.replace(' ', '')
+            return params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+class RuleFilesHandler(BaseHTTPRequestHandler):
+    server_version = 'generate-rule'
+
+    def do_GET(self):
+        self.send_file(head=False)
+
+    def do_HEAD(self):
+        self.send_file(head=True)
+
+    def send_file(self, head):
+        name = unquote(urlsplit(self.path).path).lstrip('/')
+        entry = self.server.rule_files.files.get(name)
+        if entry is None:
+            self.send_error(404)
+            return
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        etag = entry['gzip_etag'] if use_gzip else entry['etag']
+        # 两种编码的内容相同，客户端带着任意一个 ETag 都可以返回 304
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            if '*' in tags or entry['etag'] in tags or entry['gzip_etag'] in tags:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+        body = entry['gzip'] if use_gzip else entry['body']
+        self.send_response(200)
+        self.send_header('Content-Type', entry['content_type'])
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', entry['last_modified'])
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+def start_server(rule_files, host, port):
+    # 在后台线程中运行 HTTP 服务，返回 server，停止时调用 server.shutdown()
+    server = ThreadingHTTPServer((host, port), RuleFilesHandler)
+    server.daemon_threads = True
+    server.rule_files = rule_files
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving generated_rules/ on http://{server.server_address[0]}:{server.server_address[1]}/")
+    return server
+
+class RefreshService:
+    # 常驻内存的状态：每个上游按规则类型过滤后的域名集合、白名单后缀树以及生成清单
+    # 每轮只下载到期的上游，内容哈希变化的上游所涉及的规则才会重新生成
+    def __init__(self, config, options=None, parse_options=None, report_options=None, sort_options=None):
+        self.config = config
+        self.options = dict(DEFAULT_SERVICE_OPTIONS, **(options or {}))
+        self.report_options = report_options
+        self.cache = SourceCache(config.get('cache'))
+        self.line_parser = LineParser(parse_options)
+        self.downloader = Downloader(config.get('download'), cache=self.cache, parser=self.line_parser)
+        self.rules = config['rules_list']
+        rules_by_name = {rule['name']: rule for rule in self.rules}
+        self.builder = RuleBuilder(self.cache, self.line_parser, rules_by_name, sort_options=sort_options)
+        self.decoder = AdblockRuleDecoder()
+        allow_rules = {}
+        for rule in self.rules:
+            for allow_rule in allowlist_rules(rule, rules_by_name):
+                allow_rules[allow_rule['name']] = allow_rule
+        self.url_rules = url_rules_map(self.rules + list(allow_rules.values()))
+        # 被多条规则使用的上游取其中最短的轮询间隔
+        self.intervals = {}
+        for rule in self.rules:
+            for url in rule_urls(rule):
+                interval = rule.get('refresh_interval', self.options['interval'])
+                self.intervals[url] = min(self.intervals.get(url, interval), interval)
+        self.next_poll = dict.fromkeys(self.url_rules, 0.0)
+        self.sources = {}
+        manifest = load_manifest()
+        self.manifest = {
+            'generator_version': GENERATOR_VERSION,
+            'rules': manifest.get('rules', {}),
+            'full_rules': manifest.get('full_rules', {}),
+            'changed': [],
+        }
+        self.rule_files = RuleFiles('generated_rules', self.options['gzip_level'])
+        self.stopped = threading.Event()
+
+    def poll(self, urls):
+        # 下载到期的上游并重新生成受影响的规则，返回重新生成的规则与完整配置名称
+        report = BuildReport(self.report_options)
+        self.downloader.report = report
+        self.line_parser.report = report
+        self.builder.report = report
+        first_poll = not self.sources
+        hashes = {url: self.cache.body_hash(url) for url in urls}
+        with report.stage('fetch'):
+            with ThreadPoolExecutor(max_workers=self.downloader.options['workers']) as pool:
+                results = dict(zip(urls, pool.map(self.downloader.download, urls, [self.url_rules[url] for url in urls])))
+        changed_urls = set()
+        for url, source in results.items():
+            if source['domains'] is None:
+                if url in self.sources:
+                    continue
+                # 启动后第一次遇到未变化的上游，从缓存读出解析结果，之后一直保存在内存中
+                source['domains'] = {parse_key(rule): set(load_source_domains(source, rule, self.cache, self.line_parser))
+                                     for rule in self.url_rules[url]}
+            elif url in self.sources and self.cache.body_hash(url) == hashes[url]:
+                continue
+            self.sources[url] = source
+            changed_urls.add(url)
+        # 白名单后缀树以被引用的规则名为键，该规则的上游变化后重新建立
+        for url in changed_urls:
+            for rule in self.url_rules[url]:
+                self.builder.forget_allowlist(rule['name'])
+
+        changed = []
+        for rule in self.rules:
+            urls_of_rule = set(rule_urls(rule))
+            for allow_rule in allowlist_rules(rule, self.builder.rules_by_name):
+                urls_of_rule.update(rule_urls(allow_rule))
+            if not first_poll and not urls_of_rule & changed_urls:
+                continue
+            if not all(url in self.sources for url in urls_of_rule):
+                continue
+            print(f"Processing rule: {rule['name']}")
+            entry, built = self.builder.update(rule, self.sources, self.manifest['rules'].get(rule['name']))
+            if entry is not None:
+                self.manifest['rules'][rule['name']] = entry
+            if built:
+                changed.append(rule['name'])
+        # 完整配置只依赖本地文件，每轮检查一次输入哈希，没有变化时直接跳过
+        for output in self.config.get('full_rule_outputs', []):
+            entry, built = generate_full_rule(output, self.decoder, report, self.manifest['full_rules'].get(output['output_name']))
+            self.manifest['full_rules'][output['output_name']] = entry
+            if built:
+                changed.append(output['output_name'])
+        if changed or first_poll:
+            self.manifest['changed'] = changed
+            save_manifest(self.manifest)
+            self.cache.evict()
+            report.write()
+        updated = self.rule_files.refresh()
+        if updated:
+            print(f"Reloaded {updated} files into the HTTP cache.")
+        return changed
+
+    def run(self):
+        self.rule_files.refresh()
+        server = start_server(self.rule_files, self.options['host'], self.options['port'])
+        try:
+            while not self.stopped.is_set():
+                now = time.monotonic()
+                due = [url for url, at in self.next_poll.items() if at <= now]
+                if due:
+                    print(f"Polling {len(due)} sources.")
+                    changed = self.poll(due)
+                    print(f"Rebuilt {len(changed)} outputs." if changed else "No outputs changed.")
+                    polled_at = time.monotonic()
+                    for url in due:
+                        self.next_poll[url] = polled_at + self.intervals.get(url, self.options['interval'])
+                    continue
+                self.stopped.wait(min(self.next_poll.values()) - now)
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.line_parser.close()
+
+def run(config, options=None, parse_options=None, report_options=None, sort_options=None):
+    service = RefreshService(config, options, parse_options, report_options, sort_options)
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        print("Stopped.")
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+# 上游列表的本地缓存：按 URL 存放原始内容、ETag/Last-Modified 以及解析后的域名集合
+# 目录结构: <path>/<sha256(url)>/{meta.json, body, <parse_key>.domains}
+
+DEFAULT_CACHE_OPTIONS = {
+    'path': '.cache/sources',
+    'max_size': 256 * 1024 * 1024,  # 缓存目录总大小上限（字节），超出后按最近使用时间淘汰
+}
+
+class SourceCache:
+    def __init__(self, options=None):
+        self.options = dict(DEFAULT_CACHE_OPTIONS, **(options or {}))
+        self.path = self.options['path']
+        os.makedirs(self.path, exist_ok=True)
+
+    def entry_path(self, url):
+        return os.path.join(self.path, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def load_meta(self, url):
+        meta_path = os.path.join(self.entry_path(url), 'meta.json')
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(os.path.join(self.entry_path(url), 'body')):
+            return None
+        # 更新访问时间，供淘汰时判断
+        os.utime(meta_path)
+        return meta
+
+    def body_hash(self, url):
+        # 缓存内容的 sha256，没有缓存时返回 None
+        meta = self.load_meta(url)
+        if meta is None:
+            return None
+        return meta.get('sha256')
+
+    def conditional_headers(self, url):
+        meta = self.load_meta(url)
+        headers = {}
+        if meta is None:
+            return headers
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def iter_body(self, url):
+        try:
+            with open(os.path.join(self.entry_path(url), 'body'), 'r', encoding='utf-8') as f:
+                yield from f
+        except OSError:
+            return
+
+    def body_writer(self, url, etag=None, last_modified=None):
+        entry = self.entry_path(url)
+        os.makedirs(entry, exist_ok=True)
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': int(time.time()),
+        }
+        return BodyWriter(entry, meta)
+
+    def load_domains(self, url, parse_key):
+        # 返回逐行读取缓存的解析结果的迭代器，不把整个文件读入内存；没有缓存时返回 None
+        path = os.path.join(self.entry_path(url), f'{parse_key}.domains')
+        if not os.path.exists(path):
+            return None
+        return self.iter_domains(path)
+
+    def iter_domains(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8', newline='\n') as f:
+                for line in f:
+                    yield line[:-1]
+        except OSError:
+            return
+
+    def store_domains(self, url, parse_key, domains, presorted=False):
+        # presorted 为 True 时 domains 已经有序且不重复（例如外部排序的输出），逐条写出而不再排序
+        entry = self.entry_path(url)
+        if not os.path.isdir(entry):
+            return
+        path = os.path.join(entry, f'{parse_key}.domains')
+        with open(path + '.tmp', 'w', encoding='utf-8', newline='\n') as f:
+            for domain in (domains if presorted else sorted(domains)):
+                f.write(domain + '\n')
+        os.replace(path + '.tmp', path)
+
+    def evict(self):
+        # 按 meta.json 的修改时间（最近使用）从旧到新删除，直到总大小不超过上限
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if not os.path.isdir(entry):
+                continue
+            size = 0
+            for file_name in os.listdir(entry):
+                size += os.path.getsize(os.path.join(entry, file_name))
+            meta_path = os.path.join(entry, 'meta.json')
+            used_at = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+            entries.append((used_at, size, entry))
+            total_size += size
+        entries.sort()
+        evicted = 0
+        for used_at, size, entry in entries:
+            if total_size <= self.options['max_size']:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+            evicted += 1
+        if evicted:
+            print(f"Evicted {evicted} cached sources, cache size is now {total_size} bytes.")
+
+class BodyWriter:
+    # 边下载边写入缓存：先写临时文件，完成后再替换并写入 meta.json，避免中断时留下半个文件
+    def __init__(self, entry, meta):
+        self.entry = entry
+        self.meta = meta
+        self.sha256 = hashlib.sha256()
+        self.file = open(os.path.join(entry, 'body.tmp'), 'w', encoding='utf-8')
+
+    def write(self, line):
+        line += '\n'
+        self.sha256.update(line.encode('utf-8'))
+        self.file.write(line)
+
+    def close(self):
+        self.file.close()
+        # 内容变化后旧的解析结果全部失效
+        for file_name in os.listdir(self.entry):
+            if file_name.endswith('.domains'):
+                os.remove(os.path.join(self.entry, file_name))
+        os.replace(os.path.join(self.entry, 'body.tmp'), os.path.join(self.entry, 'body'))
+        self.meta['sha256'] = self.sha256.hexdigest()
+        with open(os.path.join(self.entry, 'meta.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(os.path.join(self.entry, 'meta.json.tmp'), os.path.join(self.entry, 'meta.json'))
+
+    def discard(self):
+        self.file.close()
+        os.remove(os.path.join(self.entry, 'body.tmp'))
@@ -0,0 +1,47 @@
+import sys
+import threading
+
+from decode_adblock import AdblockRuleDecoder
+
+# 解析结果的缓存由同一个解码器的所有线程共享，不同的解析参数不能互相串用
+
+LINES = [f'||ads{i}.example.com^' for i in range(200)] + [f'@@||ok{i}.example.com^' for i in range(50)] + ['/banner[0-9]+/', '|http://x.com/a']
+OPTIONS = [
+    ('REJECT', 'REGEX', 'REJECT', 'DIRECT'),
+    ('DIRECT', 'REGEX', 'DIRECT', 'REJECT'),
+    ('REJECT', 'REGEX', 'PROXY', 'DIRECT'),
+    ('PROXY', 'REGEX', 'REJECT', 'REJECT'),
+]
+
+def decode(decoder, options):
+    return [dict(rule) for rule in decoder.iter_decode_adblock_rule(LINES, *options)]
+
+def test_memo_keeps_options_apart():
+    decoder = AdblockRuleDecoder()
+    for options in OPTIONS + OPTIONS:
+        assert decode(decoder, options) == decode(AdblockRuleDecoder(memo_size=0), options)
+
+def test_memo_is_shared_safely_between_threads():
+    expected = {options: decode(AdblockRuleDecoder(memo_size=0), options) for options in OPTIONS}
+    # 很小的缓存使得淘汰与读取频繁交错
+    decoder = AdblockRuleDecoder(memo_size=64)
+    errors = []
+    def worker(options):
+        try:
+            for _ in range(30):
+                if decode(decoder, options) != expected[options]:
+                    errors.append(options)
+                    return
+        except Exception as e:
+            errors.append(e)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=worker, args=(options,)) for options in OPTIONS]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
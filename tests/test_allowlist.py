@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from generate_list import (LINE_COMMENT, LINE_EXACT, LINE_INVALID_CHARS, LINE_SUFFIX, LINE_WILDCARD,
+                           RuleBuilder, allowlist_rules, classify_line)
+from source_cache import SourceCache
+
+# 白名单从黑名单中减去被允许的条目：只删除白名单确实覆盖的条目，更宽泛的黑名单条目必须保留
+
+ALLOW = {'type': 'allowlist'}
+
+@pytest.mark.parametrize('line, expected', [
+    ('@@||ok.example.com^', ('+.ok.example.com', LINE_SUFFIX)),
+    ('@@||ok.example.com', ('+.ok.example.com', LINE_SUFFIX)),
+    ('@@|https://ok.example.com/path', ('ok.example.com', LINE_EXACT)),
+    ('@@ok.example.com^', ('ok.example.com', LINE_EXACT)),
+    ('@@||ok*.example.com^', ('ok*.example.com', LINE_WILDCARD)),
+    ('@@||example.com/ads^', (None, LINE_INVALID_CHARS)),
+    ('  @@||ok.example.com^  ', ('+.ok.example.com', LINE_SUFFIX)),
+    ('! @@||ok.example.com^', (None, LINE_COMMENT)),
+])
+def test_classify_allowlist_line(line, expected):
+    assert classify_line(line, ALLOW) == expected
+
+def test_allowlist_rules_type():
+    rules_by_name = {'hosts': {'name': 'hosts', 'type': 'domain', 'url': 'h'},
+                     'exceptions': {'name': 'exceptions', 'type': 'adblock', 'url': ['e1', 'e2']}}
+    rule = {'name': 'block', 'allowlist': ['hosts', 'exceptions']}
+    assert allowlist_rules(rule, rules_by_name) == [{'name': 'hosts', 'type': 'domain', 'url': 'h'},
+                                                   {'name': 'exceptions', 'type': 'allowlist', 'url': ['e1', 'e2']}]
+    assert allowlist_rules({'name': 'block', 'allowlist': 'hosts'}, rules_by_name)[0]['name'] == 'hosts'
+
+def make_builder(tmp_path, block_lines, allow_lines, allow_type='adblock', prune=True, memory_budget=0):
+    cache = SourceCache({'path': str(tmp_path / 'cache')})
+    sources = {}
+    for url, lines in (('https://example.com/block.txt', block_lines), ('https://example.com/allow.txt', allow_lines)):
+        body = cache.body_writer(url)
+        for line in lines:
+            body.write(line)
+        body.close()
+        sources[url] = {'url': url, 'not_modified': False, 'empty': False, 'domains': None}
+    rules_by_name = {
+        'block': {'name': 'block', 'type': 'adblock', 'url': 'https://example.com/block.txt',
+                  'allowlist': 'allow', 'prune_redundant': prune},
+        'allow': {'name': 'allow', 'type': allow_type, 'url': 'https://example.com/allow.txt'},
+    }
+    builder = RuleBuilder(cache, None, rules_by_name, sort_options={'memory_budget': memory_budget, 'tmp_dir': str(tmp_path)})
+    return builder, rules_by_name['block'], sources
+
+def collect(tmp_path, *args, **kwargs):
+    builder, rule, sources = make_builder(tmp_path, *args, **kwargs)
+    domains, counts = builder.collect(rule, sources)
+    return list(domains), counts
+
+def test_allowed_exact_domain_removes_only_that_entry(tmp_path):
+    block = ['x.example.com', 'y.example.com', '||x.example.com^', 'z.x.example.com']
+    domains, counts = collect(tmp_path, block, ['x.example.com'], allow_type='domain', prune=False)
+    assert domains == ['+.x.example.com', 'y.example.com', 'z.x.example.com']
+    assert counts['allowlist_removed'] == 1
+
+def test_narrower_allow_keeps_broader_block(tmp_path):
+    block = ['||example.com^', '||ads.example.net^', 'www.example.org']
+    allow = ['@@||sub.example.com^', '@@www.example.com^', '@@||cdn.ads.example.net^']
+    domains, counts = collect(tmp_path, block, allow)
+    assert domains == ['+.ads.example.net', '+.example.com', 'www.example.org']
+    assert counts['allowlist_removed'] == 0
+
+def test_broader_allow_removes_narrower_block(tmp_path):
+    block = ['||ads.example.com^', 'www.example.com', '.cdn.example.com', 'ads*.example.com', 'example.org']
+    domains, counts = collect(tmp_path, block, ['@@||example.com^'])
+    assert domains == ['example.org']
+    assert counts['allowlist_removed'] == 4
+
+def random_lines(rng, prefixes, size):
+    labels = ['a', 'b', 'ads', 'cdn', 'x*']
+    return [rng.choice(prefixes) + '.'.join(rng.choice(labels) for _ in range(rng.randint(1, 3))) + rng.choice(['.com', '.net']) + rng.choice(['', '^'])
+            for _ in range(size)]
+
+@pytest.mark.parametrize('prune', [True, False])
+def test_external_collect_matches_memory(tmp_path, prune):
+    rng = random.Random(20240614)
+    for i in range(10):
+        block = random_lines(rng, ['', '||', '.'], rng.randint(1, 300))
+        allow = random_lines(rng, ['@@', '@@||'], rng.randint(1, 30))
+        expected, expected_counts = collect(tmp_path / f'memory{i}', block, allow, prune=prune)
+        builder, rule, sources = make_builder(tmp_path / f'external{i}', block, allow, prune=prune, memory_budget=256)
+        domains, counts = builder.collect_external(rule, sources)
+        try:
+            assert list(domains) == expected
+        finally:
+            domains.close()
+        assert counts == expected_counts
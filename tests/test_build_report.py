@@ -0,0 +1,76 @@
+import cProfile
+import os
+import pstats
+import threading
+
+import pytest
+
+import build_report
+from build_report import BuildReport
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+def test_profiles_main_thread_stages(tmp_path):
+    report = BuildReport({'path': str(tmp_path / 'report.json'), 'profile_dir': str(tmp_path / 'prof')})
+    def worker():
+        # 其他线程中的阶段只计时，不启动 profiler
+        with report.stage('assemble'):
+            busy(20000)
+    with report.stage('fetch'):
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        with report.stage('dedup'):
+            busy(20000)
+            with report.stage('dedup'):
+                busy(100)
+        for thread in threads:
+            thread.join()
+    with report.stage('fetch'):
+        busy(100)
+    report.write()
+    assert sorted(os.listdir(tmp_path / 'prof')) == ['dedup.prof', 'fetch.prof']
+    assert report.stages['assemble']['calls'] == 3
+    assert report.stages['fetch']['calls'] == 2
+    stats = pstats.Stats(str(tmp_path / 'prof' / 'dedup.prof'))
+    assert any(func[2] == 'busy' for func in stats.stats)
+
+def test_skips_stage_when_another_profiler_is_active(tmp_path, monkeypatch, capsys):
+    class ActiveProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError('Another profiling tool is already active')
+    monkeypatch.setattr(build_report.cProfile, 'Profile', ActiveProfile)
+    report = BuildReport({'path': str(tmp_path / 'report.json'), 'profile_dir': str(tmp_path / 'prof')})
+    with report.stage('fetch'):
+        with report.stage('dedup'):
+            busy(100)
+    report.write()
+    assert report.stages['dedup']['calls'] == 1
+    assert not os.path.exists(tmp_path / 'prof')
+    assert 'Skipped profiling stage fetch' in capsys.readouterr().out
+
+@pytest.mark.skipif(not build_report.reset_hwm(), reason='VmHWM cannot be reset on this platform')
+def test_stage_peak_is_per_stage(tmp_path):
+    # 后一个阶段的峰值不能包含前一个阶段已经释放的内存
+    report = BuildReport({'path': str(tmp_path / 'report.json')})
+    size = 128 * 1024 * 1024
+    with report.stage('dedup'):
+        block = b'x' * size
+        del block
+    with report.stage('emit'):
+        busy(100)
+    dedup = report.stages['dedup']['peak_rss_bytes']
+    emit = report.stages['emit']['peak_rss_bytes']
+    assert dedup - emit > size // 2
+    assert report.to_dict()['peak_rss_bytes'] >= dedup
+
+def test_nested_stage_peaks(tmp_path):
+    report = BuildReport({'path': str(tmp_path / 'report.json')})
+    with report.stage('fetch'):
+        with report.stage('dedup'):
+            busy(100)
+    if report._stage_peaks:
+        assert report.stages['fetch']['peak_rss_bytes'] >= report.stages['dedup']['peak_rss_bytes']
+    else:
+        assert 'peak_rss_bytes' not in report.stages['fetch']
@@ -0,0 +1,47 @@
+import io
+import random
+
+import pytest
+import yaml
+
+from generate_list import QuotedDumper, read_clash_payload, write_clash_payload
+
+# write_clash_payload 必须与原来的 yaml.dump(..., Dumper=QuotedDumper) 输出逐字节一致
+
+def dump_reference(domains):
+    return yaml.dump({'payload': domains}, Dumper=QuotedDumper, sort_keys=False, allow_unicode=True)
+
+def dump_streaming(domains):
+    f = io.StringIO()
+    count = write_clash_payload(f, iter(domains))
+    assert count == len(domains)
+    return f.getvalue()
+
+@pytest.mark.parametrize('domains', [
+    [],
+    ['example.com', '+.example.com', '.example.com', '*.example.com', 'ad*.example.com'],
+    ["it's.example.com", "''", "'", "a''b"],
+    ['with space.com', ' leading', 'trailing ', '\ttab', 'a  b'],
+    ['ctrl\x00.com', 'bell\x07', 'esc\x1b[0m', 'del\x7f', 'nel\x85', 'line\u2028sep', 'bom\ufeff', 'nonchar\uffff', 'edge\ud7ff'],
+    ['emoji\U0001F600.com', 'cjk中文.com', 'math\U0001D400', 'private\U000F0000'],
+    ['', '-', '#comment', ': colon', '- dash', '"double"', 'back\\slash', 'percent%20'],
+])
+def test_matches_quoted_dumper(domains):
+    assert dump_streaming(domains) == dump_reference(domains)
+
+def test_empty_payload():
+    assert dump_streaming([]) == "'payload': []\n"
+
+def test_random_strings_match_quoted_dumper():
+    rng = random.Random(20240601)
+    alphabet = 'abc.-*+\'" \t\x01\x1f\x7f\x85\xa0\u2028\ud7ff\ufffe\U0001F600'
+    for _ in range(200):
+        domains = [''.join(rng.choice(alphabet) for _ in range(rng.randrange(0, 12))) for _ in range(rng.randrange(1, 20))]
+        assert dump_streaming(domains) == dump_reference(domains)
+
+def test_read_back(tmp_path):
+    domains = ['+.example.com', "it's.example.com", 'with space.com', 'emoji\U0001F600.com']
+    path = tmp_path / 'list.yaml'
+    with open(path, 'w', encoding='utf-8') as f:
+        write_clash_payload(f, domains)
+    assert read_clash_payload(str(path)) == set(domains)
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from domain_trie import DomainTrie, entry_from_sort_key, iter_prune_sorted, prune_redundant, sort_key
+
+# +. 规则覆盖的条目会从发布的 Clash 与 AdGuard Home 列表中删除，覆盖判断必须按标签对齐且保守
+
+def prune_sorted(entries):
+    return list(iter_prune_sorted(sorted({sort_key(entry) for entry in entries})))
+
+@pytest.mark.parametrize('entry', ['example.com', 'www.example.com', '.example.com', '.a.example.com',
+                                   '+.a.example.com', 'a.b.example.com', 'ad*.example.com'])
+def test_suffix_covers_subdomains(entry):
+    trie = DomainTrie()
+    trie.add('+.example.com')
+    assert trie.covers(entry)
+    assert trie.covers(entry, strict=True)
+
+def test_strict_self_coverage():
+    trie = DomainTrie()
+    trie.add('+.example.com')
+    assert trie.covers('+.example.com')
+    assert not trie.covers('+.example.com', strict=True)
+    assert prune_redundant(['+.example.com']) == (['+.example.com'], 0)
+
+@pytest.mark.parametrize('entry', ['examplex.com', 'xexample.com', 'example.com.cn', 'example.org', 'com'])
+def test_label_aligned(entry):
+    trie = DomainTrie()
+    trie.add('+.example.com')
+    assert not trie.covers(entry)
+    assert prune_redundant(['+.example.com', entry])[0] == ['+.example.com', entry]
+    assert entry in prune_sorted(['+.example.com', entry])
+
+def test_exact_and_dot_entries_cover_only_themselves():
+    trie = DomainTrie()
+    trie.add('example.com')
+    assert not trie.add('.example.org')
+    assert trie.covers('example.com')
+    assert not trie.covers('www.example.com')
+    assert not trie.covers('+.example.com')
+    assert not trie.covers('www.example.org')
+
+def test_wildcard_labels():
+    # 含通配符的 +. 规则不进入后缀树，它下面的条目不会被删除
+    entries = ['+.*.example.com', 'a.x.example.com', '+.ads*.example.net', 'ads1.example.net', 'a.*.example.org', '+.x.*.example.org']
+    assert prune_redundant(entries) == (entries, 0)
+    assert prune_sorted(entries) == sorted(entries, key=sort_key)
+    # 通配符标签之上的 +. 规则仍然覆盖整个子树
+    kept, pruned = prune_redundant(['+.example.com', 'a.*.example.com', '+.*.example.com'])
+    assert kept == ['+.example.com']
+    assert pruned == 2
+
+def test_prune_redundant_keeps_order():
+    entries = ['www.example.com', 'other.com', '+.example.com', '.example.com', '+.sub.example.com', 'example.com']
+    assert prune_redundant(entries) == (['other.com', '+.example.com'], 4)
+
+def test_sort_key_round_trip():
+    for entry in ['example.com', '+.example.com', '.example.com', 'a*.b.example.com', 'localhost']:
+        assert entry_from_sort_key(sort_key(entry)) == entry
+
+def test_iter_prune_sorted_matches_prune_redundant():
+    rng = random.Random(20240613)
+    labels = ['a', 'b', 'ab', 'com', 'x*', '*', 'ex', 'exa']
+    for _ in range(500):
+        entries = [rng.choice(['', '+.', '.']) + '.'.join(rng.choice(labels) for _ in range(rng.randint(1, 4)))
+                   for _ in range(rng.randint(1, 40))]
+        unique = sorted(set(entries))
+        kept, pruned = prune_redundant(unique)
+        streamed = prune_sorted(unique)
+        assert sorted(streamed) == sorted(kept), entries
+        assert len(unique) - len(streamed) == pruned
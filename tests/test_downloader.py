@@ -0,0 +1,142 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from build_report import BuildReport
+from generate_list import Downloader, collect_domains
+from source_cache import SourceCache
+
+# Downloader 对本地 http.server 下载：5xx 按退避重试、同一主机的并发数受 per_host 限制、
+# 响应先后不影响合并顺序、重试用尽后返回空结果或上一次缓存的内容
+
+RULE_TYPE = 'domain'
+KEY = 'domain-v1'
+
+class Upstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), UpstreamHandler)
+        self.lock = threading.Lock()
+        self.requests = {}      # 路径 -> 每次请求的时间
+        self.failures = {}      # 路径 -> 还要返回 503 的次数
+        self.delays = {}        # 路径 -> 响应前等待的秒数
+        self.bodies = {}        # 路径 -> 响应内容
+        self.active = 0
+        self.max_active = 0
+        self.finished = []
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.setdefault(self.path, []).append(time.monotonic())
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            failures = server.failures.get(self.path, 0)
+            if failures:
+                server.failures[self.path] = failures - 1
+        time.sleep(server.delays.get(self.path, 0))
+        # 在发送响应之前记录完成，客户端收到响应后立即发起的请求不会被算作并发
+        with server.lock:
+            server.active -= 1
+            server.finished.append(self.path)
+        body = server.bodies.get(self.path)
+        if failures or body is None:
+            self.send_response(503 if failures else 500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_retries_5xx_with_backoff(upstream):
+    upstream.failures['/flaky.txt'] = 3
+    upstream.bodies['/flaky.txt'] = 'a.example.com\nb.example.com\n'
+    downloader = Downloader({'retries': 3, 'backoff': 0.1})
+    url = upstream.url('/flaky.txt')
+    result = downloader.download(url, [{'type': RULE_TYPE, 'url': url}])
+    assert result['empty'] is False
+    assert result['domains'][KEY] == {'a.example.com', 'b.example.com'}
+    times = upstream.requests['/flaky.txt']
+    assert len(times) == 4
+    # urllib3 第一次重试不等待，之后按 backoff * 2^(n-1) 递增
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert gaps[1] >= 0.2 * 0.9
+    assert gaps[2] >= 0.4 * 0.9
+    assert downloader.report.sources[url]['status'] == 'downloaded'
+
+def test_per_host_limit(upstream):
+    urls = []
+    for i in range(8):
+        path = f'/list{i}.txt'
+        upstream.bodies[path] = f'host{i}.example.com\n'
+        upstream.delays[path] = 0.2
+        urls.append(upstream.url(path))
+    downloader = Downloader({'workers': 8, 'per_host': 2, 'retries': 0})
+    sources = downloader.fetch_all([{'type': RULE_TYPE, 'url': urls}])
+    assert upstream.max_active == 2
+    assert all(sources[url]['domains'][KEY] == {f'host{i}.example.com'} for i, url in enumerate(urls))
+
+def test_merge_order_independent_of_arrival(upstream):
+    # 前面的上游响应更慢，完成顺序与配置顺序相反
+    urls = []
+    for i in range(4):
+        path = f'/part{i}.txt'
+        upstream.bodies[path] = f'shared.example.com\npart{i}.example.com\n'
+        upstream.delays[path] = 0.1 * (4 - i)
+        urls.append(upstream.url(path))
+    rules = [{'type': RULE_TYPE, 'url': urls[:2]}, {'type': RULE_TYPE, 'url': urls[2:]}]
+    downloader = Downloader({'workers': 4, 'per_host': 4, 'retries': 0})
+    sources = downloader.fetch_all(rules)
+    assert upstream.finished == [f'/part{i}.txt' for i in reversed(range(4))]
+    assert list(sources) == urls
+    serial = Downloader({'workers': 1, 'retries': 0}).fetch_all(rules)
+    for rule in rules:
+        assert collect_domains(rule, sources, None) == collect_domains(rule, serial, None)
+    assert collect_domains(rules[0], sources, None) == {'shared.example.com', 'part0.example.com', 'part1.example.com'}
+
+def test_gives_up_after_retries(upstream):
+    upstream.failures['/down.txt'] = 100
+    downloader = Downloader({'retries': 2, 'backoff': 0})
+    url = upstream.url('/down.txt')
+    result = downloader.download(url, [{'type': RULE_TYPE, 'url': url}])
+    assert result == {'url': url, 'not_modified': False, 'empty': True, 'domains': {KEY: set()}}
+    assert len(upstream.requests['/down.txt']) == 3
+    assert downloader.report.sources[url]['status'] == 'error'
+
+def test_falls_back_to_cached_copy(upstream, tmp_path):
+    upstream.bodies['/list.txt'] = 'cached.example.com\n'
+    url = upstream.url('/list.txt')
+    rules = [{'type': RULE_TYPE, 'url': url}]
+    cache = SourceCache({'path': str(tmp_path / 'cache')})
+    assert Downloader({'retries': 0}, cache=cache).download(url, rules)['domains'][KEY] == {'cached.example.com'}
+    upstream.failures['/list.txt'] = 100
+    report = BuildReport()
+    downloader = Downloader({'retries': 1, 'backoff': 0}, cache=cache, report=report)
+    result = downloader.download(url, rules)
+    assert result == {'url': url, 'not_modified': True, 'empty': False, 'domains': None}
+    assert report.sources[url]['status'] == 'cached'
+    assert collect_domains(rules[0], {url: result}, cache) == {'cached.example.com'}
@@ -0,0 +1,179 @@
+import io
+import random
+
+import pytest
+
+from decode_adblock import AdblockRuleDecoder, Rule
+
+# emit_rules 一次遍历写出所有目标，各目标的输出必须与原来逐个目标的转换函数完全相同
+
+CLASH_NAMES = {'HOST': 'DOMAIN', 'HOST-SUFFIX': 'DOMAIN-SUFFIX', 'HOST-KEYWORD': 'DOMAIN-KEYWORD'}
+
+def new_uniq(ignore_case):
+    seen = set()
+    def uniq(find_str):
+        if ignore_case:
+            find_str = find_str.lower()
+        if find_str in seen:
+            return False
+        seen.add(find_str)
+        return True
+    return uniq
+
+def unbound_reference(ruleset, unbound_target_dns='8.8.8.8', ignore_case=False):
+    # 原 convert_rule_to_unbound 的冻结副本，不要修改
+    rejection_ruleset = ''
+    forward_ruleset = ''
+    uniq = new_uniq(ignore_case)
+    for i in ruleset:
+        if i['domain'] == '':
+            continue
+        if i['prefer'] == 'HOST-SUFFIX' or i['prefer'] == 'HOST' and uniq(i['domain']):
+            if i['action'] == 'REJECT':
+                rejection_ruleset += 'local-zone: "' + i['domain'] + '" refuse\n'
+            else:
+                forward_ruleset += 'forward-zone:\n\tname: "' + i['domain'] + '."\n' + unbound_target_dns + '\n'
+    return {
+        'rejection': rejection_ruleset,
+        'forward': forward_ruleset
+    }
+
+def quantumult_reference(ruleset, ignore_case=False):
+    # 原 convert_rule_to_quantumult 的冻结副本，不要修改
+    hosts_ruleset = ''
+    regex_rejection_ruleset = ''
+    uniq = new_uniq(ignore_case)
+    for i in ruleset:
+        if i['prefer'] == 'HOST-SUFFIX' or i['prefer'] == 'HOST-KEYWORD' or i['prefer'] == 'HOST':
+            if i['domain'] == '':
+                continue
+            if uniq(i['domain']):
+                hosts_ruleset += i['prefer'] + ',' + i['domain'] + ',' + i['action'] + '\n'
+        elif i['prefer'] == 'REGEX':
+            if i['action'] != 'REJECT':
+                continue
+            if i['regex'] == '':
+                continue
+            regex_rejection_ruleset += i['regex'] + '\n'
+    return {
+        'hosts': hosts_ruleset,
+        'regex_rejection': regex_rejection_ruleset
+    }
+
+def clash_reference(ruleset, ignore_case=False):
+    # 原 convert_rule_to_clash 的冻结副本，不要修改
+    file_header = 'payload:\n'
+    clash_action_lines = {}
+    uniq = new_uniq(ignore_case)
+    for i in ruleset:
+        if i['prefer'] == 'HOST-SUFFIX' or i['prefer'] == 'HOST-KEYWORD' or i['prefer'] == 'HOST':
+            if i['domain'] == '':
+                continue
+            if uniq(i['domain']):
+                try:
+                    lines = clash_action_lines[i['action'].lower()]
+                except KeyError:
+                    lines = clash_action_lines[i['action'].lower()] = [file_header]
+                lines.append('  - ' + CLASH_NAMES[i['prefer']] + ',' + i['domain'] + '\n')
+    return {action: ''.join(lines) for action, lines in clash_action_lines.items()}
+
+def random_ruleset(rng, size):
+    domains = ['example.com', 'Example.com', 'ads.example.com', 'cdn.example.net', 'a', '']
+    regexes = ['^ads', 'track\\d+', '']
+    ruleset = []
+    for _ in range(size):
+        prefer = rng.choice(['HOST', 'HOST-SUFFIX', 'HOST-KEYWORD', 'REGEX', 'USER-AGENT'])
+        action = rng.choice(['REJECT', 'REJECT', 'DIRECT', 'PROXY'])
+        regex = rng.choice(regexes) if prefer == 'REGEX' else None
+        rule = Rule(rng.choice(domains), regex, prefer, action)
+        ruleset.append(dict(rule) if rng.random() < 0.3 else rule)
+    return ruleset
+
+def decoded_ruleset(rng, size):
+    pieces = ['||ads.example.com^', '||Ads.example.com^', 'example.org', '@@||ok.example.com^', '/banner\\d+/',
+              '||track*.example.net^', 'example.com##.ad', '|https://x.example.com/path', '||cdn.example.com^$third-party']
+    text = '\n'.join(rng.choice(pieces) for _ in range(size))
+    return AdblockRuleDecoder().decode_adblock_rule(text)
+
+def emit_all(decoder, ruleset, unbound_target_dns='8.8.8.8'):
+    targets = {name: io.StringIO() for name in ('unbound_rejection', 'unbound_forward', 'quantumult_hosts', 'quantumult_regex', 'adguard')}
+    clash_files = {}
+    def open_action(action_name):
+        clash_files[action_name] = io.StringIO()
+        return clash_files[action_name]
+    counts = decoder.emit_rules(ruleset, dict(targets, clash=open_action), unbound_target_dns=unbound_target_dns)
+    outputs = {name: f.getvalue() for name, f in targets.items()}
+    outputs['clash'] = {action: f.getvalue() for action, f in clash_files.items()}
+    return outputs, counts
+
+@pytest.mark.parametrize('ignore_case', [False, True])
+@pytest.mark.parametrize('seed', range(4))
+def test_emit_rules_matches_old_converters(seed, ignore_case):
+    rng = random.Random(20240615 + seed)
+    ruleset = random_ruleset(rng, rng.randint(0, 400)) if seed % 2 else decoded_ruleset(rng, rng.randint(0, 400))
+    decoder = AdblockRuleDecoder(uniq_ignore_case=ignore_case)
+    outputs, counts = emit_all(decoder, ruleset, unbound_target_dns='1.1.1.1')
+    unbound = unbound_reference(ruleset, '1.1.1.1', ignore_case)
+    quantumult = quantumult_reference(ruleset, ignore_case)
+    clash = clash_reference(ruleset, ignore_case)
+    assert outputs['unbound_rejection'] == unbound['rejection']
+    assert outputs['unbound_forward'] == unbound['forward']
+    assert outputs['quantumult_hosts'] == quantumult['hosts']
+    assert outputs['quantumult_regex'] == quantumult['regex_rejection']
+    assert outputs['clash'] == clash
+    assert counts['quantumult_hosts'] == quantumult['hosts'].count('\n')
+    assert counts['clash'] == sum(text.count('\n') - 1 for text in clash.values())
+    # 旧的转换函数现在由 emit_rules 实现，仍然返回相同的结果
+    assert decoder.convert_rule_to_unbound(ruleset, '1.1.1.1') == unbound
+    assert decoder.convert_rule_to_quantumult(ruleset) == quantumult
+    assert decoder.convert_rule_to_clash(ruleset) == clash
+
+def test_uniq_state_is_reset_per_call():
+    # 去重状态只在一次 emit_rules 内有效，同一个实例重复转换、不同实例之间的结果都相同
+    rng = random.Random(20240616)
+    ruleset = random_ruleset(rng, 200)
+    decoder = AdblockRuleDecoder()
+    first = emit_all(decoder, ruleset)
+    assert emit_all(decoder, ruleset) == first
+    assert emit_all(AdblockRuleDecoder(), ruleset) == first
+    assert decoder.convert_rule_to_clash(ruleset) == decoder.convert_rule_to_clash(ruleset) == first[0]['clash']
+
+def test_adguard_output():
+    ruleset = [
+        Rule('ads.example.com', None, 'HOST-SUFFIX', 'REJECT'),
+        Rule('ads.example.com', None, 'HOST', 'REJECT'),
+        Rule('x.example.com', None, 'HOST', 'REJECT'),
+        Rule('track', None, 'HOST-KEYWORD', 'REJECT'),
+        Rule('ok.example.com', None, 'HOST-SUFFIX', 'DIRECT'),
+        Rule('', None, 'HOST', 'REJECT'),
+        Rule('', '^banner\\d+', 'REGEX', 'REJECT'),
+        Rule('', 'allowed/', 'REGEX', 'DIRECT'),
+        Rule('', '', 'REGEX', 'REJECT'),
+        Rule('example.com', None, 'USER-AGENT', 'REJECT'),
+    ]
+    decoder = AdblockRuleDecoder()
+    expected = ('||ads.example.com^\n'
+                '|x.example.com^\n'
+                '*track*\n'
+                '@@||ok.example.com^\n'
+                '/^banner\\d+/\n'
+                '@@/allowed//\n')
+    assert decoder.convert_rule_to_adguard(ruleset) == expected
+    outputs, counts = emit_all(decoder, ruleset)
+    assert outputs['adguard'] == expected
+    assert counts['adguard'] == 6
+
+def test_decoded_rules_to_adguard():
+    text = '||ads.example.com^\n@@||ok.example.com^\nexample.org\n/banner\\d+/'
+    decoder = AdblockRuleDecoder()
+    lines = decoder.convert_rule_to_adguard(decoder.decode_adblock_rule(text)).splitlines()
+    assert '||ads.example.com^' in lines
+    assert '@@||ok.example.com^' in lines
+    assert any(line.startswith('/') and line.endswith('/') for line in lines)
+
+def test_only_given_targets_are_written():
+    rules = [Rule('ads.example.com', None, 'HOST-SUFFIX', 'REJECT')]
+    adguard = io.StringIO()
+    assert AdblockRuleDecoder().emit_rules(rules, {'adguard': adguard}) == {'adguard': 1}
+    with pytest.raises(ValueError):
+        AdblockRuleDecoder().emit_rules(rules, {'surge': io.StringIO()})
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+import decode_adblock
+from decode_adblock import AdblockRuleDecoder
+
+# decode_hosts_rule 改用正则后，输出必须与原来逐字符的状态机完全相同
+
+def decode_hosts_reference(rules_list, action_type='HOST-SUFFIX', default_action='REJECT'):
+    # 原 decode_hosts_rule 的冻结副本，不要修改
+    now_rule_string = ''
+    rules = []
+    ignore_this_line = False
+    space = False
+    ip_path = False
+    for rule_char in rules_list:
+        if rule_char == '\n':
+            if now_rule_string != '':
+                rules.append({'domain': now_rule_string, 'regex': None, 'prefer': action_type, 'action': default_action})
+                now_rule_string = ''
+            ignore_this_line = False
+            space = False
+            ip_path = False
+            now_rule_string = ''
+            continue
+        if ignore_this_line or rule_char == '\r':
+            continue
+        if rule_char == '#':
+            ignore_this_line = True
+            continue
+        if ip_path == False and now_rule_string == '':
+            if rule_char != ' ' and rule_char != '\t':
+                ip_path = True
+            continue
+        if ip_path == True and rule_char == ' ' or rule_char == '\t':
+            if space == False:
+                space = True
+            elif now_rule_string != '':
+                ignore_this_line = True
+            continue
+        if space:
+            now_rule_string += rule_char
+    if now_rule_string != '':
+        rules.append({'domain': now_rule_string, 'regex': None, 'prefer': action_type, 'action': default_action})
+        now_rule_string = ''
+    return rules
+
+def as_dicts(rules):
+    return [dict(rule) for rule in rules]
+
+@pytest.mark.parametrize('text', [
+    '',
+    '0.0.0.0 example.com',
+    '0.0.0.0 example.com\n127.0.0.1\tlocalhost\n',
+    '  0.0.0.0   example.com   # comment\n',
+    '# 0.0.0.0 example.com\n0.0.0.0 #example.com\n#\n',
+    '0.0.0.0 a.com b.com\n0.0.0.0\t\tc.com\t\n',
+    '0.0.0.0 example.com\r\n0.0.0.0 exa\rmple.org\r',
+    '0.0.0.0 ex#ample.com\n0.0.0.0#x example.net\n',
+    '0.0.0.0\vexample.com\n0.0.0.0 exa\vmple.com\n\v 0.0.0.0 b.com',
+    '0.0.0.0\n\n   \n\t\n0.0.0.0 ',
+])
+def test_matches_state_machine(text):
+    decoder = AdblockRuleDecoder()
+    assert as_dicts(decoder.decode_hosts_rule(text)) == decode_hosts_reference(text)
+
+def test_random_input_matches_state_machine():
+    rng = random.Random(20240608)
+    pieces = ['0.0.0.0', '127.0.0.1', '::1', 'example.com', 'a', 'b.c', '-', ' ', '  ', '\t', '\r\n', '\n', '\r', '#', '\v', '\x0c', '中文']
+    decoder = AdblockRuleDecoder()
+    for _ in range(2000):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randrange(0, 30)))
+        expected = decode_hosts_reference(text, 'DOMAIN', 'DIRECT')
+        assert as_dicts(decoder.decode_hosts_rule(text, action_type='DOMAIN', default_action='DIRECT')) == expected, repr(text)
+
+def test_iter_batches_match_state_machine(monkeypatch):
+    # 分批处理时批次边界不能改变结果
+    monkeypatch.setattr(decode_adblock, 'HOSTS_BATCH_LINES', 3)
+    rng = random.Random(20240609)
+    pieces = ['0.0.0.0', ' ', '\t', 'example.com', 'b.c', '#', '\r', '\v', '\n']
+    decoder = AdblockRuleDecoder()
+    for _ in range(500):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randrange(0, 40)))
+        assert as_dicts(decoder.iter_decode_hosts_rule(text.split('\n'))) == decode_hosts_reference(text), repr(text)
@@ -0,0 +1,150 @@
+import os
+import random
+
+import pytest
+
+import generate_list
+from build_report import BuildReport
+from generate_list import (RuleBuilder, rule_input_hash, write_clash_payload, write_domain_diff,
+                           write_sorted_domain_diff)
+from source_cache import SourceCache
+
+# 输入没有变化时跳过重新生成；上游内容、规则配置或引用的白名单配置变化时必须重新生成
+# 两种增量写法对同样的输入写出完全相同的 .diff
+
+BLOCK_URL = 'https://example.com/block.txt'
+ALLOW_URL = 'https://example.com/allow.txt'
+
+def write_body(cache, url, lines):
+    body = cache.body_writer(url)
+    for line in lines:
+        body.write(line)
+    body.close()
+
+def make_rules():
+    return {
+        'block': {'name': 'block', 'type': 'adblock', 'url': BLOCK_URL, 'file_prefix': 'block',
+                  'exclude_action': 'IGNORE', 'allowlist': 'allow'},
+        'allow': {'name': 'allow', 'type': 'adblock', 'url': ALLOW_URL},
+    }
+
+def make_sources():
+    return {url: {'url': url, 'not_modified': True, 'empty': False, 'domains': None} for url in (BLOCK_URL, ALLOW_URL)}
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('generated_rules')
+    cache = SourceCache({'path': str(tmp_path / 'cache')})
+    write_body(cache, BLOCK_URL, ['||ads.example.com^', 'track.example.net', '||ok.example.org^'])
+    write_body(cache, ALLOW_URL, ['@@||ok.example.org^'])
+    return cache
+
+def test_input_hash(workdir):
+    cache = workdir
+    rules = make_rules()
+    inputs = rule_input_hash(rules['block'], rules, cache)
+    assert inputs is not None
+    assert rule_input_hash(make_rules()['block'], make_rules(), cache) == inputs
+    # 规则配置、白名单配置、白名单上游内容以及生成器版本都是输入的一部分
+    changed = make_rules()
+    changed['block']['exclude_action'] = 'DIRECT'
+    assert rule_input_hash(changed['block'], changed, cache) != inputs
+    changed = make_rules()
+    changed['allow']['type'] = 'domain'
+    assert rule_input_hash(changed['block'], changed, cache) != inputs
+    write_body(cache, ALLOW_URL, ['@@||ok.example.org^', '@@||other.example.org^'])
+    assert rule_input_hash(rules['block'], rules, cache) != inputs
+
+def test_input_hash_depends_on_generator_version(workdir, monkeypatch):
+    rules = make_rules()
+    inputs = rule_input_hash(rules['block'], rules, workdir)
+    monkeypatch.setattr(generate_list, 'GENERATOR_VERSION', generate_list.GENERATOR_VERSION + 1)
+    assert rule_input_hash(rules['block'], rules, workdir) != inputs
+
+def test_input_hash_without_cached_source(workdir):
+    rules = make_rules()
+    rules['block']['url'] = [BLOCK_URL, 'https://example.com/missing.txt']
+    assert rule_input_hash(rules['block'], rules, workdir) is None
+
+def build(cache, rules, previous, sort_options=None):
+    report = BuildReport()
+    builder = RuleBuilder(cache, None, rules, report=report, sort_options=sort_options)
+    entry, built = builder.update(rules['block'], make_sources(), previous)
+    return entry, built, report.rules['block']['status']
+
+def read_output(name):
+    with open(os.path.join('generated_rules', name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+def test_unchanged_inputs_skip_rebuild(workdir):
+    entry, built, status = build(workdir, make_rules(), None)
+    assert built and status == 'built'
+    assert 'block-clash_reject_hostnames.yaml' in entry['outputs']
+    assert "'+.ok.example.org'" not in read_output('block-clash_reject_hostnames.yaml')
+    mtimes = {name: os.path.getmtime(os.path.join('generated_rules', name)) for name in entry['outputs']}
+    again, built, status = build(workdir, make_rules(), entry)
+    assert not built and status == 'unchanged'
+    assert again is entry
+    assert {name: os.path.getmtime(os.path.join('generated_rules', name)) for name in entry['outputs']} == mtimes
+
+def test_missing_output_forces_rebuild(workdir):
+    entry, _, _ = build(workdir, make_rules(), None)
+    os.remove(os.path.join('generated_rules', entry['outputs'][0]))
+    _, built, status = build(workdir, make_rules(), entry)
+    assert built and status == 'built'
+    assert os.path.exists(os.path.join('generated_rules', entry['outputs'][0]))
+
+@pytest.mark.parametrize('memory_budget', [0, 256])
+def test_changed_source_forces_rebuild(workdir, memory_budget):
+    sort_options = {'memory_budget': memory_budget}
+    entry, _, _ = build(workdir, make_rules(), None, sort_options)
+    write_body(workdir, BLOCK_URL, ['||ads.example.com^', '||new.example.com^', '||ok.example.org^'])
+    updated, built, status = build(workdir, make_rules(), entry, sort_options)
+    assert built and status == 'built'
+    assert updated['inputs'] != entry['inputs']
+    assert updated['diff'] == {'file': 'block-domains.diff', 'base': entry['inputs'], 'added': 1, 'removed': 1}
+    assert read_output('block-domains.diff') == (f"# base: {entry['inputs']}\n# target: {updated['inputs']}\n"
+                                                 "-track.example.net\n++.new.example.com\n")
+    assert "'+.new.example.com'" in read_output('block-clash_reject_hostnames.yaml')
+
+def test_changed_config_forces_rebuild(workdir):
+    entry, _, _ = build(workdir, make_rules(), None)
+    rules = make_rules()
+    rules['block']['allowlist'] = []
+    updated, built, status = build(workdir, rules, entry)
+    assert built and status == 'built'
+    assert updated['diff']['added'] == 1
+    assert "'+.ok.example.org'" in read_output('block-clash_reject_hostnames.yaml')
+    # 没有变化的上一次条目不会再生成增量，旧的 .diff 被删除
+    rules['block']['exclude_action'] = 'DIRECT'
+    _, built, _ = build(workdir, rules, None)
+    assert built
+    assert not os.path.exists(os.path.join('generated_rules', 'block-domains.diff'))
+
+def random_domains(rng, size):
+    return {rng.choice(['', '+.', '.']) + f'd{rng.randrange(size * 2)}.example{rng.randrange(3)}.com' for _ in range(size)}
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sorted_diff_matches_set_diff(workdir, seed):
+    rng = random.Random(20240618 + seed)
+    previous = random_domains(rng, rng.randint(0, 300))
+    domains = sorted(random_domains(rng, rng.randint(0, 300)) | set(rng.sample(sorted(previous), len(previous) // 2)))
+    previous_path = os.path.join('generated_rules', 'previous.yaml')
+    with open(previous_path, 'w', encoding='utf-8') as f:
+        write_clash_payload(f, sorted(previous))
+    sorted_diff = write_sorted_domain_diff('sorted.diff', previous_path, iter(domains), 'base-hash', 'target-hash')
+    set_diff = write_domain_diff('set.diff', previous, domains, 'base-hash', 'target-hash')
+    assert sorted_diff == dict(set_diff, file='sorted.diff')
+    assert read_output('sorted.diff') == read_output('set.diff')
+    lines = read_output('set.diff').splitlines()
+    assert lines[:2] == ['# base: base-hash', '# target: target-hash']
+    assert sorted(lines[2:]) == sorted([f'-{d}' for d in previous - set(domains)] + [f'+{d}' for d in set(domains) - previous])
+
+def test_sorted_diff_falls_back(workdir):
+    previous_path = os.path.join('generated_rules', 'previous.yaml')
+    assert write_sorted_domain_diff('sorted.diff', previous_path, [], 'b', 't') is None
+    with open(previous_path, 'w', encoding='utf-8') as f:
+        f.write("payload:\n  - 'b.example.com'\n  - 'a.example.com'\n")
+    assert write_sorted_domain_diff('sorted.diff', previous_path, ['a.example.com'], 'b', 't') is None
+    assert not os.path.exists(os.path.join('generated_rules', 'sorted.diff'))
@@ -0,0 +1,108 @@
+import fnmatch
+import io
+import random
+
+import pytest
+
+from lookup import LookupIndex, normalize_name, run_queries
+
+# LookupIndex 的结果必须与逐条比较所有条目的暴力匹配一致：
+# 非通配符条目按 精确条目 > 同名 +. 条目 > 最长的父域名 的顺序命中，都不匹配时才使用通配符条目
+
+LABELS = ['a', 'b', 'ab', 'com', 'net', 'x-1']
+WILDCARD_LABELS = ['*', 'a*', '*b', 'x*1']
+
+def entry_matches(entry, name):
+    # 按标签逐个比较，* 只在标签内匹配
+    if entry.startswith('+.'):
+        pattern, min_extra = entry[2:], 0
+    elif entry.startswith('.'):
+        pattern, min_extra = entry[1:], 1
+    else:
+        pattern, min_extra = entry, None
+    pattern_labels = pattern.split('.')
+    name_labels = name.split('.')
+    extra = len(name_labels) - len(pattern_labels)
+    if extra < 0 or (min_extra is None and extra != 0) or (min_extra is not None and extra < min_extra):
+        return False
+    return all(fnmatch.fnmatchcase(label, pattern_label) for label, pattern_label in zip(name_labels[extra:], pattern_labels))
+
+def brute_force(added, name):
+    # 返回 (期望的命中, 可接受的命中集合)；通配符之间的先后不作要求
+    first_source = {}
+    for entry, source in added:
+        first_source.setdefault(entry, source)
+    matching = [entry for entry in first_source if entry_matches(entry, name)]
+    plain = [entry for entry in matching if '*' not in entry]
+    if name in plain:
+        return (name, first_source[name]), None
+    if '+.' + name in plain:
+        return ('+.' + name, first_source['+.' + name]), None
+    if plain:
+        longest = max(len(entry.lstrip('+.')) for entry in plain)
+        entry = next(entry for entry in plain if len(entry.lstrip('+.')) == longest)
+        return (entry, first_source[entry]), None
+    if matching:
+        return None, {(entry, first_source[entry]) for entry in matching}
+    return None, None
+
+def random_name(rng, labels, count):
+    return '.'.join(rng.choice(labels) for _ in range(count))
+
+@pytest.mark.parametrize('seed', range(6))
+def test_matches_brute_force(seed):
+    rng = random.Random(20240617 + seed)
+    added = []
+    index = LookupIndex()
+    for source in ('one', 'two'):
+        for _ in range(rng.randint(1, 40)):
+            labels = LABELS + WILDCARD_LABELS if rng.random() < 0.3 else LABELS
+            entry = rng.choice(['', '+.', '.']) + random_name(rng, labels, rng.randint(1, 3))
+            index.add(entry, source)
+            added.append((entry, source))
+    names = [random_name(rng, LABELS, rng.randint(1, 4)) for _ in range(3000)]
+    results = index.lookup_many(names)
+    for name, hit in zip(names, results):
+        expected, wildcard_hits = brute_force(added, name)
+        if wildcard_hits is not None:
+            assert hit in wildcard_hits, name
+        else:
+            assert hit == expected, name
+        assert index.lookup(name) == hit
+
+def test_priority():
+    index = LookupIndex()
+    index.add('+.example.com', 'suffix')
+    index.add('.example.com', 'dot')
+    index.add('example.com', 'exact')
+    index.add('+.ads.example.com', 'ads')
+    index.add('*.example.com', 'wildcard')
+    index.add('+.com', 'tld')
+    assert index.lookup('example.com') == ('example.com', 'exact')
+    assert index.lookup('www.example.com') == ('+.example.com', 'suffix')
+    assert index.lookup('x.ads.example.com') == ('+.ads.example.com', 'ads')
+    assert index.lookup('other.com') == ('+.com', 'tld')
+    assert index.lookup('examplex.com') == ('+.com', 'tld')
+    assert index.lookup('example.org') is None
+
+def test_label_aligned_wildcards():
+    index = LookupIndex()
+    index.add('ad*.example.com', 'list')
+    index.add('.*.cdn.net', 'list')
+    assert index.lookup('ads.example.com') == ('ad*.example.com', 'list')
+    assert index.lookup('ad.example.com') == ('ad*.example.com', 'list')
+    assert index.lookup('x.ads.example.com') is None
+    assert index.lookup('ads.xexample.com') is None
+    assert index.lookup('a.b.cdn.net') == ('.*.cdn.net', 'list')
+    assert index.lookup('b.cdn.net') is None
+
+def test_run_queries():
+    index = LookupIndex()
+    index.add_list(['+.ads.example.com', 'track.example.net'], 'list')
+    output = io.StringIO()
+    lines = ['WWW.Ads.Example.com. A 0.0.0.0\n', '\n', 'example.net\n', 'track.example.net\n']
+    assert run_queries(index, lines, output) == (3, 2)
+    assert output.getvalue() == ('www.ads.example.com\tblocked\t+.ads.example.com\tlist\n'
+                                 'example.net\tallowed\t\t\n'
+                                 'track.example.net\tblocked\ttrack.example.net\tlist\n')
+    assert normalize_name('  ') is None
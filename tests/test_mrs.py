@@ -0,0 +1,134 @@
+import os
+import random
+import subprocess
+import types
+
+import pytest
+import yaml
+
+import mrs
+
+# fixtures/mrs 中每个 .yaml 与同名 .mrs 是一组夹具，.mrs 应与 mihomo 的输出一致，可以这样重新生成：
+#   mihomo convert-ruleset domain yaml wildcard.yaml wildcard.mrs
+# 目前的 .mrs 由 mihomo DomainTrie.Insert/Foreach、NewDomainSet 与 WriteBin 的 Go 逐行移植生成；
+# 设置 MIHOMO=<mihomo 可执行文件> 时 test_matches_mihomo 用真正的 mihomo 重新生成并比较（CI 中运行）
+# zstd 压缩的结果与实现有关，因此比较的是解压后的内容
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'mrs')
+FIXTURES = sorted(name[:-5] for name in os.listdir(FIXTURE_DIR) if name.endswith('.yaml'))
+
+MIHOMO = os.environ.get('MIHOMO')
+
+pytestmark = pytest.mark.skipif(not mrs.zstd_available(), reason='zstd support is unavailable')
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, f'{name}.yaml'), encoding='utf-8') as f:
+        payload = yaml.safe_load(f)['payload']
+    with open(os.path.join(FIXTURE_DIR, f'{name}.mrs'), 'rb') as f:
+        expected = mrs._decompress(f.read())
+    return payload, expected
+
+@pytest.mark.parametrize('name', FIXTURES)
+def test_encode_matches_fixture(name):
+    payload, expected = load_fixture(name)
+    assert mrs.encode_mrs(payload) == expected
+
+@pytest.mark.parametrize('name', FIXTURES)
+def test_external_sort_matches_fixture(name):
+    payload, expected = load_fixture(name)
+    assert mrs.encode_mrs(payload, memory_budget=256) == expected
+
+def test_fixtures_cover_entry_forms():
+    payload = [domain for name in FIXTURES for domain in load_fixture(name)[0]]
+    assert any(domain.startswith('+.') for domain in payload)
+    assert any(domain.startswith('.') for domain in payload)
+    assert any(domain.startswith('*') for domain in payload)
+
+def test_count_field():
+    # count 是成功插入的条目数：重复条目计入，无效条目（空标签、结尾的点）不计入
+    payload, expected = load_fixture('overlap')
+    assert int.from_bytes(expected[5:13], 'big') == 8
+    assert mrs.domain_keys(payload)[1] == 8
+    assert mrs.encode_mrs(payload)[5:13] == expected[5:13]
+
+def test_wildcard_keys(tmp_path):
+    path = str(tmp_path / 'wildcard.mrs')
+    assert mrs.write_mrs(path, ['+.example.com', '.example.org', '*.example.net']) == 3
+    count, keys = mrs.read_mrs(path)
+    assert count == 3
+    assert keys == {'example.com', '+.example.com', '+.example.org', '*.example.net'}
+
+def test_empty_rule_set():
+    assert mrs.encode_mrs(['', 'bad..example.com', 'trailing.']) is None
+
+def test_random_round_trip():
+    # 超过 64 个节点时位数组跨越多个 uint64，外部排序与内存排序的结果必须相同
+    rng = random.Random(20240607)
+    labels = ['a', 'b', 'ab', 'cdn', 'x1', 'é', '中文']
+    for _ in range(50):
+        domains = [rng.choice(['', '+.', '.', '*.']) + '.'.join(rng.choice(labels) for _ in range(rng.randint(1, 4)))
+                   for _ in range(rng.randint(1, 120))]
+        keys, count = mrs.domain_keys(domains)
+        payload = mrs.encode_mrs(domains)
+        assert mrs.encode_mrs(domains, memory_budget=512) == payload
+        assert int.from_bytes(payload[5:13], 'big') == count
+        domain_set = payload[21:]
+        leaves_length = int.from_bytes(domain_set[1:9], 'big')
+        leaves = [int.from_bytes(domain_set[9 + i * 8:17 + i * 8], 'big') for i in range(leaves_length)]
+        offset = 9 + leaves_length * 8
+        bitmap_length = int.from_bytes(domain_set[offset:offset + 8], 'big')
+        bitmap = [int.from_bytes(domain_set[offset + 8 + i * 8:offset + 16 + i * 8], 'big') for i in range(bitmap_length)]
+        offset += 8 + bitmap_length * 8
+        labels_bytes = domain_set[offset + 8:]
+        assert mrs.decode_domain_set(leaves, bitmap, labels_bytes) == keys
+
+def test_compacted_levels_match(monkeypatch):
+    # 各层的位串分多次打包后再拼接，结果必须与一次打包相同
+    rng = random.Random(20240611)
+    domains = [f'{rng.choice(["", "+.", "."])}a{rng.randrange(5000)}.b{rng.randrange(50)}.com' for _ in range(2000)]
+    expected = mrs.encode_mrs(domains)
+    monkeypatch.setattr(mrs, 'COMPACT_BITS', 24)
+    monkeypatch.setattr(mrs, 'COMPACT_INTERVAL', 3)
+    assert mrs.encode_mrs(domains) == expected
+    assert mrs.encode_mrs(domains, memory_budget=4096) == expected
+
+def random_payload(seed, size):
+    rng = random.Random(seed)
+    labels = ['ads', 'cdn', 'x1', 'a', 'b-c', 'bücher', '中文', '*']
+    return [rng.choice(['', '+.', '.', '*.']) + '.'.join(rng.choice(labels) for _ in range(rng.randint(1, 3))) + rng.choice(['.com', '.net', '.cn'])
+            for _ in range(size)]
+
+@pytest.mark.skipif(not MIHOMO, reason='set MIHOMO to a mihomo binary to compare with its output')
+@pytest.mark.parametrize('name', FIXTURES + ['random-large'])
+def test_matches_mihomo(name, tmp_path):
+    # 用真正的 mihomo convert-ruleset 生成 .mrs，与 encode_mrs 以及提交的夹具逐字节比较
+    if name == 'random-large':
+        payload = random_payload(20240612, 20000)
+        source = str(tmp_path / 'random.yaml')
+        with open(source, 'w', encoding='utf-8') as f:
+            yaml.dump({'payload': payload}, f, allow_unicode=True)
+        expected = None
+    else:
+        payload, expected = load_fixture(name)
+        source = os.path.join(FIXTURE_DIR, f'{name}.yaml')
+    output = str(tmp_path / 'mihomo.mrs')
+    subprocess.run([MIHOMO, 'convert-ruleset', 'domain', 'yaml', source, output], check=True)
+    actual = mrs.read_payload(output)
+    assert mrs.encode_mrs(payload) == actual
+    if expected is not None:
+        assert expected == actual
+
+def test_stdlib_zstd_module(tmp_path, monkeypatch):
+    # compression.zstd (Python 3.14+) 只能使用一次性的 compress/decompress
+    zstandard = pytest.importorskip('zstandard')
+    class Unusable:
+        def __init__(self, *args, **kwargs):
+            raise AssertionError('the stdlib module must use compress/decompress')
+    stdlib = types.ModuleType('compression.zstd')
+    stdlib.compress = zstandard.compress
+    stdlib.decompress = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    stdlib.ZstdCompressor = stdlib.ZstdDecompressor = Unusable
+    monkeypatch.setattr(mrs, 'zstd', stdlib)
+    path = str(tmp_path / 'stdlib.mrs')
+    assert mrs.write_mrs(path, ['+.example.com', 'example.org']) == 2
+    assert mrs.read_mrs(path) == (2, {'example.com', '+.example.com', 'example.org'})
@@ -0,0 +1,31 @@
+import threading
+
+import decode_adblock
+from decode_adblock import AdblockRuleDecoder, process_pool_context
+from generate_list import LineParser
+
+# 进程池在下载线程中启动，不能使用 fork
+
+LINES = [f'||ads{i}.example.com^' for i in range(500)] + ['! comment', '', '0.0.0.0 host.example.com', '@@||ok.example.com^']
+
+def test_context_does_not_fork():
+    assert process_pool_context().get_start_method() in ('forkserver', 'spawn')
+
+def test_line_parser_pool_started_from_thread():
+    rules = [{'type': 'adblock'}]
+    expected = LineParser({'workers': 1}).parse(LINES, rules)
+    parser = LineParser({'workers': 2, 'chunk_lines': 50})
+    result = {}
+    try:
+        thread = threading.Thread(target=lambda: result.update(parser.parse(LINES, rules)))
+        thread.start()
+        thread.join()
+    finally:
+        parser.close()
+    assert result == expected
+
+def test_decode_adblock_pool_matches_serial(monkeypatch):
+    monkeypatch.setattr(decode_adblock, 'DECODE_CHUNK_LINES', 100)
+    text = '\n'.join(LINES)
+    expected = [dict(rule) for rule in AdblockRuleDecoder().decode_adblock_rule(text)]
+    assert [dict(rule) for rule in AdblockRuleDecoder().decode_adblock_rule(text, workers=2)] == expected
@@ -0,0 +1,77 @@
+import random
+import re
+
+import pytest
+
+from regex_set import RegexSet, consolidate, tokenize, verify_equivalence
+
+# 合并后的正则集合必须与逐个匹配原始正则的结果相同；无法安全合并的正则必须原样保留
+
+UNMERGEABLE = [
+    r'(a)\1',
+    r'(a)(?:b\1)',
+    r'(?P<x>ad)(?P=x)',
+    r'(?P<n>x)y',
+    r'(?i)ADS',
+    r'ad(?i:S)x',
+    r'ads|track',
+    r'^ads|cdn$',
+    r'a*+b',
+    r'a++',
+    r'a?+c',
+    r'a{2}+b',
+    r'(?>ab)c',
+    r'(?(1)a|b)',
+]
+
+@pytest.mark.parametrize('pattern', UNMERGEABLE)
+def test_unmergeable_patterns_are_kept(pattern):
+    assert tokenize(pattern) is None
+    combined, kept = consolidate([pattern, 'ads', 'adx'])
+    assert kept == [pattern]
+    assert combined == ['ad(?:s|x)']
+
+def test_nested_alternation_is_merged():
+    combined, kept = consolidate(['(?:a|b)c', '(?:a|b)d'])
+    assert kept == []
+    assert combined == ['(?:a|b)(?:c|d)']
+
+def test_prefix_of_other_pattern():
+    # ads 能匹配时 adserver 必然能匹配，合并后只保留 ads
+    assert consolidate(['adserver', 'ads', 'adx'])[0] == ['ad(?:s|x)']
+
+def random_pattern(rng):
+    pieces = ['a', 'b', 'ad', 's', 'x', r'\.', r'\d', '[ab]', '[^a]', '.', '(?:a|b)', '/']
+    quantifiers = ['', '', '', '*', '+', '?', '{2}', '{1,2}', '*?']
+    pattern = ''.join(rng.choice(pieces) + rng.choice(quantifiers) for _ in range(rng.randint(1, 4)))
+    pattern = rng.choice(['', '', '^']) + pattern + rng.choice(['', '', '$'])
+    kind = rng.random()
+    if kind < 0.08:
+        pattern = '(a)' + pattern + r'\1'
+    elif kind < 0.16:
+        pattern = '(?i)' + pattern.upper()
+    elif kind < 0.24:
+        pattern = pattern + '|' + rng.choice(pieces)
+    elif kind < 0.32:
+        pattern = rng.choice(['a', 'b', '[ab]']) + rng.choice(['*+', '++', '?+', '{1,2}+']) + pattern
+    elif kind < 0.36:
+        pattern = '(?>' + pattern + ')b'
+    return pattern
+
+@pytest.mark.parametrize('seed', range(8))
+def test_random_patterns_match_like_originals(seed):
+    rng = random.Random(20240610 + seed)
+    patterns = [random_pattern(rng) for _ in range(rng.randint(20, 200))]
+    regex_set = RegexSet(patterns, chunk_size=rng.choice([7, 50, 500]))
+    for pattern in regex_set.kept:
+        assert tokenize(pattern) is None or not is_valid(pattern)
+    alphabet = ['a', 'b', 's', 'x', 'ad', 'A', 'S', '.', '/', '0', '7', '-', 'ads', 'aab']
+    samples = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 8))) for _ in range(3000)]
+    assert verify_equivalence(patterns, regex_set, samples) == []
+
+def is_valid(pattern):
+    try:
+        re.compile(pattern)
+    except re.error:
+        return False
+    return True
@@ -0,0 +1,158 @@
+import gzip
+import http.client
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from service import RefreshService, RuleFiles, accepts_gzip, start_server
+
+# 服务模式：HTTP 处理器的 ETag/304、按 Accept-Encoding 返回 gzip、未知路径 404，
+# 以及轮询发现上游变化后重新生成并提供新的内容
+
+@pytest.mark.parametrize('header, expected', [
+    ('', False),
+    ('gzip', True),
+    ('br, GZIP', True),
+    ('deflate, gzip;q=0.5', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.000', False),
+    ('*', True),
+    ('identity', False),
+    ('x-gzip', False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
+
+def request(server, path, method='GET', headers=None):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    try:
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+@pytest.fixture
+def rule_files(tmp_path):
+    directory = tmp_path / 'generated_rules'
+    directory.mkdir()
+    (directory / 'list.yaml').write_text("payload:\n  - '+.example.com'\n", encoding='utf-8')
+    (directory / 'list.yaml.tmp').write_text('partial', encoding='utf-8')
+    files = RuleFiles(str(directory))
+    assert files.refresh() == 1
+    return files
+
+@pytest.fixture
+def server(rule_files):
+    server = start_server(rule_files, '127.0.0.1', 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_etag_and_not_modified(server):
+    status, headers, body = request(server, '/list.yaml')
+    assert status == 200
+    assert body == b"payload:\n  - '+.example.com'\n"
+    assert headers['Content-Type'] == 'text/yaml; charset=utf-8'
+    assert 'Content-Encoding' not in headers
+    etag = headers['ETag']
+    status, headers, body = request(server, '/list.yaml', headers={'If-None-Match': etag})
+    assert status == 304
+    assert body == b''
+    assert headers['ETag'] == etag
+    # 另一种编码的 ETag 与弱 ETag 同样返回 304
+    gzip_etag = request(server, '/list.yaml', headers={'Accept-Encoding': 'gzip'})[1]['ETag']
+    assert gzip_etag != etag
+    assert request(server, '/list.yaml', headers={'If-None-Match': gzip_etag})[0] == 304
+    assert request(server, '/list.yaml', headers={'If-None-Match': f'"other", W/{etag}'})[0] == 304
+    assert request(server, '/list.yaml', headers={'If-None-Match': '"other"'})[0] == 200
+
+def test_gzip_only_when_accepted(server):
+    plain = request(server, '/list.yaml')[2]
+    status, headers, body = request(server, '/list.yaml', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert int(headers['Content-Length']) == len(body)
+    assert gzip.decompress(body) == plain
+    status, headers, body = request(server, '/list.yaml', headers={'Accept-Encoding': 'gzip;q=0, br'})
+    assert 'Content-Encoding' not in headers
+    assert body == plain
+    status, headers, body = request(server, '/list.yaml', method='HEAD', headers={'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert body == b''
+
+@pytest.mark.parametrize('path', ['/missing.yaml', '/list.yaml.tmp', '/', '/../list.yaml', '/sub/list.yaml'])
+def test_unknown_path(server, path):
+    assert request(server, path)[0] == 404
+
+def test_refresh_picks_up_changes(server, rule_files):
+    etag = request(server, '/list.yaml')[1]['ETag']
+    path = os.path.join(rule_files.directory, 'list.yaml')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("payload:\n  - '+.example.org'\n  - '+.example.net'\n")
+    assert rule_files.refresh() == 1
+    assert rule_files.refresh() == 0
+    status, headers, body = request(server, '/list.yaml', headers={'If-None-Match': etag})
+    assert status == 200
+    assert headers['ETag'] != etag
+    assert b'example.org' in body
+    os.remove(path)
+    rule_files.refresh()
+    assert request(server, '/list.yaml')[0] == 404
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        data = self.server.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    server.body = '||ads.example.com^\n'
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_poll_serves_updated_content(tmp_path, monkeypatch, upstream):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('generated_rules')
+    url = f'http://127.0.0.1:{upstream.server_address[1]}/list.txt'
+    config = {
+        'rules_list': [{'name': 'block', 'type': 'adblock', 'url': url, 'file_prefix': 'block', 'exclude_action': 'IGNORE'}],
+        'cache': {'path': str(tmp_path / 'cache')},
+        'download': {'retries': 0},
+    }
+    service = RefreshService(config, {'port': 0}, report_options={'path': str(tmp_path / 'report.json')})
+    assert service.poll([url]) == ['block']
+    server = start_server(service.rule_files, '127.0.0.1', 0)
+    try:
+        status, headers, body = request(server, '/block-clash_reject_hostnames.yaml')
+        assert status == 200
+        assert b"'+.ads.example.com'" in body
+        etag = headers['ETag']
+        # 上游没有变化时不重新生成，内容与 ETag 不变
+        assert service.poll([url]) == []
+        assert request(server, '/block-clash_reject_hostnames.yaml', headers={'If-None-Match': etag})[0] == 304
+        upstream.body = '||ads.example.com^\n||tracker.example.net^\n'
+        assert service.poll([url]) == ['block']
+        status, headers, body = request(server, '/block-clash_reject_hostnames.yaml', headers={'If-None-Match': etag})
+        assert status == 200
+        assert headers['ETag'] != etag
+        assert b"'+.tracker.example.net'" in body
+        status, headers, body = request(server, '/block-rejection-unbound_dns.conf', headers={'Accept-Encoding': 'gzip'})
+        assert gzip.decompress(body) == b'||ads.example.com^\n||tracker.example.net^'
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.line_parser.close()
@@ -0,0 +1,46 @@
+from external_sort import ExternalSorter
+from generate_list import LineParser, load_source_domains, store_parsed_domains
+from source_cache import SourceCache
+
+LINES = ['||b.example.com^', '||a.example.com^', '||b.example.com^', '! comment', '||c.example.com^']
+RULE = {'type': 'adblock'}
+
+def make_cache(tmp_path, url):
+    cache = SourceCache({'path': str(tmp_path / 'cache')})
+    body = cache.body_writer(url)
+    for line in LINES:
+        body.write(line)
+    body.close()
+    return cache
+
+def test_load_domains_streams_lines(tmp_path):
+    url = 'https://example.com/list.txt'
+    cache = make_cache(tmp_path, url)
+    assert cache.load_domains(url, 'adblock-v1') is None
+    # 只以 \n 分行，\r 与 U+2028 等字符原样保留
+    domains = {'a.example.com', 'line\u2028sep', 'cr\rname'}
+    cache.store_domains(url, 'adblock-v1', domains)
+    loaded = cache.load_domains(url, 'adblock-v1')
+    assert not isinstance(loaded, list)
+    assert list(loaded) == sorted(domains)
+
+def test_external_parse_results_go_through_the_cache(tmp_path):
+    url = 'https://example.com/list.txt'
+    cache = make_cache(tmp_path, url)
+    expected = LineParser().parse(LINES, [RULE])['adblock-v1']
+    parser = LineParser({'chunk_lines': 2}, sort_options={'memory_budget': 64, 'tmp_dir': str(tmp_path)})
+    domains = parser.parse(LINES, [RULE])['adblock-v1']
+    assert isinstance(domains, ExternalSorter)
+    store_parsed_domains(cache, url, 'adblock-v1', domains)
+    assert domains.runs == []
+    assert list(cache.load_domains(url, 'adblock-v1')) == sorted(expected)
+    # 没有解析结果时从缓存的原始内容重新解析，外部排序的结果同样经由缓存文件读出
+    cache.store_domains(url, 'adblock-v1', [])
+    source = {'url': url, 'not_modified': True, 'empty': False, 'domains': None}
+    assert list(load_source_domains(source, RULE, cache, parser)) == []
+    for path in (tmp_path / 'cache').iterdir():
+        for name in path.iterdir():
+            if name.suffix == '.domains':
+                name.unlink()
+    assert list(load_source_domains(source, RULE, cache, parser)) == sorted(expected)
+    assert [name for name in tmp_path.iterdir() if name.suffix == '.run'] == []